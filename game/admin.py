@@ -1,8 +1,8 @@
 from django.contrib import admin
 
-from .models import Game, SubGame
+from .models import Game, Move
 
 
 
 admin.site.register(Game)
-admin.site.register(SubGame)
+admin.site.register(Move)
@@ -0,0 +1,189 @@
+"""
+Room affinity: every room is served by one worker, so its state stays hot
+in that worker's memory.
+
+Rooms are mapped to workers with a consistent-hash ring over ROOM_WORKERS;
+a worker joining or leaving only moves the rooms whose ring points change
+hands.  RoomAffinityMiddleware wraps the game consumer: a connection that
+reaches a worker not owning its room is forwarded to the owner, with the
+worker relaying frames both ways, or, with ROOM_AFFINITY_MODE = 'redirect',
+the client is told to connect to the owner itself.
+
+A forwarded socket carries the X-Room-Forwarded header, so the owner serves
+it even if the rings disagree for a moment.  Its value is an HMAC of the
+room code under ROOM_FORWARD_KEY (which defaults to one derived from
+SECRET_KEY); a header a client made up is ignored, and the socket is sent
+to the owner like any other.
+
+When the membership changes (``manage.py rebalance_rooms``), every worker
+hands the rooms it lost over to their new owners; see
+RoomRegistry.rebalance.
+
+Settings:
+    ROOM_WORKERS        worker name -> base URL ('ws://host:port'); empty
+                        turns affinity off and every worker serves every room.
+    ROOM_WORKER_NAME    this worker's name in ROOM_WORKERS.
+    ROOM_AFFINITY_MODE  'forward' or 'redirect'.
+    ROOM_FORWARD_KEY    key of the X-Room-Forwarded header, shared by the workers.
+"""
+import asyncio
+import bisect
+import hashlib
+import hmac
+import json
+import threading
+
+from django.conf import settings
+
+# Virtual nodes per worker; more spread the rooms more evenly.
+DEFAULT_REPLICAS = 64
+WORKERS_GROUP = 'room_workers'
+FORWARDED_HEADER = 'X-Room-Forwarded'
+# Close code telling the client to connect again, to the URL it was given.
+REDIRECT_CLOSE_CODE = 4000
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    def __init__(self, workers=None, replicas=DEFAULT_REPLICAS):
+        self.workers = dict(workers or {})
+        points = sorted((ring_hash(f"{name}#{i}"), name) for name in self.workers for i in range(replicas))
+        self.hashes = [point for point, name in points]
+        self.names = [name for point, name in points]
+
+    def owner(self, room_code):
+        "The name of the worker serving the room, or None on an empty ring."
+        if not self.hashes:
+            return None
+        return self.names[bisect.bisect(self.hashes, ring_hash(room_code)) % len(self.hashes)]
+
+
+_ring = None
+_ring_lock = threading.Lock()
+
+
+def get_ring():
+    global _ring
+    with _ring_lock:
+        if _ring is None:
+            _ring = HashRing(getattr(settings, 'ROOM_WORKERS', {}))
+        return _ring
+
+
+def set_workers(workers):
+    "Replaces the membership; the caller rebalances the rooms."
+    global _ring
+    with _ring_lock:
+        _ring = HashRing(workers)
+
+
+def local_worker():
+    return getattr(settings, 'ROOM_WORKER_NAME', '')
+
+
+def remote_url(room_code):
+    "Base URL of the worker owning the room, or None when it is this one or affinity is off."
+    ring = get_ring()
+    owner = ring.owner(room_code)
+    if owner is None or owner == local_worker():
+        return None
+    return ring.workers[owner]
+
+
+def forward_key():
+    key = getattr(settings, 'ROOM_FORWARD_KEY', None) or f"room-forward:{settings.SECRET_KEY}"
+    return hashlib.sha256(key.encode()).digest()
+
+
+def forwarded_value(room_code):
+    "The X-Room-Forwarded header of a socket forwarded to the room's owner."
+    return hmac.new(forward_key(), room_code.encode(), hashlib.sha256).hexdigest()
+
+
+def is_forwarded(scope, room_code):
+    "Whether the socket was forwarded by a worker, which signed the header for the room."
+    name = FORWARDED_HEADER.lower().encode()
+    expected = forwarded_value(room_code).encode()
+    return any(header == name and hmac.compare_digest(value, expected)
+               for header, value in scope.get('headers', ()))
+
+
+def redirect_message(url, seat=None):
+    "Tells the client to connect again, to ``url`` or else to the same URL, keeping ``seat``."
+    return json.dumps({'type': 'redirect', 'url': url, 'seat': seat})
+
+
+class RoomAffinityMiddleware:
+    "Sends game sockets to the worker owning their room."
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        room_code = scope['url_route']['kwargs']['room_code']
+        # A forwarded socket stays, even if the rings disagree for a moment.
+        url = None if is_forwarded(scope, room_code) else remote_url(room_code)
+        if url is None:
+            return await self.inner(scope, receive, send)
+        target = url + scope['path']
+        if scope.get('query_string'):
+            target += '?' + scope['query_string'].decode()
+        if getattr(settings, 'ROOM_AFFINITY_MODE', 'forward') == 'redirect':
+            await redirect(receive, send, target)
+        else:
+            await forward(scope, receive, send, target, room_code)
+
+
+async def redirect(receive, send, target):
+    await receive()  # websocket.connect
+    await send({'type': 'websocket.accept'})
+    await send({'type': 'websocket.send', 'text': redirect_message(target)})
+    await send({'type': 'websocket.close', 'code': REDIRECT_CLOSE_CODE})
+
+
+async def forward(scope, receive, send, target, room_code):
+    "Relays the socket to ``target`` until either side closes."
+    import aiohttp
+
+    await receive()  # websocket.connect
+    headers = {FORWARDED_HEADER: forwarded_value(room_code)}
+    for header, value in scope.get('headers', ()):
+        if header == b'cookie':
+            headers['Cookie'] = value.decode('latin-1')
+    async with aiohttp.ClientSession() as session:
+        try:
+            upstream = await session.ws_connect(target, headers=headers)
+        except aiohttp.ClientError:
+            await send({'type': 'websocket.close', 'code': 1013})  # Try again later
+            return
+        await send({'type': 'websocket.accept'})
+
+        async def relay_down():
+            async for message in upstream:
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    await send({'type': 'websocket.send', 'text': message.data})
+                elif message.type == aiohttp.WSMsgType.BINARY:
+                    await send({'type': 'websocket.send', 'bytes': message.data})
+            await send({'type': 'websocket.close', 'code': upstream.close_code or 1000})
+
+        down = asyncio.create_task(relay_down())
+        try:
+            while not down.done():
+                receiving = asyncio.create_task(receive())
+                await asyncio.wait([receiving, down], return_when=asyncio.FIRST_COMPLETED)
+                if not receiving.done():
+                    receiving.cancel()
+                    break
+                message = receiving.result()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message.get('text') is not None:
+                    await upstream.send_str(message['text'])
+                elif message.get('bytes') is not None:
+                    await upstream.send_bytes(message['bytes'])
+        finally:
+            down.cancel()
+            await upstream.close()
@@ -0,0 +1,213 @@
+"""
+Out-of-process move service for the computer players.
+
+Positions are sent to a pool of worker processes so a deep search never holds
+a request thread or the ASGI event loop.  Every request has a deadline; when
+it passes the request is cancelled and the move falls back to GoodPlayer
+computed in the caller, which costs a few table lookups.
+
+Pondering (game.ponder) runs on a pool of its own, of AI_PONDER_MAX_JOBS
+processes, so its searches never hold a worker that a live move is waiting
+for.
+
+Each worker sends the stats of its transposition table back with every
+move; table_stats() gives the latest of each worker, by pool.
+
+Settings:
+    AI_SERVICE_WORKERS  size of the process pool; 0 runs moves in-process.
+    AI_MOVE_TIMEOUT     seconds a move may take before the fallback is used.
+    AI_PONDER_MAX_JOBS  size of the pondering pool.
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+
+from django.conf import settings
+
+from .engine import UltimateBoard
+from .players import GoodPlayer, choose_move, get_player, get_transposition_table
+
+DEFAULT_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+DEFAULT_TIMEOUT = 2.0
+DEFAULT_PONDER_WORKERS = 1
+# Share of the deadline the worker may spend searching; the rest covers
+# process hand-off.
+THINK_SHARE = 0.8
+
+_pool = None
+_ponder_pool = None
+_pool_lock = threading.Lock()
+# Pool name -> worker pid -> the stats of its table sent with its last move.
+_table_stats = {'live': {}, 'ponder': {}}
+
+
+def get_workers():
+    return getattr(settings, 'AI_SERVICE_WORKERS', DEFAULT_WORKERS)
+
+
+def get_timeout():
+    return getattr(settings, 'AI_MOVE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def get_ponder_workers():
+    return getattr(settings, 'AI_PONDER_MAX_JOBS', DEFAULT_PONDER_WORKERS)
+
+
+def position_of(engine):
+    "Picklable form of an engine position."
+    return ([engine.sub_board(i) for i in range(9)], engine.active, engine.turn, engine.winner)
+
+
+def _init_worker(table_bytes):
+    import game.players
+    from .transposition import TranspositionTable
+    game.players._transposition_table = TranspositionTable(table_bytes)
+
+
+def compute_move(player_name, position, remaining=None, budget=None):
+    "Runs in a worker: returns the player's (main_index, sub_index)."
+    boards, active_index, next_player, winner = position
+    engine = UltimateBoard.from_strings(boards, active_index=active_index,
+                                        next_player=next_player, winner=winner)
+    player = get_player(player_name)
+    if budget is not None and hasattr(player, 'max_think_time'):
+        player.max_think_time = min(player.max_think_time, budget)
+    return choose_move(player, engine, remaining)
+
+
+def search(player_name, position, remaining=None, budget=None):
+    "Runs in a worker: compute_move, with the worker's pid and table stats."
+    move = compute_move(player_name, position, remaining, budget)
+    return move, os.getpid(), get_transposition_table().stats()
+
+
+def fallback_move(engine):
+    return choose_move(GoodPlayer(), engine)
+
+
+def _new_pool(workers):
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(get_transposition_table().memory_bytes,),
+    )
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = _new_pool(get_workers())
+        return _pool
+
+
+def get_ponder_pool():
+    global _ponder_pool
+    with _pool_lock:
+        if _ponder_pool is None:
+            _ponder_pool = _new_pool(max(1, get_ponder_workers()))
+        return _ponder_pool
+
+
+def shutdown():
+    global _pool, _ponder_pool
+    with _pool_lock:
+        for pool in (_pool, _ponder_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        _pool = _ponder_pool = None
+        for workers in _table_stats.values():
+            workers.clear()
+
+
+atexit.register(shutdown)
+
+
+def table_stats():
+    "The transposition table stats of each worker, by pool and pid."
+    with _pool_lock:
+        stats = {name: dict(workers) for name, workers in _table_stats.items()}
+    if not get_workers():
+        stats['live'] = {os.getpid(): get_transposition_table().stats()}
+    return stats
+
+
+class MoveFuture(concurrent.futures.Future):
+    """
+    The move of a search() running on a pool: keeps the table stats sent
+    with it and resolves to the move alone.  Cancelling it cancels the
+    search, and fails the same way once the search is running.
+    """
+
+    def __init__(self, search_future, pool_name):
+        super().__init__()
+        self.search_future = search_future
+        self.pool_name = pool_name
+        search_future.add_done_callback(self._relay)
+
+    def cancel(self):
+        return self.search_future.cancel()
+
+    def _relay(self, search_future):
+        if search_future.cancelled():
+            super().cancel()
+        elif search_future.exception() is not None:
+            self.set_exception(search_future.exception())
+        else:
+            move, pid, stats = search_future.result()
+            with _pool_lock:
+                _table_stats[self.pool_name][pid] = stats
+            self.set_result(move)
+
+
+def submit_move(player_name, engine, remaining=None, timeout=None):
+    "Queues a move on the pool and returns a concurrent.futures.Future."
+    if timeout is None:
+        timeout = get_timeout()
+    return MoveFuture(get_pool().submit(search, player_name, position_of(engine), remaining,
+                                        timeout * THINK_SHARE), 'live')
+
+
+def submit_ponder(player_name, engine, remaining=None, timeout=None):
+    "submit_move for pondering searches, on their own pool."
+    if timeout is None:
+        timeout = get_timeout()
+    return MoveFuture(get_ponder_pool().submit(search, player_name, position_of(engine), remaining,
+                                               timeout * THINK_SHARE), 'ponder')
+
+
+def request_move(player_name, engine, remaining=None, timeout=None):
+    """
+    Returns the player's (main_index, sub_index), blocking for at most
+    ``timeout`` seconds before falling back to GoodPlayer.
+    """
+    if timeout is None:
+        timeout = get_timeout()
+    if not get_workers():
+        return compute_move(player_name, position_of(engine), remaining, timeout * THINK_SHARE)
+    future = submit_move(player_name, engine, remaining, timeout)
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        future.cancel()
+        return fallback_move(engine)
+
+
+async def request_move_async(player_name, engine, remaining=None, timeout=None):
+    "Awaitable request_move for async views, consumers and other async code."
+    if timeout is None:
+        timeout = get_timeout()
+    if not get_workers():
+        # In-process, the search still must not hold the event loop.
+        return await asyncio.to_thread(compute_move, player_name, position_of(engine), remaining,
+                                       timeout * THINK_SHARE)
+    future = submit_move(player_name, engine, remaining, timeout)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except TimeoutError:
+        future.cancel()
+        return fallback_move(engine)
@@ -0,0 +1,75 @@
+"""
+One timer for every game clock in the process.
+
+A game's clocks are not run second by second: the player to move is charged
+lazily from Game.last_move_time (see Game.clock_remaining), so the only
+moment a clock needs the server is when it falls.  ClockScheduler keeps the
+flag-fall deadlines of the rooms in a heap and a single task sleeps until the
+earliest one, so an idle room costs nothing until its player to move runs
+out of time.
+
+Replacing or cancelling a deadline leaves the old heap entry in place, to be
+skipped when it comes up.
+"""
+import asyncio
+import heapq
+import itertools
+
+from django.utils import timezone
+
+
+class ClockScheduler:
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+        self.counter = itertools.count()
+        self.task = None
+        self.wakeup = None
+        self.fired = 0
+
+    def schedule(self, key, when, callback):
+        """
+        Calls the coroutine function ``callback()`` at ``when``, an aware
+        datetime, instead of what was scheduled for ``key`` before.
+        """
+        self.cancel(key)
+        entry = [when, next(self.counter), key, callback]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+        self._wake()
+
+    def cancel(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry[3] = None
+
+    def deadline(self, key):
+        entry = self.entries.get(key)
+        return entry[0] if entry else None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _wake(self):
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.wakeup = asyncio.Event()
+            self.task = loop.create_task(self._run())
+        self.wakeup.set()
+
+    async def _run(self):
+        while self.entries:
+            while self.heap and self.heap[0][3] is None:
+                heapq.heappop(self.heap)
+            delay = (self.heap[0][0] - timezone.now()).total_seconds()
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            when, count, key, callback = heapq.heappop(self.heap)
+            del self.entries[key]
+            self.fired += 1
+            asyncio.get_running_loop().create_task(callback())
@@ -1,50 +1,67 @@
 import json
 import asyncio
 import aiohttp
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from .models import Game
-from django.contrib.auth.models import User
-from .models import GameHistory
+from .affinity import REDIRECT_CLOSE_CODE, redirect_message
+from .protocol import broadcast_event, encode, negotiate
+from .results import record_game_result
+from .rooms import RoomMoved, game_data, get_registry, sync_data, timeout_event
 
-from django.db import transaction
 from django.utils import timezone
-from datetime import timedelta
 
 class GameConsumer(AsyncWebsocketConsumer):
+    # The room's state lives in the room-state backend (see game.rooms); only
+    # joining a room and recording a result wait on the database.
+    room = None
+    player = None
+    protocol = 1
+    spectator = False
+
     async def connect(self):
         self.room_code = self.scope['url_route']['kwargs']['room_code']
         self.group_name = f"game_{self.room_code}"
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        # Sent by a client connecting again after its room moved worker.
+        self.seat = query.get('seat', [None])[0]
+        # Watchers are sent the room's broadcasts but never take a seat.
+        self.spectator = query.get('watch', [''])[0] == '1'
+        self.protocol = negotiate(self.scope)
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
 
-        self.timer_task = None
-        self.vote_yes = {'X': False, 'O': False}
-        self.vote_no = {'X': False, 'O': False}
+        self.registry = get_registry()
+        self.room = await self.registry.join(self.room_code)
 
-        game = await self.get_or_create_game()
-        player_assigned = await self.assign_player(game)
+        if self.spectator:
+            if self.room.game.state:
+                await self.start_game({})
+            else:
+                await self.send_frame({
+                    'type': 'waiting',
+                    'message': 'Waiting for the players to join'
+                })
+            return
+
+        player_assigned = await self.registry.update(self.room, self.assign_player)
+        await self.registry.flush(self.room)
+        self.player = player_assigned
 
         if not player_assigned:
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 'type': 'error',
                 'message': 'Game is full'
-            }))
+            })
             await self.close()
             return
 
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'player_assignment',
             'player': player_assigned
-        }))
-
-        game = await self.get_game()
-        if game.player_x and game.player_o:
-            if not await self.subgames_exist(game):
-                await self.create_subgames(game)
-                await self.start_timer_loop()
-            game_data = await self.get_game_data()
+        })
 
+        game_data = await self.registry.update(self.room, self.create_subgames)
+        if game_data['player_x'] and game_data['player_o']:
             await self.channel_layer.group_send(self.group_name, {
                 'type': 'start_game',
                 'next_player': game_data['next_player'],
@@ -55,275 +72,221 @@ class GameConsumer(AsyncWebsocketConsumer):
             })
 
         else:
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 'type': 'waiting',
                 'message': 'Waiting for another player to join'
-            }))
+            })
 
     async def disconnect(self, close_code):
-        game = await self.get_game()
-        if game:
-            await self.reset_game(game)
-        if self.timer_task:
-            self.timer_task.cancel()
+        if self.room and not self.spectator:
+            try:
+                await self.registry.update(self.room, self.reset_game)
+            except RoomMoved:
+                pass
+        if self.room:
+            await self.registry.leave(self.room)
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
 
     async def start_game(self, event):
-        game_data = await self.get_game_data()
+        await self.registry.refresh(self.room)
+        game_data = self.room.data()
         current_user = self.scope["user"].username if self.scope["user"].is_authenticated else "Guest"
-        if current_user == game_data['player_x']:
+        if self.spectator:
+            my_player = opponent = None
+        elif current_user == game_data['player_x']:
             my_player = game_data['player_x']
             opponent = game_data['player_o'] or "Waiting..."
         else:
             my_player = game_data['player_o']
             opponent = game_data['player_x'] or "Waiting..."
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'start',
+            'seq': self.room.game.ply,
             'next_player': game_data['next_player'],
             'my_player': my_player,
             'opponent': opponent,
             'time_x': game_data['remaining_x'],  # Send correct remaining time for X
             'time_o': game_data['remaining_o'],  # Send correct remaining time for O
-        }))
+            'server_time': game_data['server_time'],
+            'deadline': game_data['deadline'],
+            # Lets a client that connected again mid-game redraw the board.
+            'cells': self.room.game.state[:90],
+            'active_index': game_data['active_index'],
+        })
 
     async def receive(self, text_data):
         data = json.loads(text_data)
         action = data.get('action')
+        if self.spectator and action not in ('sync', 'state'):
+            await self.send_frame({
+                'type': 'error',
+                'message': 'Spectators cannot play'
+            })
+            return
 
-        if action == 'move':
-            await self.handle_move(data)
-        elif action == 'surrender':
-            await self.handle_surrender(data)
-        elif action == 'replay_vote':
-            await self.handle_vote(data)
-        elif action == 'restart_game':
-            await self.handle_restart()
+        try:
+            if action == 'move':
+                await self.handle_move(data)
+            elif action == 'surrender':
+                await self.handle_surrender(data)
+            elif action == 'replay_vote':
+                await self.handle_vote(data)
+            elif action == 'restart_game':
+                await self.handle_restart()
+            elif action == 'sync':
+                await self.handle_sync(data)
+            elif action == 'state':
+                # The client missed a move; it is sent the whole position.
+                await self.start_game({})
+        except RoomMoved as e:
+            await self.room_moved({'url': e.url})
 
     async def handle_move(self, data):
         main_index = data.get('main_index')
         sub_index = data.get('sub_index')
         player = data.get('player')
-
-        game = await self.get_game()
-        if not game or game.winner:
-            return
-
-        subgame = await self.get_subgame_by_index(game, main_index)
-        if subgame and subgame.winner:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': f"Subgrid {main_index} has already been won by {subgame.winner}."
-            }))
-            return
-
-        try:
-            winner, winning_line = await self.play_move(game, main_index, sub_index, player)
-        except Exception as e:
-            await self.send(text_data=json.dumps({
+        if player != self.player:
+            # apply_move checks the turn; the seat is the socket's own.
+            await self.send_frame({
                 'type': 'error',
-                'message': str(e)
-            }))
+                'message': 'You can only play your own seat'
+            })
             return
 
-        game_data = await self.get_game_data()
-        await self.channel_layer.group_send(
-            self.group_name,
-            {
+        def play(game):
+            # Checked on the room's current game, again on every retry.
+            if game.winner:
+                return None
+            now = timezone.now()
+            flagged = game.check_flag(now)
+            if flagged:
+                # The flag fell before the room's clock timer fired.
+                return timeout_event(flagged, game.winner)
+            subgame = game.get_sub_game(main_index)
+            if subgame and subgame.winner:
+                raise ValueError(f"Subgrid {main_index} has already been won by {subgame.winner}.")
+            winner, winning_line = game.apply_move(main_index, sub_index, player, now=now, persist=False,
+                                                   clocked=True)
+            game_data_after = game_data(game, now)
+            return {
                 'type': 'move',
+                'seq': game.ply,
                 'main_index': main_index,
                 'sub_index': sub_index,
                 'player': player,
-                'next_player': game_data['next_player'],
-                'winner': game_data['winner'],
-                'active_index': game_data['active_index'],
-                'time_x': game_data['time_x'],
-                'time_o': game_data['time_o'],
+                'next_player': game_data_after['next_player'],
+                'winner': game_data_after['winner'],
+                'active_index': game_data_after['active_index'],
+                'time_x': game_data_after['remaining_x'],
+                'time_o': game_data_after['remaining_o'],
+                'server_time': game_data_after['server_time'],
+                'deadline': game_data_after['deadline'],
                 'winning_line': list(winning_line) if winning_line else None,
-                'board_state': game.board,  # Send the current board state
             }
-        )
 
-        if game_data['winner']:
-            await self.record_game_result(game, game_data['winner'])
+        try:
+            event = await self.registry.update(self.room, play)
+        except RoomMoved:
+            raise
+        except Exception as e:
+            await self.send_frame({
+                'type': 'error',
+                'message': str(e)
+            })
+            return
+        if event is None:
+            return
+
+        await self.broadcast(event)
 
-        if not game_data['winner']:
-            await self.start_timer_loop()
+        if event['winner']:
+            # A win, or a loss on time found before the room's clock timer fired.
+            await self.registry.flush(self.room)
+            record_game_result(self.room.game, event['winner'])
 
     async def handle_surrender(self, data):
-        surrendering_player = data.get('player')
+        # Only the socket's own seat can be given up.
+        surrendering_player = self.player
         winner = 'O' if surrendering_player == 'X' else 'X'
 
-        game = await self.get_game()
-        if game:
-            await self.set_game_winner(game, winner)
-        await self.channel_layer.group_send(
-            self.group_name,
-            {
-                'type': 'surrender_game',
-                'winner': winner,
-                'message': f"{surrendering_player} surrendered. {winner} wins!",
-            }
-        )
+        def finish(game):
+            # A win, a flag fall or another surrender may have ended it first.
+            if game.winner:
+                return False
+            game.winner = winner
+            return True
+
+        if not await self.registry.update(self.room, finish):
+            return
+        await self.broadcast({
+            'type': 'surrender',
+            'winner': winner,
+            'message': f"{surrendering_player} surrendered. {winner} wins!",
+        })
 
-        if game:
-            await self.record_game_result(game, winner)
+        await self.registry.flush(self.room)
+        record_game_result(self.room.game, winner)
 
 
     async def handle_vote(self, data):
         player = data.get('from')
         vote = data.get('vote')
 
-        if vote == 'yes':
-            self.vote_yes[player] = True
-        else:
-            self.vote_no[player] = True
+        outcome = await self.registry.vote(self.room, player, vote)
 
-        await self.channel_layer.group_send(self.group_name, {
+        await self.broadcast({
             'type': 'replay_vote',
             'from': player,
             'vote': vote,
         })
 
-        if self.vote_yes['X'] and self.vote_yes['O']:
-            await self.reset_full_game()
-            self.vote_yes = {'X': False, 'O': False}
-            self.vote_no = {'X': False, 'O': False}
-            await self.channel_layer.group_send(self.group_name, {'type': 'restart_game'})
-        elif self.vote_no['X'] or self.vote_no['O']:
-            self.vote_yes = {'X': False, 'O': False}
-            self.vote_no = {'X': False, 'O': False}
+        if outcome == 'restart':
+            await self.send_restart()
 
     async def handle_restart(self):
+        await self.send_restart()
+        await self.registry.clear_votes(self.room)
 
-        game = await self.get_game()
-        if game:
-            await self.reset_full_game()  # Reset game state in the database (calls game.reset_state())
-            # Reset internal vote tracking
-            self.vote_yes = {'X': False, 'O': False}
-            self.vote_no = {'X': False, 'O': False}
-            # Fetch fresh game data after reset
-            game_data = await self.get_game_data()
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    'type': 'restart_game',
-                    'next_player': game_data['next_player'],
-                    'player_x': game_data['player_x'],
-                    'player_o': game_data['player_o'],
-                    'time_x': game_data['remaining_x'],
-                    'time_o': game_data['remaining_o'],
-                }
-            )
-            await self.start_timer_loop()
-
-    async def restart_game(self, event):
-        """
-        Notify the frontend with complete game reset data.
-        """
-        await self.send(text_data=json.dumps({
+    async def send_restart(self):
+        game_data = await self.registry.update(self.room, self.reset_full_game)
+        await self.broadcast({
             'type': 'restart',
-            'next_player': event.get('next_player'),
-            'player_x': event.get('player_x'),
-            'player_o': event.get('player_o'),
-            'time_x': event.get('time_x'),
-            'time_o': event.get('time_o'),
-        }))
-
-    async def start_timer_loop(self):
-        if self.timer_task:
-            self.timer_task.cancel()
-
-        async def countdown():
-            while True:
-                await asyncio.sleep(1)
-                game = await self.get_game()
-                if not game or game.winner:
-                    break
-
-                current = game.next_player
-                await self.decrease_timer(game, current)
-
-                game_data = await self.get_game_data()
-                await self.channel_layer.group_send(self.group_name, {
-                    'type': 'update_timers',
-                    'time_x': game_data['remaining_x'],  # Send updated time for X
-                    'time_o': game_data['remaining_o'],  # Send updated time for O
-                })
+            'next_player': game_data['next_player'],
+            'player_x': game_data['player_x'],
+            'player_o': game_data['player_o'],
+            'time_x': game_data['remaining_x'],
+            'time_o': game_data['remaining_o'],
+            'server_time': game_data['server_time'],
+            'deadline': game_data['deadline'],
+        })
 
-                if game_data['remaining_x'] <= 0:
-                    await self.channel_layer.group_send(self.group_name, {
-                        'type': 'surrender_game',
-                        'winner': 'O',
-                        'message': '⏰ X ran out of time. O wins!',
-                    })
-                    break
-                if game_data['remaining_o'] <= 0:
-                    await self.channel_layer.group_send(self.group_name, {
-                        'type': 'surrender_game',
-                        'winner': 'X',
-                        'message': '⏰ O ran out of time. X wins!',
-                    })
-                    break
-
-        self.timer_task = asyncio.create_task(countdown())
-
-    async def move(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'move',
-            'main_index': event['main_index'],
-            'sub_index': event['sub_index'],
-            'player': event['player'],
-            'next_player': event['next_player'],
-            'winner': event['winner'],
-            'active_index': event['active_index'],
-            'time_x': event['time_x'],
-            'time_o': event['time_o'],
-            'winning_line': event.get('winning_line'),  # <-- pass through
-        }))
-
-    async def surrender_game(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'surrender',
-            'winner': event['winner'],
-            'message': event['message'],
-        }))
-        if self.timer_task:
-            self.timer_task.cancel()
-
-    async def replay_vote(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'replay_vote',
-            'from': event['from'],
-            'vote': event['vote'],
-        }))
-
-    async def update_timers(self, event):
-        # Handler for "update_timers" messages
-        await self.send(text_data=json.dumps({
-            'type': 'timer_update',
-            'time_x': event.get('time_x'),
-            'time_o': event.get('time_o'),
-        }))
-
-    # ---------------------------- Database Helpers ----------------------------
-
-    @database_sync_to_async
-    def get_or_create_game(self):
-        return Game.objects.get_or_create(room_code=self.room_code)[0]
-
-    @database_sync_to_async
-    def get_game(self):
-        try:
-            return Game.objects.get(room_code=self.room_code)
-        except Game.DoesNotExist:
-            return None
+    async def send_frame(self, message):
+        await self.send(text_data=encode(message, self.protocol))
+
+    async def broadcast(self, message):
+        # Encoded here, once; see room_frame.
+        await self.channel_layer.group_send(self.group_name, broadcast_event(message))
+
+    async def room_frame(self, event):
+        # The same text for every socket of the room speaking this version.
+        await self.send(text_data=event['frames'][str(self.protocol)])
+
+    async def handle_sync(self, data):
+        # Sent by the client when it connects and every CLOCK_RESYNC_INTERVAL
+        # seconds after; there are no per-second clock updates.
+        await self.registry.refresh(self.room)
+        await self.send_frame(sync_data(data.get('client_time'), self.room.game))
 
-    @database_sync_to_async
-    def get_subgame_by_index(self, game, main_index):
-        return game.sub_games.filter(index=main_index).first()
+    async def room_moved(self, event):
+        # The client connects again, keeping its seat, and resends a move
+        # that was not broadcast.
+        await self.send(text_data=redirect_message(event['url'] or None, self.player))
+        await self.close(code=REDIRECT_CLOSE_CODE)
+
+    # ------------------------------ Room Changes ------------------------------
+    # Run by RoomRegistry.update on the room's game, possibly more than once.
 
-    @database_sync_to_async
     def assign_player(self, game):
         # If user is authenticated, check if already assigned.
         if self.scope["user"].is_authenticated:
@@ -332,169 +295,41 @@ class GameConsumer(AsyncWebsocketConsumer):
                 return 'X'
             elif game.player_o == username:
                 return 'O'
-        else:
-
-            pass
-
+        elif self.seat == 'X' and game.player_x == "Guest_1":
+            return 'X'
+        elif self.seat == 'O' and game.player_o == "Guest_2":
+            return 'O'
 
         if not game.player_x:
             user_id = self.scope["user"].username if self.scope["user"].is_authenticated else "Guest_1"
             game.player_x = user_id
-            game.save()
             return 'X'
         elif not game.player_o:
             user_id = self.scope["user"].username if self.scope["user"].is_authenticated else "Guest_2"
             game.player_o = user_id
-            game.save()
             return 'O'
 
-        if self.scope["user"].is_authenticated:
-            if game.player_x == self.scope["user"].username:
-                return 'X'
-            elif game.player_o == self.scope["user"].username:
-                return 'O'
         return None
 
-    @database_sync_to_async
+    def create_subgames(self, game):
+        if game.player_x and game.player_o:
+            if not game.sub_games.exists():
+                game.create_subgames(persist=False)
+            elif game.last_move_time is None:
+                # A room from the pool (game.lobby) has its board already.
+                game.last_move_time = timezone.now()
+        return game_data(game)
+
     def reset_game(self, game):
         if game.player_x == self.channel_name:
             game.player_x = None
         elif game.player_o == self.channel_name:
             game.player_o = None
-        game.save()
-
-    @database_sync_to_async
-    def play_move(self, game, main_index, sub_index, symbol=None):
-        sub_game = game.sub_games.filter(index=main_index).first()
-        if not sub_game:
-            raise ValueError("SubGame does not exist")
-
-        winner, winning_line = sub_game.play(sub_index, symbol)
-        game.last_main_index = main_index
-        game.last_sub_index = sub_index
-        game.last_player = symbol
-        if winner:
-            game.board = game.board[:main_index] + winner + game.board[main_index + 1:]
-        elif ' ' not in sub_game.board:
-            game.board = game.board[:main_index] + ' ' + game.board[main_index + 1:]
-        game.set_active_index(sub_index)
-        game.save()
-        game.is_game_over  # Trigger win check
-        return (winner, winning_line)
-
-    @database_sync_to_async
-    def get_game_data(self):
-        game = Game.objects.get(room_code=self.room_code)
-        return {
-            'next_player': game.next_player,
-            'player_x': game.player_x,
-            'player_o': game.player_o,
-            'winner': game.winner,
-            'active_index': game.active_index,
-            'time_x': game.time_x,
-            'time_o': game.time_o,
-            'remaining_x': game.remaining_x,
-            'remaining_o': game.remaining_o,
-        }
-
-    @database_sync_to_async
-    def decrease_timer(self, game, player):
-        if player == 'X' and game.remaining_x > 0:
-            game.remaining_x -= 1
-        elif player == 'O' and game.remaining_o > 0:
-            game.remaining_o -= 1
-        game.save()
-
-    @database_sync_to_async
-    def subgames_exist(self, game):
-        return game.sub_games.exists()
-
-    @database_sync_to_async
-    def create_subgames(self, game):
-        game.create_subgames()
-
-    @database_sync_to_async
-    def reset_full_game(self):
-        game = Game.objects.get(room_code=self.room_code)
-        game.reset_state()
-        game.save()
-
-    @database_sync_to_async
-    def set_game_winner(self, game, winner):
-        game.winner = winner
-        game.save()
 
-    # Add new utility method for recording game results directly
-    @database_sync_to_async
-    def record_game_result(self, game, winner):
-
-
-        # Try to get both user objects
-        player_x_obj = None
-        player_o_obj = None
-
-        if game.player_x:
-            try:
-                player_x_obj = User.objects.get(username=game.player_x)
-            except User.DoesNotExist:
-                pass
-
-        if game.player_o:
-            try:
-                player_o_obj = User.objects.get(username=game.player_o)
-            except User.DoesNotExist:
-                pass
-
-        if not player_x_obj and not player_o_obj:
-            return
-
-        now = timezone.now()
-        time_str = now.strftime("%Y%m%d%H%M%S%f")
-        precise_game_id = f"{game.room_code}_{time_str}"
-
-        player_results = {}
-        if player_x_obj:
-            player_results[player_x_obj.username] = {"symbol": "X", "user_obj": player_x_obj}
-        if player_o_obj:
-            player_results[player_o_obj.username] = {"symbol": "O", "user_obj": player_o_obj}
-
-        if winner == 'draw':
-            for username in player_results:
-                player_results[username]["result"] = 'draw'
-        else:
-            for username, data in player_results.items():
-                if data["symbol"] == winner:
-                    player_results[username]["result"] = 'win'
-                else:
-                    player_results[username]["result"] = 'loss'
-
-        recent_time = now - timedelta(minutes=1)
-        with transaction.atomic():
-            for username, data in player_results.items():
-                opponent_username = game.player_o if username == game.player_x else game.player_x
-
-                if opponent_username and "game.players." in opponent_username.lower():
-                    mode_to_set = 'single'
-                    opponent_display = "Computer"
-                else:
-                    mode_to_set = 'multi'
-                    opponent_display = opponent_username or "Unknown"
-
-                existing_records = GameHistory.objects.filter(
-                    user=data["user_obj"],
-                    opponent=opponent_display,  # Updated here
-                    mode=mode_to_set,
-                    result=data["result"],
-                    date_played__gte=recent_time
-                )
-                if not existing_records.exists():
-                    GameHistory.objects.create(
-                        user=data["user_obj"],
-                        opponent=opponent_display,
-                        mode=mode_to_set,
-                        result=data["result"],
-                        game_identifier=precise_game_id
-                    )
-                    print(f"Created game history: {username} vs {opponent_username}, Result: {data['result']}, Game ID: {precise_game_id}")
-                else:
-                    print(f"Skipped duplicate game history for: {username} vs {opponent_username}, Game ID: {precise_game_id}")
\ No newline at end of file
+    def reset_full_game(self, game):
+        # The moves of the finished round are still to be flushed; they keep
+        # their round number.
+        game.reset_state(persist=False)
+        # The new round's clock starts at once.
+        game.last_move_time = timezone.now()
+        return game_data(game)
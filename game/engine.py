@@ -0,0 +1,248 @@
+"""
+In-memory rules engine for ultimate tic-tac-toe.
+
+The 81 cells are kept as one 9-bit mask per symbol for each of the nine
+sub-boards (bit ``sub_index`` of ``x[main_index]``).  The meta-board is kept
+the same way: ``won_x``/``won_o`` hold the sub-boards won by each symbol and
+``drawn`` the ones that filled up without a winner.  Every rule check is a
+handful of integer operations on these masks.
+"""
+
+WINNING = [
+    [0, 1, 2], [3, 4, 5], [6, 7, 8],
+    [0, 3, 6], [1, 4, 7], [2, 5, 8],
+    [0, 4, 8], [2, 4, 6],
+]
+
+WIN_MASKS = tuple(sum(1 << i for i in line) for line in WINNING)
+FULL = 0x1FF
+
+# Lookup tables over every possible 9-bit mask.
+IS_WIN = tuple(any(mask & win == win for win in WIN_MASKS) for mask in range(512))
+BITS = tuple(tuple(i for i in range(9) if mask >> i & 1) for mask in range(512))
+
+
+def opponent(symbol):
+    return 'O' if symbol == 'X' else 'X'
+
+
+def board_masks(board):
+    "Returns the (x, o) masks of a 9-character board string."
+    x = o = 0
+    for i, value in enumerate(board):
+        if value == 'X':
+            x |= 1 << i
+        elif value == 'O':
+            o |= 1 << i
+    return x, o
+
+
+def board_string(x, o):
+    return ''.join('X' if x >> i & 1 else 'O' if o >> i & 1 else ' ' for i in range(9))
+
+
+def board_result(x, o):
+    """
+    Returns 'X' or 'O' for a won board, ' ' for a full board without a
+    winner and None while the board is still open.
+    """
+    if IS_WIN[x]:
+        return 'X'
+    if IS_WIN[o]:
+        return 'O'
+    if x | o == FULL:
+        return ' '
+    return None
+
+
+def winning_line(mask):
+    "Returns the first line of WINNING completed by mask, or None."
+    for line, win in zip(WINNING, WIN_MASKS):
+        if mask & win == win:
+            return line
+    return None
+
+
+class UltimateBoard:
+    """
+    Position of an ultimate tic-tac-toe game.
+
+    ``active`` is the sub-board the next move must be played in, or None when
+    the mover may pick any open sub-board (the send rule).  ``winner`` is
+    'X', 'O', 'draw' or None.
+    """
+
+    def __init__(self):
+        self.x = [0] * 9
+        self.o = [0] * 9
+        self.won_x = 0
+        self.won_o = 0
+        self.drawn = 0
+        self.active = None
+        self.turn = 'X'
+        self.winner = None
+        self.history = []
+
+    @classmethod
+    def from_strings(cls, boards, active_index=None, next_player='X', winner=None):
+        """
+        Builds a position from nine 9-character sub-board strings, indexed by
+        main index.
+        """
+        engine = cls()
+        for main_index, board in enumerate(boards):
+            x, o = board_masks(board)
+            engine.x[main_index] = x
+            engine.o[main_index] = o
+            engine._settle(main_index)
+        engine.active = active_index if active_index is not None and engine.is_open(active_index) else None
+        engine.turn = next_player
+        engine.winner = winner or engine._meta_result()
+        return engine
+
+    def copy(self):
+        engine = UltimateBoard()
+        engine.x = self.x[:]
+        engine.o = self.o[:]
+        engine.won_x = self.won_x
+        engine.won_o = self.won_o
+        engine.drawn = self.drawn
+        engine.active = self.active
+        engine.turn = self.turn
+        engine.winner = self.winner
+        return engine
+
+    # ------------------------------------------------------------------ queries
+
+    @property
+    def closed(self):
+        "Mask of sub-boards that are won or drawn."
+        return self.won_x | self.won_o | self.drawn
+
+    def is_open(self, main_index):
+        return not self.closed >> main_index & 1
+
+    def open_boards(self):
+        return list(BITS[FULL & ~self.closed])
+
+    def playable_boards(self):
+        "Sub-boards the next move may be played in."
+        if self.winner:
+            return []
+        if self.active is not None:
+            return [self.active]
+        return self.open_boards()
+
+    def empty_cells(self, main_index):
+        return BITS[FULL & ~(self.x[main_index] | self.o[main_index])]
+
+    def legal_moves(self):
+        "Returns every legal (main_index, sub_index) pair for the next move."
+        return [(main_index, sub_index)
+                for main_index in self.playable_boards()
+                for sub_index in self.empty_cells(main_index)]
+
+    def is_legal(self, main_index, sub_index):
+        if self.winner or not (0 <= main_index < 9 and 0 <= sub_index < 9):
+            return False
+        if self.active is not None and main_index != self.active:
+            return False
+        if not self.is_open(main_index):
+            return False
+        return not (self.x[main_index] | self.o[main_index]) >> sub_index & 1
+
+    def cell(self, main_index, sub_index):
+        if self.x[main_index] >> sub_index & 1:
+            return 'X'
+        if self.o[main_index] >> sub_index & 1:
+            return 'O'
+        return ' '
+
+    def sub_board(self, main_index):
+        return board_string(self.x[main_index], self.o[main_index])
+
+    def sub_winner(self, main_index):
+        "Returns 'X' or 'O' when the sub-board is won, else None."
+        if self.won_x >> main_index & 1:
+            return 'X'
+        if self.won_o >> main_index & 1:
+            return 'O'
+        return None
+
+    def sub_winning_line(self, main_index):
+        winner = self.sub_winner(main_index)
+        if winner is None:
+            return None
+        return winning_line(self.x[main_index] if winner == 'X' else self.o[main_index])
+
+    def meta_board(self):
+        "The meta-board string as stored on Game.board; drawn boards stay blank."
+        return board_string(self.won_x, self.won_o)
+
+    # ----------------------------------------------------------------- updates
+
+    def play(self, main_index, sub_index, symbol=None):
+        """
+        Plays a move and returns the outcome of the sub-board it was played
+        in, with the same values as board_result.
+        """
+        if not (0 <= main_index < 9 and 0 <= sub_index < 9):
+            raise IndexError("Invalid board index")
+        if self.winner:
+            raise ValueError("Game is already over")
+        if self.active is not None and main_index != self.active:
+            raise ValueError("This is not the active board")
+        if not self.is_open(main_index):
+            raise ValueError("This sub-board is full or already won")
+        bit = 1 << sub_index
+        if (self.x[main_index] | self.o[main_index]) & bit:
+            raise ValueError("Square already played")
+        if symbol is None:
+            symbol = self.turn
+
+        self.history.append((main_index, sub_index, self.active, self.turn, self.winner))
+        if symbol == 'X':
+            self.x[main_index] |= bit
+        else:
+            self.o[main_index] |= bit
+        result = self._settle(main_index)
+        if result:
+            self.winner = self._meta_result()
+        self.active = sub_index if self.is_open(sub_index) else None
+        self.turn = opponent(symbol)
+        return result
+
+    def undo(self):
+        "Takes back the last move played through play()."
+        main_index, sub_index, active, turn, winner = self.history.pop()
+        mask = ~(1 << sub_index)
+        self.x[main_index] &= mask
+        self.o[main_index] &= mask
+        bit = ~(1 << main_index)
+        self.won_x &= bit
+        self.won_o &= bit
+        self.drawn &= bit
+        self.active = active
+        self.turn = turn
+        self.winner = winner
+
+    def _settle(self, main_index):
+        "Records the result of a sub-board on the meta-board masks."
+        result = board_result(self.x[main_index], self.o[main_index])
+        bit = 1 << main_index
+        if result == 'X':
+            self.won_x |= bit
+        elif result == 'O':
+            self.won_o |= bit
+        elif result == ' ':
+            self.drawn |= bit
+        return result
+
+    def _meta_result(self):
+        if IS_WIN[self.won_x]:
+            return 'X'
+        if IS_WIN[self.won_o]:
+            return 'O'
+        if self.closed == FULL:
+            return 'draw'
+        return None
@@ -4,7 +4,7 @@ from django import forms
 from django.core.exceptions import ImproperlyConfigured, ValidationError
 
 from .players import get_player
-from .models import Game, SubGame
+from .models import Game
 
 
 def validate_player_type(player_type):
@@ -26,10 +26,8 @@ class NewGameForm(forms.Form):
         "Creates a game."
         players = [self.cleaned_data['player1'], self.cleaned_data['player2']]
         random.shuffle(players)
-        game = Game.objects.create(player_x=players[0],
-                                   player_o=players[1])
-        for i in range(9):
-            SubGame.objects.create(game=game, player_x=players[0], player_o=players[1], index=i)
+        game = Game(player_x=players[0], player_o=players[1])
+        game.create_subgames()
         return game
 
 
@@ -0,0 +1,228 @@
+"""
+Opening multiplayer rooms: their codes, and a pool of rooms made ahead.
+
+A room code is six characters of A-Z0-9.  Codes are made from the numbers
+of a sequence (RoomSequence, reserved ROOM_CODE_BLOCK numbers at a time by
+each process) by a keyed permutation of the 36^6 codes: a four-round
+Feistel network over two halves of 36^3.  Distinct numbers give distinct
+codes, so a code is never looked up before it is used, and the codes of
+consecutive rooms look unrelated to anyone without ROOM_CODE_KEY (which
+defaults to one derived from SECRET_KEY).  Rooms made before kept random
+codes; should one of those come up, the unique constraint refuses it and
+the room takes the next code.
+
+With ROOM_POOL_SIZE rooms, each process keeps that many rooms made ahead:
+inserted with their code and an empty board, marked ``pooled``.  Opening a
+room then claims one with a single update that sets its clock and clears
+the mark, and a background thread makes more once the pool is half used.
+Without a pooled room at hand, a room is inserted as it is opened.
+
+Settings:
+    ROOM_CODE_KEY    key of the permutation.
+    ROOM_CODE_BLOCK  sequence numbers each process reserves at a time.
+    ROOM_POOL_SIZE   rooms each process keeps ready; 0 turns the pool off.
+"""
+import hashlib
+import string
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import EMPTY_STATE, WRITE_RETRIES, Game, RoomSequence
+
+ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 6
+HALF = len(ALPHABET) ** (CODE_LENGTH // 2)
+CODES = HALF * HALF
+ROUNDS = 4
+DEFAULT_CODE_BLOCK = 100
+DEFAULT_POOL_SIZE = 0
+
+
+class RoomCodesExhausted(Exception):
+    "Every room code has been given out."
+
+
+def code_key():
+    key = getattr(settings, 'ROOM_CODE_KEY', None) or f"room-codes:{settings.SECRET_KEY}"
+    return hashlib.sha256(key.encode()).digest()
+
+
+def _round(key, index, half):
+    digest = hashlib.blake2b(f"{index}:{half}".encode(), key=key, digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % HALF
+
+
+def permute(number, key):
+    "The number's place in the keyed permutation of range(CODES)."
+    if not 0 <= number < CODES:
+        raise RoomCodesExhausted(number)
+    left, right = divmod(number, HALF)
+    for index in range(ROUNDS):
+        left, right = right, (left + _round(key, index, right)) % HALF
+    return left * HALF + right
+
+
+def unpermute(number, key):
+    left, right = divmod(number, HALF)
+    for index in reversed(range(ROUNDS)):
+        left, right = (right - _round(key, index, left)) % HALF, left
+    return left * HALF + right
+
+
+def encode_code(number):
+    chars = []
+    for i in range(CODE_LENGTH):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def reserve_numbers(count):
+    "Reserves ``count`` numbers of the sequence; returns the first."
+    with transaction.atomic():
+        sequence, created = RoomSequence.objects.select_for_update().get_or_create(pk=1)
+        first = sequence.next_value
+        sequence.next_value = F('next_value') + count
+        sequence.save(update_fields=['next_value'])
+    return first
+
+
+class CodeAllocator:
+    def __init__(self, key=None, block=None):
+        self.key = key or code_key()
+        self.block = block or getattr(settings, 'ROOM_CODE_BLOCK', DEFAULT_CODE_BLOCK)
+        self.lock = threading.Lock()
+        self.next = self.end = 0
+
+    def take(self):
+        with self.lock:
+            if self.next >= self.end:
+                self.next = reserve_numbers(self.block)
+                self.end = self.next + self.block
+            number = self.next
+            self.next += 1
+        return encode_code(permute(number, self.key))
+
+
+def room_fields(minutes, increment):
+    seconds = minutes * 60
+    return {'time_x': seconds, 'time_o': seconds, 'remaining_x': seconds, 'remaining_o': seconds,
+            'increment': increment}
+
+
+def create_room(minutes, increment, retries=WRITE_RETRIES):
+    "Inserts a new room; only a code left from before the sequence makes it try another."
+    for attempt in range(retries):
+        try:
+            with transaction.atomic():
+                return Game.objects.create(room_code=get_code_allocator().take(), player_x=None, player_o=None,
+                                           board=" " * 9, **room_fields(minutes, increment))
+        except IntegrityError:
+            if attempt == retries - 1:
+                raise
+
+
+class RoomPool:
+    def __init__(self, size=None):
+        self.size = size if size is not None else getattr(settings, 'ROOM_POOL_SIZE', DEFAULT_POOL_SIZE)
+        self.lock = threading.Lock()
+        self.ready = deque()
+        self.filling = False
+        self.loaded = False
+        self.claimed = 0
+        self.made = 0
+
+    def fill(self, count=None):
+        "Makes rooms until the pool is full; returns how many were made."
+        with self.lock:
+            count = self.size - len(self.ready) if count is None else count
+        allocator = get_code_allocator()
+        rooms = [Game(room_code=allocator.take(), board=" " * 9, state=EMPTY_STATE, pooled=True)
+                 for i in range(max(count, 0))]
+        try:
+            with transaction.atomic():
+                made = Game.objects.bulk_create(rooms)
+        except IntegrityError:
+            # A code from before the sequence; leave that room out.
+            made = []
+            for room in rooms:
+                try:
+                    with transaction.atomic():
+                        room.save()
+                    made.append(room)
+                except IntegrityError:
+                    pass
+        with self.lock:
+            self.ready.extend(room.pk for room in made)
+            self.made += len(made)
+        return len(made)
+
+    def _fill_in_background(self):
+        try:
+            self.fill()
+        finally:
+            close_old_connections()
+            with self.lock:
+                self.filling = False
+
+    def claim(self, minutes, increment):
+        "Gives out a pooled room set to the time control, or None if there is none at hand."
+        if not self.size:
+            return None
+        with self.lock:
+            if not self.loaded:
+                # Rooms made by earlier processes or fill_room_pool.
+                self.loaded = True
+                waiting = Game.objects.filter(pooled=True).values_list('pk', flat=True)[:self.size]
+                known = set(self.ready)
+                self.ready.extend(pk for pk in waiting if pk not in known)
+        while True:
+            with self.lock:
+                if len(self.ready) <= self.size // 2 and not self.filling:
+                    self.filling = True
+                    threading.Thread(target=self._fill_in_background, name='room-pool', daemon=True).start()
+                if not self.ready:
+                    return None
+                pk = self.ready.popleft()
+            # Another process may have claimed it first.
+            if Game.objects.filter(pk=pk, pooled=True).update(
+                    pooled=False, date_created=timezone.now(), version=F('version') + 1,
+                    **room_fields(minutes, increment)):
+                with self.lock:
+                    self.claimed += 1
+                return pk
+
+    def stats(self):
+        return {'size': self.size, 'ready': len(self.ready), 'claimed': self.claimed, 'made': self.made}
+
+
+_allocator = None
+_pool = None
+_lobby_lock = threading.Lock()
+
+
+def get_code_allocator():
+    global _allocator
+    with _lobby_lock:
+        if _allocator is None:
+            _allocator = CodeAllocator()
+        return _allocator
+
+
+def get_room_pool():
+    global _pool
+    with _lobby_lock:
+        if _pool is None:
+            _pool = RoomPool()
+        return _pool
+
+
+def open_room(minutes, increment):
+    "The id of a new room with the given time control, from the pool when it can."
+    pk = get_room_pool().claim(minutes, increment)
+    return pk if pk is not None else create_room(minutes, increment).pk
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from game.opening_book import BOOK_PATH, OpeningBook
+
+
+class Command(BaseCommand):
+    help = "Generates the opening book shipped in game/data by searching every book position."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plies', type=int, default=5, help="Book positions have fewer stones than this")
+        parser.add_argument('--depth', type=int, default=6, help="Search depth for each book move")
+        parser.add_argument('--output', default=BOOK_PATH)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        def progress(count):
+            if count % 100 == 0:
+                self.stdout.write(f"  {count} positions, {time.monotonic() - started:.0f}s")
+
+        book = OpeningBook.build(options['plies'], options['depth'], progress)
+        data = book.to_bytes()
+        with open(options['output'], 'wb') as f:
+            f.write(data)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(book)} positions ({len(data)} bytes) to {options['output']}"
+            f" in {time.monotonic() - started:.0f}s"))
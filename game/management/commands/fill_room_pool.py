@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from game.lobby import RoomPool
+from game.models import Game
+
+
+class Command(BaseCommand):
+    help = "Makes rooms ahead of time until the pool of rooms waiting to be opened holds the given number."
+
+    def add_arguments(self, parser):
+        parser.add_argument('rooms', type=int, help="Rooms the pool should hold")
+
+    def handle(self, *args, **options):
+        waiting = Game.objects.filter(pooled=True).count()
+        made = RoomPool(size=options['rooms']).fill(options['rooms'] - waiting)
+        self.stdout.write(self.style.SUCCESS(f"Made {made} rooms; {waiting + made} in the pool"))
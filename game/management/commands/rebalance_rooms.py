@@ -0,0 +1,34 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+
+from game.affinity import WORKERS_GROUP, HashRing, get_ring
+
+
+class Command(BaseCommand):
+    help = ("Sends a new room worker membership to every worker; each one hands the rooms "
+            "it no longer owns over to their new owners.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('workers', nargs='*', help="name=url, e.g. ws-1=ws://10.0.0.1:8001")
+        parser.add_argument('--sample', type=int, default=10000,
+                            help="Room codes used to estimate the share of rooms that move")
+
+    def handle(self, *args, **options):
+        workers = {}
+        for worker in options['workers']:
+            name, sep, url = worker.partition('=')
+            if not sep or not name or not url:
+                raise CommandError(f"Expected name=url, got {worker!r}")
+            workers[name] = url
+
+        before, after = get_ring(), HashRing(workers)
+        codes = [f"{i:06X}" for i in range(options['sample'])]
+        moved = sum(before.owner(code) != after.owner(code) for code in codes)
+        self.stdout.write(f"{len(workers)} workers; about {moved / max(len(codes), 1):.1%} of the rooms move")
+
+        async_to_sync(get_channel_layer().group_send)(WORKERS_GROUP, {
+            'type': 'workers.changed',
+            'workers': workers,
+        })
+        self.stdout.write(self.style.SUCCESS("Membership sent to the workers"))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from game.models import GameResult, Rating
+from game.ratings import get_leaderboard, rate
+
+
+def results_in_order(chunk_size):
+    "Every GameResult by (date_played, id), read chunk_size at a time."
+    results = GameResult.objects.only('player_x', 'player_o', 'winner', 'ai_level', 'date_played')
+    after = None
+    while True:
+        chunk = results
+        if after:
+            chunk = chunk.filter(Q(date_played__gt=after[0]) | Q(date_played=after[0], id__gt=after[1]))
+        chunk = list(chunk.order_by('date_played', 'id')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1].date_played, chunk[-1].pk
+
+
+class Command(BaseCommand):
+    help = "Rates every game result again, oldest first, and replaces all ratings with the outcome."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Results read per query")
+        parser.add_argument('--k', type=float, default=None, help="Overrides RATING_K")
+
+    def handle(self, *args, **options):
+        ratings = {}
+        rated = 0
+        for chunk in results_in_order(options['chunk_size']):
+            rate(chunk, ratings, options['k'])
+            rated += len(chunk)
+
+        with transaction.atomic():
+            Rating.objects.all().delete()
+            Rating.objects.bulk_create(ratings.values(), batch_size=options['chunk_size'])
+        get_leaderboard().invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Rated {rated} results; {len(ratings)} ratings"))
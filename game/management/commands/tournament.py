@@ -0,0 +1,73 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game.players import PLAYERS
+from game.selfplay import compare, run_tournament
+
+
+class Command(BaseCommand):
+    help = "Plays seeded in-memory games between two players and reports strength and speed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('first', help="Player name, e.g. game.players.GoodPlayer or 'good'")
+        parser.add_argument('second', help="Opponent player name")
+        parser.add_argument('--games', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--think-time', type=float, default=None,
+                            help="Seconds per move for search players")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Processes to play games in parallel")
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+        parser.add_argument('--baseline', help="Compare against the JSON results of an earlier run")
+        parser.add_argument('--max-score-drop', type=float, default=0.1,
+                            help="Score loss against the baseline that counts as a regression")
+        parser.add_argument('--max-slowdown', type=float, default=1.5,
+                            help="Ratio of p90 move latency over the baseline that counts as a regression")
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        try:
+            result = run_tournament(options['first'], options['second'], options['games'],
+                                    seed=options['seed'], think_time=options['think_time'],
+                                    workers=options['workers'])
+        except ValueError as e:
+            raise CommandError(f"{e}. Registered players: {', '.join(PLAYERS)}")
+
+        first, second = result['first'], result['second']
+        self.stdout.write(f"{first} vs {second}: {result['games']} games, seed {result['seed']}")
+        self.stdout.write(f"  W/D/L   {result['wins']}/{result['draws']}/{result['losses']}"
+                          f"  score {result['score']:.3f}  Elo {result['elo']:+.0f}")
+        self.stdout.write(f"  speed   {result['games_per_second']:.2f} games/s,"
+                          f" {result['avg_plies']:.1f} plies/game")
+        for seat, summary in result['latency'].items():
+            self.stdout.write(f"  {seat} ({result[seat]}): p50 {summary['p50'] * 1000:.2f} ms  p90 {summary['p90'] * 1000:.2f} ms"
+                              f"  p99 {summary['p99'] * 1000:.2f} ms  max {summary['max'] * 1000:.2f} ms")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(result, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            if (baseline.get('first'), baseline.get('second')) != (first, second):
+                raise CommandError("The baseline was recorded for different players")
+            regressions = []
+            for metric, (before, after) in compare(result, baseline).items():
+                if before is None:
+                    continue
+                self.stdout.write(f"  {metric}: {before:.4f} -> {after:.4f}")
+                if metric == 'score' and before - after > options['max_score_drop']:
+                    regressions.append(metric)
+                if metric.endswith('.p90') and before and after / before > options['max_slowdown']:
+                    regressions.append(metric)
+            if regressions:
+                message = f"Regressions against the baseline: {', '.join(regressions)}"
+                if options['fail_on_regression']:
+                    raise CommandError(message)
+                self.stdout.write(self.style.WARNING(message))
+            else:
+                self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
@@ -0,0 +1,111 @@
+import asyncio
+import random
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from game.engine import UltimateBoard
+from game.protocol import LATEST_VERSION, broadcast_event, encode
+
+
+def move_frames(games, seed=0):
+    "The move frames of seeded random games, as GameConsumer.move sends them."
+    rng = random.Random(seed)
+    frames = []
+    server_time = 1_700_000_000_000
+    for game in range(games):
+        engine = UltimateBoard()
+        clocks = {'X': 300, 'O': 300}
+        ply = 0
+        while not engine.winner and engine.legal_moves():
+            symbol = engine.turn
+            main_index, sub_index = rng.choice(engine.legal_moves())
+            engine.play(main_index, sub_index, symbol)
+            ply += 1
+            used = rng.randint(1, 8)
+            clocks[symbol] = max(0, clocks[symbol] - used)
+            server_time += used * 1000
+            next_player = 'O' if symbol == 'X' else 'X'
+            frames.append({
+                'type': 'move',
+                'seq': ply,
+                'main_index': main_index,
+                'sub_index': sub_index,
+                'player': symbol,
+                'next_player': next_player,
+                'winner': engine.winner,
+                'active_index': engine.active,
+                'time_x': clocks['X'],
+                'time_o': clocks['O'],
+                'server_time': server_time,
+                'deadline': None if engine.winner else server_time + clocks[next_player] * 1000,
+                'winning_line': list(engine.sub_winning_line(main_index) or ()) or None,
+            })
+    return frames
+
+
+def measure(frames, version, repeat):
+    size = sum(len(encode(frame, version).encode()) for frame in frames)
+    started = time.perf_counter()
+    for i in range(repeat):
+        for frame in frames:
+            encode(frame, version)
+    elapsed = time.perf_counter() - started
+    return size / len(frames), elapsed / (repeat * len(frames))
+
+
+async def fan_out(frames, watchers, once, version=LATEST_VERSION):
+    """
+    Broadcasts the frames to ``watchers`` sockets through an in-memory
+    channel layer, encoding each frame once for all of them (``once``) or
+    once per socket; returns the seconds it took.
+    """
+    layer = InMemoryChannelLayer(capacity=2)
+    channels = [await layer.new_channel() for i in range(watchers)]
+    for channel in channels:
+        await layer.group_add('benchmark', channel)
+    started = time.perf_counter()
+    for frame in frames:
+        await layer.group_send('benchmark', broadcast_event(frame) if once else frame)
+        for channel in channels:
+            event = await layer.receive(channel)
+            text = event['frames'][str(version)] if once else encode(event, version)
+    return time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = ("Compares the bytes and encoding time of a move frame in each version of the wire protocol, "
+            "and the throughput of broadcasting it to a room's sockets.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20, help="Times each frame is encoded")
+        parser.add_argument('--watchers', type=int, nargs='*', default=[1, 10, 100, 1000],
+                            help="Sockets in the room for the fan-out benchmark")
+        parser.add_argument('--fan-out-moves', type=int, default=20, help="Moves broadcast for each room size")
+
+    def handle(self, *args, **options):
+        frames = move_frames(options['games'], options['seed'])
+        self.stdout.write(f"{len(frames)} move frames from {options['games']} games")
+        baseline = None
+        for version in range(1, LATEST_VERSION + 1):
+            size, seconds = measure(frames, version, options['repeat'])
+            line = f"  v{version}: {size:.1f} bytes/move  {seconds * 1e6:.2f} us/encode"
+            if baseline:
+                line += f"  ({size / baseline[0]:.0%} of the bytes, {seconds / baseline[1]:.0%} of the time of v1)"
+            else:
+                baseline = size, seconds
+            self.stdout.write(line)
+
+        broadcast = frames[:options['fan_out_moves']]
+        if not options['watchers'] or not broadcast:
+            return
+        self.stdout.write(f"Fan-out of {len(broadcast)} moves, v{LATEST_VERSION} frames")
+        for watchers in options['watchers']:
+            each = asyncio.run(fan_out(broadcast, watchers, once=False))
+            once = asyncio.run(fan_out(broadcast, watchers, once=True))
+            self.stdout.write(
+                f"  {watchers:>5} sockets: per socket {len(broadcast) * watchers / each:,.0f} frames/s,"
+                f" once {len(broadcast) * watchers / once:,.0f} frames/s ({each / once:.2f}x)")
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:26
+
+from django.db import migrations, models
+
+EMPTY_BOARD = " " * 9
+
+
+def pack_sub_games(apps, schema_editor):
+    """
+    Copies each game's nine SubGame rows into Game.state: the 81 cells, the
+    sub-board winners, then the last move index of each sub-board.
+    """
+    Game = apps.get_model('game', 'Game')
+    SubGame = apps.get_model('game', 'SubGame')
+    rows = {}
+    for sub_game in SubGame.objects.order_by('game_id', 'index').iterator():
+        if 0 <= sub_game.index < 9:
+            rows.setdefault(sub_game.game_id, {})[sub_game.index] = sub_game
+    games = []
+    for game in Game.objects.filter(pk__in=rows).iterator():
+        sub_games = [rows[game.pk].get(i) for i in range(9)]
+        game.state = ''.join((sg.board or EMPTY_BOARD).ljust(9)[:9] if sg else EMPTY_BOARD for sg in sub_games) + \
+            ''.join(sg.winner if sg and sg.winner in ('X', 'O') else ' ' for sg in sub_games) + \
+            ''.join(str(sg.last_move_index) if sg and sg.last_move_index is not None and sg.last_move_index < 9
+                    else ' ' for sg in sub_games)
+        games.append(game)
+    Game.objects.bulk_update(games, ['state'], batch_size=500)
+
+
+def unpack_sub_games(apps, schema_editor):
+    Game = apps.get_model('game', 'Game')
+    SubGame = apps.get_model('game', 'SubGame')
+    sub_games = []
+    for game in Game.objects.exclude(state='').iterator():
+        for i in range(9):
+            last_move = game.state[90 + i]
+            sub_games.append(SubGame(
+                game=game,
+                index=i,
+                board=game.state[i * 9:i * 9 + 9],
+                player_x=game.player_x,
+                player_o=game.player_o,
+                winner=game.state[81 + i].strip() or None,
+                last_move_index=None if last_move == ' ' else int(last_move),
+            ))
+    SubGame.objects.bulk_create(sub_games, batch_size=900)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='state',
+            field=models.CharField(blank=True, default='', max_length=99),
+        ),
+        migrations.RunPython(pack_sub_games, unpack_sub_games),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:26
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0002_game_state'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='SubGame',
+        ),
+    ]
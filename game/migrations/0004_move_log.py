@@ -0,0 +1,54 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def count_plies(apps, schema_editor):
+    "Existing games have no logged moves; their snapshot holds every stone."
+    Game = apps.get_model('game', 'Game')
+    games = []
+    for game in Game.objects.exclude(state='').iterator():
+        game.ply = 81 - game.state[:81].count(' ')
+        games.append(game)
+    Game.objects.bulk_update(games, ['ply'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0003_delete_subgame'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='ply',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='round',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Move',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('round', models.PositiveIntegerField(default=0)),
+                ('ply', models.PositiveSmallIntegerField()),
+                ('symbol', models.CharField(max_length=1)),
+                ('main_index', models.PositiveSmallIntegerField()),
+                ('sub_index', models.PositiveSmallIntegerField()),
+                ('remaining_x', models.IntegerField()),
+                ('remaining_o', models.IntegerField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='moves', to='game.game')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('game', 'round', 'ply'), name='unique_move_ply')],
+            },
+        ),
+        migrations.RunPython(count_plies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0005_game_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='increment',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:40
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def separate_duplicates(apps, schema_editor):
+    """
+    Rows written before the constraint may share a user and identifier
+    (the room code was used for every round); all but the first of each
+    get their id appended, so no history is lost.
+    """
+    GameHistory = apps.get_model('game', 'GameHistory')
+    duplicates = (GameHistory.objects.exclude(game_identifier=None)
+                  .values('user_id', 'game_identifier').annotate(rows=Count('id')).filter(rows__gt=1))
+    for duplicate in duplicates:
+        rows = GameHistory.objects.filter(user_id=duplicate['user_id'],
+                                          game_identifier=duplicate['game_identifier']).order_by('id')
+        for row in rows[1:]:
+            row.game_identifier = f"{row.game_identifier[:40]}#{row.id}"
+            row.save(update_fields=['game_identifier'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0006_game_increment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(separate_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='gamehistory',
+            constraint=models.UniqueConstraint(fields=('user', 'game_identifier'), name='unique_result_per_game'),
+        ),
+    ]
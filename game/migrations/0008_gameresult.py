@@ -0,0 +1,105 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+WINNERS = {'win': 'X', 'loss': 'O', 'draw': 'draw'}
+RESULTS = {'X': ('win', 'loss'), 'O': ('loss', 'win'), 'draw': ('draw', 'draw')}
+
+
+def backfill_results(apps, schema_editor):
+    """
+    One GameResult per game of GameHistory: the rows of the two players of a
+    game (the same identifier, each the other's opponent) become one, with
+    the player of the first row as X.
+    """
+    GameHistory = apps.get_model('game', 'GameHistory')
+    GameResult = apps.get_model('game', 'GameResult')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    rows = list(GameHistory.objects.select_related('user').order_by('id'))
+    users = User.objects.in_bulk({row.opponent for row in rows}, field_name='username')
+    games = {}
+    for row in rows:
+        games.setdefault(row.game_identifier or f"history:{row.id}", []).append(row)
+
+    results = []
+    for identifier, played in games.items():
+        first = played[0]
+        while played:
+            row = played.pop(0)
+            pair = next((other for other in played if other.user.username == row.opponent
+                         and other.opponent == row.user.username), None)
+            if pair is not None:
+                played.remove(pair)
+            results.append(GameResult(
+                # Rows of the same identifier that are not one game stay apart.
+                game_identifier=identifier if row is first else f"{identifier[:40]}#{row.id}",
+                player_x=row.user,
+                player_o=pair.user if pair else users.get(row.opponent),
+                name_x=row.user.username,
+                name_o=row.opponent,
+                winner=WINNERS[row.result],
+                mode=row.mode,
+                date_played=row.date_played,
+                duration=row.duration,
+                moves=row.moves,
+            ))
+    GameResult.objects.bulk_create(results, batch_size=500)
+
+
+def split_results(apps, schema_editor):
+    GameHistory = apps.get_model('game', 'GameHistory')
+    GameResult = apps.get_model('game', 'GameResult')
+    rows = []
+    for result in GameResult.objects.order_by('id'):
+        for user_id, opponent, outcome in [(result.player_x_id, result.name_o, RESULTS[result.winner][0]),
+                                           (result.player_o_id, result.name_x, RESULTS[result.winner][1])]:
+            if user_id is not None:
+                rows.append(GameHistory(user_id=user_id, opponent=opponent, mode=result.mode, result=outcome,
+                                        date_played=result.date_played, duration=result.duration,
+                                        moves=result.moves, game_identifier=result.game_identifier))
+    GameHistory.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0007_gamehistory_unique_result'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('game_identifier', models.CharField(max_length=50, unique=True)),
+                ('name_x', models.CharField(blank=True, max_length=150)),
+                ('name_o', models.CharField(blank=True, max_length=150)),
+                ('winner', models.CharField(choices=[('X', 'X'), ('O', 'O'), ('draw', 'Draw')], max_length=4)),
+                ('mode', models.CharField(choices=[('single', 'Single Player'), ('multi', 'Multiplayer')], max_length=10)),
+                ('date_played', models.DateTimeField(default=django.utils.timezone.now)),
+                ('duration', models.DurationField(blank=True, null=True)),
+                ('moves', models.PositiveIntegerField(default=0)),
+                ('player_o', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='results_as_o', to=settings.AUTH_USER_MODEL)),
+                ('player_x', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='results_as_x', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date_played'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='gameresult',
+            index=models.Index(fields=['player_x', 'date_played'], name='result_player_x_date'),
+        ),
+        migrations.AddIndex(
+            model_name='gameresult',
+            index=models.Index(fields=['player_o', 'date_played'], name='result_player_o_date'),
+        ),
+        migrations.RunPython(backfill_results, split_results),
+        migrations.DeleteModel(
+            name='GameHistory',
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.3 on 2026-10-18 16:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+FIELDS = {'X': ('wins', 'losses'), 'O': ('losses', 'wins')}
+
+
+def count_results(apps, schema_editor):
+    GameResult = apps.get_model('game', 'GameResult')
+    PlayerStats = apps.get_model('game', 'PlayerStats')
+    stats = {}
+    for player_x, player_o, winner in GameResult.objects.values_list('player_x_id', 'player_o_id', 'winner').iterator():
+        for user_id, fields in [(player_x, FIELDS['X']), (player_o, FIELDS['O'])]:
+            if user_id is None:
+                continue
+            row = stats.setdefault(user_id, PlayerStats(user_id=user_id))
+            row.games += 1
+            if winner == 'draw':
+                row.draws += 1
+            else:
+                field = fields[0] if winner == 'X' else fields[1]
+                setattr(row, field, getattr(row, field) + 1)
+    PlayerStats.objects.bulk_create(stats.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('game', '0008_gameresult'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('games', models.PositiveIntegerField(default=0)),
+                ('wins', models.PositiveIntegerField(default=0)),
+                ('losses', models.PositiveIntegerField(default=0)),
+                ('draws', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='gameresult',
+            name='result_player_x_date',
+        ),
+        migrations.RemoveIndex(
+            model_name='gameresult',
+            name='result_player_o_date',
+        ),
+        migrations.AddIndex(
+            model_name='gameresult',
+            index=models.Index(fields=['player_x', 'date_played', 'id'], name='result_player_x_page'),
+        ),
+        migrations.AddIndex(
+            model_name='gameresult',
+            index=models.Index(fields=['player_o', 'date_played', 'id'], name='result_player_o_page'),
+        ),
+        migrations.RunPython(count_results, migrations.RunPython.noop),
+    ]
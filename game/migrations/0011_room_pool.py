@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0010_ratings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='pooled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(condition=models.Q(('pooled', True)), fields=['pooled'], name='game_room_pool'),
+        ),
+    ]
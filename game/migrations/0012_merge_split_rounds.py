@@ -0,0 +1,73 @@
+# Generated by Django 5.2.3 on 2026-10-18 21:10
+
+from datetime import timedelta
+
+from django.db import migrations
+
+# The two history rows of one round were written together; rows further
+# apart than this are separate rounds.
+PAIRING_WINDOW = timedelta(minutes=1)
+MIRRORED = {'X': 'O', 'O': 'X', 'draw': 'draw'}
+FIELDS = {'X': ('wins', 'losses'), 'O': ('losses', 'wins')}
+
+
+def is_mirror(result, other):
+    return (result.player_o_id is not None
+            and (result.player_x_id, result.player_o_id) == (other.player_o_id, other.player_x_id)
+            and result.winner == MIRRORED[other.winner] and result.mode == other.mode
+            and abs(result.date_played - other.date_played) <= PAIRING_WINDOW)
+
+
+def merge_split_rounds(apps, schema_editor):
+    """
+    0007 suffixed each player's later rounds under a shared room code with
+    that player's own row id, so 0008 could not pair the two rows of such a
+    round and wrote it twice, once from each side. The later of each mirrored
+    pair is deleted and its count taken back out of PlayerStats. Ratings are
+    only rebuilt by recompute_ratings; run it again if it ran before this.
+    """
+    GameResult = apps.get_model('game', 'GameResult')
+    PlayerStats = apps.get_model('game', 'PlayerStats')
+    rounds = {}
+    for result in GameResult.objects.filter(game_identifier__contains='#').order_by('date_played', 'id'):
+        rounds.setdefault(result.game_identifier.split('#')[0], []).append(result)
+
+    duplicates = []
+    for results in rounds.values():
+        unpaired = []
+        for result in results:
+            other = next((other for other in reversed(unpaired) if is_mirror(result, other)), None)
+            if other is None:
+                unpaired.append(result)
+            else:
+                unpaired.remove(other)
+                duplicates.append(result)
+    if not duplicates:
+        return
+
+    stats = PlayerStats.objects.in_bulk({user_id for result in duplicates
+                                         for user_id in (result.player_x_id, result.player_o_id)})
+    for result in duplicates:
+        for user_id, fields in [(result.player_x_id, FIELDS['X']), (result.player_o_id, FIELDS['O'])]:
+            row = stats.get(user_id)
+            if row is None:
+                continue
+            row.games -= 1
+            if result.winner == 'draw':
+                row.draws -= 1
+            else:
+                field = fields[0] if result.winner == 'X' else fields[1]
+                setattr(row, field, getattr(row, field) - 1)
+    PlayerStats.objects.bulk_update(stats.values(), ['games', 'wins', 'losses', 'draws'], batch_size=500)
+    GameResult.objects.filter(pk__in=[result.pk for result in duplicates]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0011_room_pool'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_split_rounds, migrations.RunPython.noop),
+    ]
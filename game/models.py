@@ -1,10 +1,52 @@
 import random
-from django.core.exceptions import ValidationError
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist, ValidationError
 from django.urls import reverse
-from django.db import models, transaction
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.utils import timezone
 from django.contrib.auth.models import User
-from channels.db import database_sync_to_async
+
+from .engine import WINNING, UltimateBoard, board_masks, board_result, winning_line
+
+AI_PLAYER_KEYWORDS = ['randomplayer', 'goodplayer', 'legendplayer', 'ultimateplayer', 'computer', 'minimax']
+
+# Game.state packs the whole position into one column: the 81 cells by main
+# then sub index, the winner of each sub-board (' ' while undecided), then the
+# index of the last move played in each sub-board (' ' before the first).
+WINNERS_OFFSET = 81
+LAST_MOVES_OFFSET = 90
+STATE_LENGTH = 99
+EMPTY_STATE = " " * STATE_LENGTH
+
+# A game row is a snapshot of its position; moves in between are only
+# appended to the Move log and replayed on load.
+DEFAULT_SNAPSHOT_EVERY = 8
+
+
+WRITE_RETRIES = 3
+
+
+class GameConflict(Exception):
+    "Another request changed the game after it was loaded."
+
+
+def retry_on_conflict(game, action, retries=WRITE_RETRIES):
+    """
+    Runs ``action(game)`` in a transaction and returns its result.  When
+    another request wrote the game first, the game is loaded again and the
+    action retried on it, which re-validates a move against the new position.
+    """
+    for attempt in range(retries):
+        try:
+            with transaction.atomic():
+                return action(game)
+        except GameConflict:
+            if attempt == retries - 1:
+                raise
+            game = Game.objects.get(pk=game.pk)
 
 
 class Game(models.Model):
@@ -26,13 +68,28 @@ class Game(models.Model):
     time_o = models.IntegerField(default=300)
     remaining_x = models.IntegerField(default=300)
     remaining_o = models.IntegerField(default=300)
+    # Seconds added to a player's clock after each of their moves (Fischer).
+    increment = models.PositiveIntegerField(default=0)
+    # Start of the current turn; the player to move is charged from here.
     last_move_time = models.DateTimeField(null=True, blank=True)
+    # Empty until the sub-games are created; see EMPTY_STATE.
+    state = models.CharField(max_length=STATE_LENGTH, blank=True, default="")
+    # Moves of the current round included in the snapshot above; a restart
+    # starts a new round of the move log.
+    ply = models.PositiveIntegerField(default=0)
+    round = models.PositiveIntegerField(default=0)
+    # Bumped by every write of the row; save_changes only writes over the
+    # version it loaded.
+    version = models.PositiveIntegerField(default=0)
+    # A room made ahead of time and not given out yet; see game.lobby.
+    pooled = models.BooleanField(default=False)
+
+    WINNING = WINNING
 
-    WINNING = [
-        [0, 1, 2], [3, 4, 5], [6, 7, 8],
-        [0, 3, 6], [1, 4, 7], [2, 5, 8],
-        [0, 4, 8], [2, 4, 6],
-    ]
+    class Meta:
+        indexes = [
+            models.Index(fields=['pooled'], condition=models.Q(pooled=True), name='game_room_pool'),
+        ]
 
     def __str__(self):
         return f"{self.player_x} vs {self.player_o} | {self.room_code}"
@@ -44,62 +101,197 @@ class Game(models.Model):
     def next_player(self):
         return 'O' if self.last_player == 'X' else 'X'
 
+    # ----------------------------- Clock ------------------------------
+
     @property
-    def is_game_over(self):
+    def clock_running(self):
+        "Whether the player to move is on the clock."
+        return bool(self.state and not self.winner and self.player_x and self.player_o and self.last_move_time)
+
+    def clock_remaining(self, symbol, now=None):
+        """
+        Seconds left on ``symbol``'s clock.  Only the budget at the start of
+        the turn is stored; the player to move is charged lazily from
+        last_move_time.
+        """
+        remaining = self.remaining_x if symbol == 'X' else self.remaining_o
+        if symbol == self.next_player and self.clock_running:
+            remaining -= ((now or timezone.now()) - self.last_move_time).total_seconds()
+        return max(0.0, remaining)
+
+    def flag_deadline(self):
+        "When the player to move runs out of time, or None while no clock runs."
+        if not self.clock_running:
+            return None
+        remaining = self.remaining_x if self.next_player == 'X' else self.remaining_o
+        return self.last_move_time + timedelta(seconds=remaining)
 
-        if self.winner:
-            return self.winner
-        board = list(self.board)
-        for wins in self.WINNING:
-            w = (board[wins[0]], board[wins[1]], board[wins[2]])
-            if w == ('X', 'X', 'X'):
-                if self.winner != 'X':
-                    self.winner = 'X'
-                    self.save()
-                return 'X'
-            if w == ('O', 'O', 'O'):
-                if self.winner != 'O':
-                    self.winner = 'O'
-                    self.save()
-                return 'O'
-
-        all_full_or_won = all(
-            self.board[i] != ' ' or
-            (sg := self.sub_games.filter(index=i).first()) and (' ' not in sg.board)
-            for i in range(9)
-        )
-        if all_full_or_won:
-            if not self.winner:
-                self.winner = 'draw'
-                self.save()
-            return 'draw'
-        return None
+    def check_flag(self, now=None):
+        "Ends the game if the player to move is out of time; returns that player, or None."
+        if not self.clock_running:
+            return None
+        symbol = self.next_player
+        if self.clock_remaining(symbol, now) > 0:
+            return None
+        setattr(self, 'remaining_x' if symbol == 'X' else 'remaining_o', 0)
+        self.winner = 'O' if symbol == 'X' else 'X'
+        return symbol
+
+    def charge_clock(self, symbol, now):
+        "Stops ``symbol``'s clock at ``now``, taking off the time used and adding the increment."
+        remaining = round(self.clock_remaining(symbol, now)) + self.increment
+        setattr(self, 'remaining_x' if symbol == 'X' else 'remaining_o', remaining)
+
+    # ----------------------------- Engine -----------------------------
+
+    def load_engine(self):
+        "Builds the in-memory engine for this game from its state column."
+        state = self.state or EMPTY_STATE
+        boards = [state[i * 9:i * 9 + 9] for i in range(9)]
+        self._engine = UltimateBoard.from_strings(boards, active_index=self.active_index,
+                                                  next_player=self.next_player, winner=self.winner)
+        return self._engine
+
+    @property
+    def engine(self):
+        engine = getattr(self, '_engine', None)
+        if engine is None:
+            engine = self.load_engine()
+        return engine
+
+    @property
+    def sub_games(self):
+        "Read-only view of the nine sub-boards, empty until they are created."
+        return SubGameSet(self)
+
+    def get_sub_game(self, index):
+        if not self.state or index is None or not 0 <= index < 9:
+            return None
+        return SubGame(self, index)
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        self._engine = None
+        if fields is not None or from_queryset is not None:
+            super().refresh_from_db(using, fields, from_queryset)
+            self._mark_clean(fields)
+            return
+        fresh = type(self)._base_manager.db_manager(using or self._state.db).get(pk=self.pk)
+        for field in self._meta.concrete_fields:
+            setattr(self, field.attname, getattr(fresh, field.attname))
+        self._loaded = fresh._loaded
+
+    # -------------------------- Change tracking -------------------------
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        game = super().from_db(db, field_names, values)
+        game._mark_clean()
+        if game.state and not game.winner and all(
+                name in game.__dict__ for name in ('state', 'ply', 'round', 'active_index', 'last_player')):
+            game.replay_moves()
+        return game
+
+    def _mark_clean(self, fields=None):
+        loaded = getattr(self, '_loaded', {})
+        for field in self._meta.concrete_fields:
+            if fields is None or field.name in fields:
+                if field.attname in self.__dict__:  # Skips deferred fields
+                    loaded[field.attname] = getattr(self, field.attname)
+        self._loaded = loaded
+
+    def changed_fields(self):
+        "Names of the fields changed since the game was loaded or saved."
+        loaded = getattr(self, '_loaded', {})
+        return [field.name for field in self._meta.concrete_fields
+                if field.attname in loaded and getattr(self, field.attname) != loaded[field.attname]]
+
+    def save(self, *args, **kwargs):
+        """
+        A full save of a stored game, like save_changes, only applies over
+        the version the game was loaded with and raises GameConflict when
+        another request wrote the row first.
+        """
+        if self._state.adding or self.pk is None or kwargs.get('update_fields') is not None:
+            super().save(*args, **kwargs)
+            self._mark_clean(kwargs.get('update_fields'))
+            return
+        self.date_updated = timezone.now()
+        values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields
+                  if not field.primary_key and field.name != 'version' and field.attname in self.__dict__}
+        updated = type(self)._base_manager.filter(pk=self.pk, version=self.version).update(
+            version=F('version') + 1, **values)
+        if not updated:
+            raise GameConflict("The game was changed by another request")
+        self.version += 1
+        self._mark_clean()
+
+    def save_changes(self):
+        """
+        Writes only the changed fields, or the whole row for a new game.
+        Does nothing when nothing changed.  The UPDATE only applies over the
+        version the game was loaded with and raises GameConflict when
+        another request wrote the row first.
+        """
+        if self._state.adding or self.pk is None:
+            self.save()
+            return
+        changed = self.changed_fields()
+        if not changed:
+            return
+        self.date_updated = timezone.now()
+        values = {name: getattr(self, name) for name in changed + ['date_updated']}
+        updated = type(self)._base_manager.filter(pk=self.pk, version=self.version).update(
+            version=F('version') + 1, **values)
+        if not updated:
+            raise GameConflict("The game was changed by another request")
+        self.version += 1
+        self._mark_clean(changed + ['date_updated', 'version'])
+
+    @property
+    def pending_moves(self):
+        "Moves applied with ``persist=False`` and not written yet (see game.rooms)."
+        return self.__dict__.setdefault('_pending_moves', [])
+
+    @classmethod
+    def write_changes(cls, pk, moves, values, version):
+        """
+        Writes moves and field values over ``version`` of the game, or
+        raises GameConflict.  The moves are committed before the row: when
+        only the row conflicts they stay in the log, and loading the game
+        replays them.
+        """
+        if moves:
+            try:
+                with transaction.atomic():
+                    Move.objects.bulk_create(moves)
+            except IntegrityError:
+                raise GameConflict("Moves of the game were already played") from None
+        if values:
+            updated = cls._base_manager.filter(pk=pk, version=version).update(
+                version=F('version') + 1, date_updated=timezone.now(), **values)
+            if not updated:
+                raise GameConflict("The game was changed by another request")
+
+    @property
+    def is_game_over(self):
+        "The winner ('X', 'O' or 'draw'), or None.  Never writes."
+        return self.winner or self.engine.winner
 
     def play(self, main_index, sub_index, symbol=None):
+        "Plays a move for the next player, checking the clock, in one write."
+        with transaction.atomic():
+            return self._play(main_index, sub_index, symbol)
+
+    def _play(self, main_index, sub_index, symbol):
         if self.winner:
             raise ValidationError("Game is already over")
         if symbol is None:
             symbol = self.next_player
 
         now = timezone.now()
-
-        if self.last_move_time and not (self.player_o and any(keyword in self.player_o.lower()
-                                                              for keyword in ['randomplayer','goodplayer','legendplayer','computer','minimax'])):
-            elapsed = int((now - self.last_move_time).total_seconds())
-            if self.last_player == 'X':
-                self.remaining_x = max(0, self.remaining_x - elapsed)
-                if self.remaining_x <= 0:
-                    self.winner = 'O'
-                    self.save()
-                    return self.winner
-            elif self.last_player == 'O':
-                self.remaining_o = max(0, self.remaining_o - elapsed)
-                if self.remaining_o <= 0:
-                    self.winner = 'X'
-                    self.save()
-                    return self.winner
-
-        self.last_move_time = now
+        if self.check_flag(now):
+            self.save_changes()
+            return self.winner
 
         if self.active_index is not None and main_index != self.active_index:
             raise ValidationError("This is not the active board")
@@ -108,65 +300,131 @@ class Game(models.Model):
         if self.board[main_index] != ' ':
             return None
 
-        sub_game = self.sub_games.filter(index=main_index).first()
-        if not sub_game:
+        winner, _ = self.apply_move(main_index, sub_index, symbol, now, clocked=self.clock_running)
+        return winner
+
+    def apply_move(self, main_index, sub_index, symbol=None, now=None, persist=True, clocked=False):
+        """
+        Validates and plays a move through the engine and appends it to the
+        move log.  Every GAME_SNAPSHOT_EVERY plies, and when the game ends,
+        the changed fields of the game are saved as a new snapshot.
+        Returns (winner, winning_line) for the sub-board the move was played
+        in.
+
+        With ``persist=False`` nothing is written: the move waits in
+        pending_moves for the caller to write (see game.rooms).  With
+        ``clocked`` the mover's clock is charged; see charge_clock.
+        """
+        engine = self.engine
+        if engine.winner:
+            raise ValidationError("Game is already over")
+        if engine.active is not None and main_index != engine.active:
+            raise ValidationError("This is not the active board")
+        if main_index is None or sub_index is None or main_index < 0 or main_index >= 9 or sub_index < 0 or sub_index >= 9:
+            raise IndexError("Invalid board index")
+
+        if not self.state:
             raise ValueError("SubGame does not exist")
-        if sub_game.is_game_over or ' ' not in sub_game.board:
+        if not engine.is_open(main_index):
             raise ValidationError("This sub-board is full or already won")
 
-        winner, _ = sub_game.play(sub_index, symbol)
-        sub_game.save()
+        if engine.cell(main_index, sub_index) != ' ':
+            raise ValueError("Square already played")
 
+        if symbol is None:
+            symbol = self.next_player
+        elif symbol != self.next_player:
+            raise ValidationError("It is not your turn")
+        now = now or timezone.now()
+        if clocked:
+            self.charge_clock(symbol, now)
+        move = Move(game=self, round=self.round, ply=self.ply + 1, symbol=symbol,
+                    main_index=main_index, sub_index=sub_index, remaining_x=self.remaining_x,
+                    remaining_o=self.remaining_o, created=now)
+        if persist:
+            # The log's unique (game, round, ply) makes the insert the
+            # optimistic check: of two moves made from the same position only
+            # the first is written.
+            try:
+                with transaction.atomic():
+                    move.save()
+            except IntegrityError:
+                raise GameConflict(f"Move {move.ply} of the game was already played") from None
+        else:
+            self.pending_moves.append(move)
+        winner = self._advance(main_index, sub_index, symbol, now)
+        if persist and (self.winner or
+                        self.ply % getattr(settings, 'GAME_SNAPSHOT_EVERY', DEFAULT_SNAPSHOT_EVERY) == 0):
+            self.save_changes()
+        return winner, engine.sub_winning_line(main_index)
+
+    def _advance(self, main_index, sub_index, symbol, now):
+        "Plays a move on the engine and the fields derived from the position."
+        engine = self.engine
+        winner = engine.play(main_index, sub_index, symbol)
+
+        last_moves = self.state[LAST_MOVES_OFFSET:]
+        self.state = ''.join(engine.sub_board(i) for i in range(9)) + \
+            ''.join(engine.sub_winner(i) or ' ' for i in range(9)) + \
+            last_moves[:main_index] + str(sub_index) + last_moves[main_index + 1:]
         self.last_main_index = main_index
         self.last_sub_index = sub_index
         self.last_player = symbol
-
-        if winner:
-            self.board = self.board[:main_index] + winner + self.board[main_index + 1:]
-        elif ' ' not in sub_game.board:
-            self.board = self.board[:main_index] + ' ' + self.board[main_index + 1:]
-
-        self.set_active_index(sub_index)
-        self.save()
-        self.is_game_over  # Trigger win check
+        self.board = engine.meta_board()
+        self.active_index = engine.active
+        self.last_move_time = now
+        self.ply += 1
+        if engine.winner:
+            self.winner = engine.winner
         return winner
 
+    def replay_moves(self):
+        "Brings the snapshot up to date with the moves logged after it."
+        for move in Move.objects.filter(game_id=self.pk, round=self.round, ply__gt=self.ply).order_by('ply'):
+            if move.ply != self.ply + 1:
+                break
+            self.remaining_x, self.remaining_o = move.remaining_x, move.remaining_o
+            self._advance(move.main_index, move.sub_index, move.symbol, move.created)
+
+    def position_at(self, ply):
+        "The engine after the first ``ply`` moves of the current round."
+        engine = UltimateBoard()
+        for move in self.moves.filter(round=self.round, ply__lte=ply).order_by('ply'):
+            engine.play(move.main_index, move.sub_index, move.symbol)
+        return engine
+
     def set_active_index(self, index):
-        if index is None or self.board[index] != ' ':
+        if index is None or not self.state or not self.engine.is_open(index):
             self.active_index = None
         else:
-            # Check if the subgame is full (draw)
-            sub_game = self.sub_games.filter(index=index).first()
-            if not sub_game or sub_game.is_game_over or ' ' not in sub_game.board:
-                self.active_index = None
-            else:
-                self.active_index = index
-
-    def create_subgames(self):
+            self.active_index = index
+        self.engine.active = self.active_index
+
+    def create_subgames(self, persist=True):
+        "Starts the game on an empty board; saving an unsaved game inserts it."
         if not self.player_x or not self.player_o:
             raise ValueError("Cannot create subgames without both player_x and player_o")
-        self.sub_games.all().delete()
-        for i in range(9):
-            SubGame.objects.create(
-                game=self,
-                index=i,
-                player_x=self.player_x,
-                player_o=self.player_o
-            )
+        self.state = EMPTY_STATE
         self.board = " " * 9
         self.last_player = None
-        # Initialize remaining time from time_x and time_o
+        self.ply = 0
+        if self.pk:
+            self.round += 1
+
         self.remaining_x = self.time_x
         self.remaining_o = self.time_o
         self.last_move_time = timezone.now()
         self.winner = None
         self.active_index = None
-        self.save()
-
-    def reset_state(self):
+        self._engine = None
+        if persist:
+            self.save()
 
-        from django.utils import timezone
+    def reset_state(self, persist=True):
         self.date_created = timezone.now()
+        self.state = EMPTY_STATE
+        self.ply = 0
+        self.round += 1
         self.board = " " * 9
         self.last_main_index = None
         self.last_sub_index = None
@@ -176,333 +434,293 @@ class Game(models.Model):
         self.remaining_x = self.time_x
         self.remaining_o = self.time_o
         self.last_move_time = None
-        self.sub_games.all().delete()
-        for i in range(9):
-            SubGame.objects.create(
-                game=self,
-                index=i,
-                player_x=self.player_x,
-                player_o=self.player_o
-            )
-        self.save()
-        self.refresh_from_db()  # Ensure in-memory state is fresh
+        self._engine = None
+        if persist:
+            self.save_changes()
 
     def play_auto(self):
-        if not self.is_game_over:
-            next_symbol = self.next_player
-            player = self.player_x if next_symbol == 'X' else self.player_o
+        "Plays the computer's move if it is to move."
+        turn = self._auto_turn()
+        if turn is None:
+            return
+        from game.scheduler import get_scheduler
+        symbol, player, remaining = turn
+        try:
+            move = self._pondered_move() or get_scheduler().request_move(self.pk, player, self.engine, remaining)
+        except Exception as e:
+            print(f"Error in auto play: {e}")  # For debugging
+            move = None
+        self._play_auto_move(turn, move)
+
+    async def play_auto_async(self):
+        """
+        play_auto for async views: the computer's move is awaited on the move
+        service, so no request thread waits on the search.
+        """
+        turn = self._auto_turn()
+        if turn is None:
+            return
+        from game.scheduler import get_scheduler
+        symbol, player, remaining = turn
+        try:
+            move = self._pondered_move() or \
+                await get_scheduler().request_move_async(self.pk, player, self.engine, remaining)
+        except Exception as e:
+            print(f"Error in auto play: {e}")  # For debugging
+            move = None
+        await sync_to_async(self._play_auto_move)(turn, move)
+
+    def _auto_turn(self):
+        "(symbol, player, remaining time) of the computer to move, or None."
+        if self.is_game_over:
+            self.stop_pondering()
+            return None
+        symbol = self.next_player
+        player = self.player_x if symbol == 'X' else self.player_o
+        # Update: Allow AI move if player string contains known AI keywords.
+        if player and not any(keyword in player.lower() for keyword in AI_PLAYER_KEYWORDS):
+            return None
+        return symbol, player, self.remaining_x if symbol == 'X' else self.remaining_o
+
+    def _pondered_move(self):
+        from game import ponder
+        return ponder.get_ponderer().take(self.pk, self.engine) if ponder.is_enabled() else None
+
+    def _play_auto_move(self, turn, move):
+        "Plays the computer's move, or a random one when it has none, and ponders the reply."
+        from game import ponder
+        from game.players import RandomPlayer, choose_move
+        symbol, player, remaining = turn
+        try:
+            if move is not None:
+                self.play(*move, symbol)
+        except Exception as e:
+            print(f"Error in auto play: {e}")  # For debugging
+            move = None
+        if move is None:
+            main_index, sub_index = choose_move(RandomPlayer(), self.engine)
+            self.play(main_index, sub_index, symbol)
+        if ponder.is_enabled() and not self.winner:
+            ponder.get_ponderer().start(self.pk, player, self.engine, remaining)
+
+    def stop_pondering(self):
+        "Cancels the AI's background search for this game, if there is one."
+        from game import ponder
+        if ponder.is_enabled():
+            ponder.get_ponderer().cancel(self.pk)
+
+
+class Move(models.Model):
+    "One move of a game, appended to the log as it is played."
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='moves')
+    round = models.PositiveIntegerField(default=0)
+    ply = models.PositiveSmallIntegerField()
+    symbol = models.CharField(max_length=1)
+    main_index = models.PositiveSmallIntegerField()
+    sub_index = models.PositiveSmallIntegerField()
+    remaining_x = models.IntegerField()
+    remaining_o = models.IntegerField()
+    created = models.DateTimeField(default=timezone.now)
 
-            # Update: Allow AI move if player string contains known AI keywords.
-            if player and not any(keyword in player.lower()
-                                for keyword in ['randomplayer','goodplayer','legendplayer','computer','minimax']):
-                return
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'round', 'ply'], name='unique_move_ply'),
+        ]
 
-            from game.players import get_player
-            try:
-                player_obj = get_player(player)
-                main_index = self.active_index if self.active_index is not None else \
-                             random.choice([i for i, v in enumerate(self.board) if v == ' '])
-                sub_game = self.sub_games.filter(index=main_index).first()
-                sub_index = player_obj.play(sub_game, next_symbol)
-                self.play(main_index, sub_index, next_symbol)
-            except Exception as e:
-                print(f"Error in auto play: {e}")  # For debugging
-                from game.players import RandomPlayer
-                player_obj = RandomPlayer()
-                main_index = self.active_index if self.active_index is not None else \
-                             random.choice([i for i, v in enumerate(self.board) if v == ' '])
-                sub_game = self.sub_games.filter(index=main_index).first()
-                sub_index = player_obj.play(sub_game, next_symbol)
-                self.play(main_index, sub_index, next_symbol)
+    def __str__(self):
+        return f"Game {self.game_id} #{self.ply}: {self.symbol} {self.main_index}-{self.sub_index}"
 
-    def play(self, main_index, sub_index, symbol=None):
-        if self.winner:
-            raise ValidationError("Game is already over")
-        if symbol is None:
-            symbol = self.next_player
 
-        now = timezone.now()
+class SubGame:
+    """
+    Read-only view of one sub-board of a game, derived from Game.state.
+    Moves go through Game.play or Game.apply_move.
+    """
+    DoesNotExist = ObjectDoesNotExist
+    MultipleObjectsReturned = MultipleObjectsReturned
+
+    WINNING = Game.WINNING
 
-        if self.last_move_time and not (self.player_o and any(keyword in self.player_o.lower()
-                                                              for keyword in ['randomplayer','goodplayer','legendplayer','computer','minimax'])):
-            elapsed = int((now - self.last_move_time).total_seconds())
-            if self.last_player == 'X':
-                self.remaining_x = max(0, self.remaining_x - elapsed)
-                if self.remaining_x <= 0:
-                    self.winner = 'O'
-                    self.save()
-                    return self.winner
-            elif self.last_player == 'O':
-                self.remaining_o = max(0, self.remaining_o - elapsed)
-                if self.remaining_o <= 0:
-                    self.winner = 'X'
-                    self.save()
-                    return self.winner
+    def __init__(self, game, index):
+        self.game = game
+        self.index = index
 
-        self.last_move_time = now
+    def __str__(self):
+        return f"SubGame {self.game.pk}-{self.index}"
 
-        if self.active_index is not None and main_index != self.active_index:
-            raise ValidationError("This is not the active board")
-        if main_index is None or sub_index is None or main_index < 0 or main_index >= 9 or sub_index < 0 or sub_index >= 9:
-            raise IndexError("Invalid board index")
-        if self.board[main_index] != ' ':
-            return None
+    @property
+    def board(self):
+        return self.game.state[self.index * 9:self.index * 9 + 9]
 
-        sub_game = self.sub_games.filter(index=main_index).first()
-        if not sub_game:
-            raise ValueError("SubGame does not exist")
-        if sub_game.is_game_over or ' ' not in sub_game.board:
-            raise ValidationError("This sub-board is full or already won")
+    @property
+    def winner(self):
+        return self.game.state[WINNERS_OFFSET + self.index].strip() or None
 
-        winner, _ = sub_game.play(sub_index, symbol)
-        sub_game.save()
+    @property
+    def last_move_index(self):
+        index = self.game.state[LAST_MOVES_OFFSET + self.index]
+        return None if index == ' ' else int(index)
 
-        self.last_main_index = main_index
-        self.last_sub_index = sub_index
-        self.last_player = symbol
+    @property
+    def player_x(self):
+        return self.game.player_x
 
-        if winner:
-            self.board = self.board[:main_index] + winner + self.board[main_index + 1:]
-        elif ' ' not in sub_game.board:
-            self.board = self.board[:main_index] + ' ' + self.board[main_index + 1:]
+    @property
+    def player_o(self):
+        return self.game.player_o
 
-        self.set_active_index(sub_index)
-        self.save()
-        self.is_game_over  # Trigger win check
-        return winner
+    def get_winning_line(self):
+        x, o = board_masks(self.board)
+        return winning_line(x) or winning_line(o)
 
-    def set_active_index(self, index):
-        if index is None or self.board[index] != ' ':
-            self.active_index = None
-        else:
-            # Check if the subgame is full (draw)
-            sub_game = self.sub_games.filter(index=index).first()
-            if not sub_game or sub_game.is_game_over or ' ' not in sub_game.board:
-                self.active_index = None
-            else:
-                self.active_index = index
-
-    def create_subgames(self):
-        if not self.player_x or not self.player_o:
-            raise ValueError("Cannot create subgames without both player_x and player_o")
-        self.sub_games.all().delete()
-        for i in range(9):
-            SubGame.objects.create(
-                game=self,
-                index=i,
-                player_x=self.player_x,
-                player_o=self.player_o
-            )
-        self.board = " " * 9
-        self.last_player = None
+    @property
+    def is_game_over(self):
+        return board_result(*board_masks(self.board))
 
-        self.remaining_x = self.time_x
-        self.remaining_o = self.time_o
-        self.last_move_time = timezone.now()
-        self.winner = None
-        self.active_index = None
-        self.save()
 
-    def reset_state(self):
+class SubGameSet:
+    "The queryset-like set of a game's sub-games that Game.sub_games returns."
 
-        from django.utils import timezone
-        self.date_created = timezone.now()
-        self.board = " " * 9
-        self.last_main_index = None
-        self.last_sub_index = None
-        self.winner = None
-        self.last_player = None
-        self.active_index = None
-        self.remaining_x = self.time_x
-        self.remaining_o = self.time_o
-        self.last_move_time = None
-        self.sub_games.all().delete()
-        for i in range(9):
-            SubGame.objects.create(
-                game=self,
-                index=i,
-                player_x=self.player_x,
-                player_o=self.player_o
-            )
-        self.save()
-        self.refresh_from_db()  # Ensure in-memory state is fresh
-
-
-class SubGame(models.Model):
-    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='sub_games')
-    index = models.PositiveIntegerField()
-    board = models.CharField(max_length=9, default=" " * 9)
-    player_x = models.CharField(max_length=255, null=True, blank=True)
-    player_o = models.CharField(max_length=255, null=True, blank=True)
-    winner = models.CharField(max_length=64, null=True, blank=True)
-    last_move_index = models.PositiveIntegerField(null=True, blank=True)
-    last_computer_move = models.PositiveIntegerField(null=True, blank=True)
-    date_created = models.DateTimeField(auto_now_add=True)
-    date_updated = models.DateTimeField(auto_now=True)
+    def __init__(self, game, indexes=range(9)):
+        self.game = game
+        self.indexes = list(indexes) if game.state else []
 
-    WINNING = Game.WINNING
+    def __iter__(self):
+        return (SubGame(self.game, index) for index in self.indexes)
 
-    def __str__(self):
-        return f"SubGame {self.game.pk}-{self.index}"
+    def __len__(self):
+        return len(self.indexes)
 
-    def get_winning_line(self):
-        board = list(self.board)
-        for wins in self.WINNING:
-            w = (board[wins[0]], board[wins[1]], board[wins[2]])
-            if w == ('X', 'X', 'X') or w == ('O', 'O', 'O'):
-                return wins
-        return None
+    def all(self):
+        return self
 
-    @property
-    def is_game_over(self):
-        board = list(self.board)
-        for wins in self.WINNING:
-            w = (board[wins[0]], board[wins[1]], board[wins[2]])
-            if w == ('X', 'X', 'X'):
-                self.winner = 'X'
-                self.save()
-                return 'X'
-            if w == ('O', 'O', 'O'):
-                self.winner = 'O'
-                self.save()
-                return 'O'
-
-        return None if ' ' in board else ' '
-
-    def play(self, index, symbol):
-        if index < 0 or index >= 9:
-            raise IndexError("Invalid board index")
-        if self.board[index] != ' ':
-            raise ValueError("Square already played")
+    def filter(self, **kwargs):
+        return SubGameSet(self.game, [sub_game.index for sub_game in self
+                                      if all(getattr(sub_game, k) == v for k, v in kwargs.items())])
 
-        board = list(self.board)
-        board[index] = symbol
-        self.board = ''.join(board)
-        self.last_move_index = index
-        self.save()
+    def get(self, **kwargs):
+        matches = list(self.filter(**kwargs))
+        if not matches:
+            raise SubGame.DoesNotExist("SubGame matching query does not exist.")
+        if len(matches) > 1:
+            raise SubGame.MultipleObjectsReturned("get() returned more than one SubGame")
+        return matches[0]
 
-        winner = self.is_game_over
-        winning_line = self.get_winning_line() if winner in ('X', 'O') else None
-        return (winner, winning_line)
+    def first(self):
+        return next(iter(self), None)
+
+    def exists(self):
+        return bool(self.indexes)
+
+    def count(self):
+        return len(self.indexes)
+
+
+class RoomSequence(models.Model):
+    "The next number game.lobby makes a room code of; a single row."
+    next_value = models.BigIntegerField(default=0)
 
-    def play_auto(self):
-        if not self.is_game_over:
-            next_symbol = 'O' if self.board.count('X') > self.board.count('O') else 'X'
-            player = self.player_x if next_symbol == 'X' else self.player_o
-            if player == 'human':
-                return
-            from game.players import get_player
-            player_obj = get_player(player)
-            sub_index = player_obj.play(self, next_symbol)
-            self.play(sub_index, next_symbol)
-            self.last_move_index = sub_index
-            self.save()
+
+class GameResultQuerySet(models.QuerySet):
+    def for_user(self, user):
+        """
+        The results of the user's games, from either side, each annotated
+        with the user's ``result`` ('win', 'loss' or 'draw') and ``opponent``.
+        """
+        played_x = models.Q(player_x=user)
+        return self.filter(played_x | models.Q(player_o=user)).annotate(
+            result=models.Case(
+                models.When(winner='draw', then=models.Value('draw')),
+                models.When(played_x & models.Q(winner='X'), then=models.Value('win')),
+                models.When(~played_x & models.Q(winner='O'), then=models.Value('win')),
+                default=models.Value('loss'),
+            ),
+            opponent=models.Case(models.When(played_x, then=F('name_o')), default=F('name_x')),
+        )
 
 
-class GameHistory(models.Model):
+class GameResult(models.Model):
+    "The result of one round of a game, one row however many players it had."
     MODE_CHOICES = [
         ('single', 'Single Player'),
         ('multi', 'Multiplayer'),
     ]
 
-    RESULT_CHOICES = [
-        ('win', 'Win'),
-        ('loss', 'Loss'),
+    WINNER_CHOICES = [
+        ('X', 'X'),
+        ('O', 'O'),
         ('draw', 'Draw'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='game_history')
-    opponent = models.CharField(max_length=150, blank=True)
+    # The round of a game the row is a result of; see game.results.
+    game_identifier = models.CharField(max_length=50, unique=True)
+    # The registered players; guests and the computer only have a name.
+    player_x = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='results_as_x')
+    player_o = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='results_as_o')
+    name_x = models.CharField(max_length=150, blank=True)
+    name_o = models.CharField(max_length=150, blank=True)
+    winner = models.CharField(max_length=4, choices=WINNER_CHOICES)
     mode = models.CharField(max_length=10, choices=MODE_CHOICES)
-    result = models.CharField(max_length=10, choices=RESULT_CHOICES)
-    date_played = models.DateTimeField(auto_now_add=True)
-    duration = models.DurationField(null=True, blank=True)  # Track game duration
-    moves = models.PositiveIntegerField(default=0)  # Track number of moves
-
-    game_identifier = models.CharField(max_length=50, blank=True, null=True)
+    # The computer player of a single-player game, e.g. 'GoodPlayer'.
+    ai_level = models.CharField(max_length=50, blank=True)
+    date_played = models.DateTimeField(default=timezone.now)
+    duration = models.DurationField(null=True, blank=True)
+    moves = models.PositiveIntegerField(default=0)
 
+    objects = GameResultQuerySet.as_manager()
 
     class Meta:
         ordering = ['-date_played']
-
+        indexes = [
+            # A user's history is the union of these two, in the order it
+            # is paged through (see views.profile).
+            models.Index(fields=['player_x', 'date_played', 'id'], name='result_player_x_page'),
+            models.Index(fields=['player_o', 'date_played', 'id'], name='result_player_o_page'),
+            # Every result in order, as ratings are recomputed.
+            models.Index(fields=['date_played', 'id'], name='result_date_page'),
+        ]
 
     def __str__(self):
-        gid = f" | Game {self.game_identifier}" if self.game_identifier else ""
-        return f"{self.user.username}{gid} - {self.get_mode_display()} - {self.result}"
+        return f"Game {self.game_identifier}: {self.name_x} v {self.name_o} - {self.get_winner_display()}"
 
-    @database_sync_to_async
-    def record_game_result(self, game, winner):
-        from django.contrib.auth.models import User
-        from django.db import transaction
-        from django.utils import timezone
-        from datetime import timedelta
 
-        # Try to get both user objects
-        player_x_obj = None
-        player_o_obj = None
+class PlayerStats(models.Model):
+    "A user's totals over their GameResults, kept up to date as results are written."
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    games = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+    losses = models.PositiveIntegerField(default=0)
+    draws = models.PositiveIntegerField(default=0)
 
-        if game.player_x:
-            try:
-                player_x_obj = User.objects.get(username=game.player_x)
-            except User.DoesNotExist:
-                pass
+    @property
+    def win_rate(self):
+        return round(self.wins / self.games * 100, 1) if self.games else 0
 
-        if game.player_o:
-            try:
-                player_o_obj = User.objects.get(username=game.player_o)
-            except User.DoesNotExist:
-                pass
+    def __str__(self):
+        return f"{self.user.username}: {self.wins}-{self.losses}-{self.draws}"
 
-        if not player_x_obj and not player_o_obj:
-            return
 
-        now = timezone.now()
-        time_str = now.strftime("%Y%m%d%H%M%S%f")
-        precise_game_id = f"{game.room_code}_{time_str}"
-
-        player_results = {}
-        if player_x_obj:
-            player_results[player_x_obj.username] = {"symbol": "X", "user_obj": player_x_obj}
-        if player_o_obj:
-            player_results[player_o_obj.username] = {"symbol": "O", "user_obj": player_o_obj}
-
-        if winner == 'draw':
-            for username in player_results:
-                player_results[username]["result"] = 'draw'
-        else:
-            for username, data in player_results.items():
-                if data["symbol"] == winner:
-                    player_results[username]["result"] = 'win'
-                else:
-                    player_results[username]["result"] = 'loss'
+class Rating(models.Model):
+    """
+    A user's Elo rating in one pool: 'multi' for games against other users,
+    'ai:<level>' for games against one level of the computer; see game.ratings.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ratings')
+    pool = models.CharField(max_length=60)
+    rating = models.FloatField(default=1500)
+    games = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(default=timezone.now)
 
-        recent_time = now - timedelta(minutes=1)
-        with transaction.atomic():
-            for username, data in player_results.items():
-                opponent_username = game.player_o if username == game.player_x else game.player_x
-
-                if opponent_username and "game.players." in opponent_username.lower():
-                    mode_to_set = 'single'
-                    opponent_display = "Computer"
-                else:
-                    mode_to_set = 'multi'
-                    opponent_display = opponent_username or "Unknown"
-
-                existing_records = GameHistory.objects.filter(
-                    user=data["user_obj"],
-                    opponent=opponent_display,  # Updated here
-                    mode=mode_to_set,
-                    result=data["result"],
-                    date_played__gte=recent_time
-                )
-                if not existing_records.exists():
-                    GameHistory.objects.create(
-                        user=data["user_obj"],
-                        opponent=opponent_display,
-                        mode=mode_to_set,
-                        result=data["result"],
-                        game_identifier=precise_game_id
-                    )
-                    print(f"Created game history: {username} vs {opponent_username}, Result: {data['result']}, Game ID: {precise_game_id}")
-                else:
-                    print(f"Skipped duplicate game history for: {username} vs {opponent_username}, Game ID: {precise_game_id}")
\ No newline at end of file
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'pool'], name='unique_rating_per_pool'),
+        ]
+        indexes = [
+            # The leaderboard of a pool, and the rank of a rating in it.
+            models.Index(fields=['pool', '-rating'], name='rating_pool_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} ({self.pool}): {self.rating:.0f}"
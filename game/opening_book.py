@@ -0,0 +1,121 @@
+"""
+Opening book for the whole-board AI.
+
+The book maps the canonical Zobrist key of an early position (see
+game.transposition) to the move a deep search chose for it, stored in the
+canonical frame.  Symmetric positions share one entry.  It is generated
+offline with ``manage.py build_opening_book`` and shipped in game/data; the
+file is read the first time an AI asks for a book move.
+
+Generation follows the AI's own book moves and every reply of the opponent,
+for the AI playing X and for the AI playing O, down to ``plies`` stones.
+"""
+import os
+import zlib
+from array import array
+
+from .engine import UltimateBoard
+from .search import POPCOUNT, Search
+from .transposition import PositionHash, TranspositionTable, from_canonical, to_canonical
+
+BOOK_PATH = os.path.join(os.path.dirname(__file__), 'data', 'opening_book.bin')
+BOOK_VERSION = 1
+
+
+def stones(engine):
+    return sum(POPCOUNT[x | o] for x, o in zip(engine.x, engine.o))
+
+
+class OpeningBook:
+    def __init__(self, entries=None, max_plies=0):
+        self.entries = entries or {}
+        self.max_plies = max_plies
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, engine):
+        "Returns the book (main_index, sub_index) for the position, or None."
+        if not self.entries or engine.winner or stones(engine) >= self.max_plies:
+            return None
+        key, symmetry = PositionHash(engine).key(engine)
+        cell = self.entries.get(key)
+        if cell is None:
+            return None
+        move = from_canonical(divmod(cell, 9), symmetry)
+        return move if engine.is_legal(*move) else None
+
+    @classmethod
+    def build(cls, plies, depth, progress=None):
+        """
+        Searches every book position to ``depth`` plies.  ``progress`` is
+        called with the number of entries after each new one.
+        """
+        book = cls(max_plies=plies)
+        table = TranspositionTable(64 * 1024 * 1024)
+        expanded = set()
+
+        def expand(engine, ai_symbol, ply):
+            if ply >= plies or engine.winner:
+                return
+            key, symmetry = PositionHash(engine).key(engine)
+            if engine.turn == ai_symbol:
+                if key not in book.entries:
+                    move = Search(max_depth=depth, table=table).run(engine)
+                    canonical = to_canonical(move, symmetry)
+                    book.entries[key] = canonical[0] * 9 + canonical[1]
+                    if progress:
+                        progress(len(book.entries))
+                moves = [from_canonical(divmod(book.entries[key], 9), symmetry)]
+            else:
+                if (key, ai_symbol) in expanded:
+                    return
+                expanded.add((key, ai_symbol))
+                moves = engine.legal_moves()
+            for move in moves:
+                engine.play(*move)
+                expand(engine, ai_symbol, ply + 1)
+                engine.undo()
+
+        expand(UltimateBoard(), 'X', 0)
+        expand(UltimateBoard(), 'O', 0)
+        return book
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = zlib.decompress(data)
+        if data[0] != BOOK_VERSION:
+            raise ValueError("Unsupported opening book version")
+        max_plies = data[1]
+        keys = array('Q')
+        size = (len(data) - 2) // (keys.itemsize + 1)
+        keys.frombytes(data[2:2 + size * keys.itemsize])
+        cells = data[2 + size * keys.itemsize:]
+        if len(cells) != size:
+            raise ValueError("Truncated opening book")
+        return cls(dict(zip(keys, cells)), max_plies)
+
+    def to_bytes(self):
+        keys = sorted(self.entries)
+        data = bytes([BOOK_VERSION, self.max_plies]) + array('Q', keys).tobytes() + \
+            bytes(self.entries[key] for key in keys)
+        return zlib.compress(data, 9)
+
+
+def load_book(path=BOOK_PATH):
+    try:
+        with open(path, 'rb') as f:
+            return OpeningBook.from_bytes(f.read())
+    except (OSError, ValueError, zlib.error):
+        return OpeningBook()
+
+
+_book = None
+
+
+def get_book():
+    "Returns the shipped book, loading it on first use."
+    global _book
+    if _book is None:
+        _book = load_book()
+    return _book
@@ -1,5 +1,12 @@
 import random
-import math
+
+from .engine import BITS, board_masks
+from .opening_book import get_book
+from .search import Search
+from .tables import get_table
+from .transposition import TranspositionTable
+
+DEFAULT_TRANSPOSITION_TABLE_BYTES = 16 * 1024 * 1024
 
 
 class RandomPlayer:
@@ -11,12 +18,6 @@ class RandomPlayer:
 
 
 class GoodPlayer:
-    WINNING_COMBINATIONS = [
-        [0, 1, 2], [3, 4, 5], [6, 7, 8],
-        [0, 3, 6], [1, 4, 7], [2, 5, 8],
-        [0, 4, 8], [2, 4, 6]
-    ]
-
     def play(self, game, symbol):
         board = list(game.board)
         player = symbol
@@ -50,93 +51,116 @@ class GoodPlayer:
         return None
 
     def find_winning_move(self, board, player):
-        for combo in self.WINNING_COMBINATIONS:
-            values = [board[i] for i in combo]
-            if values.count(player) == 2 and values.count(' ') == 1:
-                return combo[values.index(' ')]
-        return None
+        x, o = board_masks(board)
+        threats = get_table().threats(x, o, player)
+        return BITS[threats][0] if threats else None
 
 
 class LegendPlayer:
-    WINNING_COMBINATIONS = [
-        [0, 1, 2], [3, 4, 5], [6, 7, 8],
-        [0, 3, 6], [1, 4, 7], [2, 5, 8],
-        [0, 4, 8], [2, 4, 6]
-    ]
-
     def play(self, game, symbol):
         board = list(game.board)
         move = self.find_best_move(board, symbol)
         return move
 
     def find_best_move(self, board, player):
-        best_score = -math.inf
-        best_move = None
-        opponent = self.get_opponent(player)
+        x, o = board_masks(board)
+        moves = get_table().best_moves(x, o, player)
+        if moves:
+            return moves[0]
+        # Decided boards have no optimal move; any open square will do.
         for i in self.get_move_order(board):
             if board[i] == ' ':
-                board[i] = player
-                score = self.minimax(board, 0, False, player, opponent, -math.inf, math.inf)
-                board[i] = ' '
-                if score > best_score:
-                    best_score = score
-                    best_move = i
-        return best_move
-
-    def minimax(self, board, depth, is_maximizing, player, opponent, alpha, beta):
-        winner = self.check_winner(board)
-        if winner == player:
-            return 100 - depth
-        elif winner == opponent:
-            return depth - 100
-        elif ' ' not in board:
-            return 0
-
-        if is_maximizing:
-            max_eval = -math.inf
-            for i in self.get_move_order(board):
-                if board[i] == ' ':
-                    board[i] = player
-                    eval = self.minimax(board, depth + 1, False, player, opponent, alpha, beta)
-                    board[i] = ' '
-                    max_eval = max(max_eval, eval)
-                    alpha = max(alpha, eval)
-                    if beta <= alpha:
-                        break
-            return max_eval
-        else:
-            min_eval = math.inf
-            for i in self.get_move_order(board):
-                if board[i] == ' ':
-                    board[i] = opponent
-                    eval = self.minimax(board, depth + 1, True, player, opponent, alpha, beta)
-                    board[i] = ' '
-                    min_eval = min(min_eval, eval)
-                    beta = min(beta, eval)
-                    if beta <= alpha:
-                        break
-            return min_eval
+                return i
+        return None
 
     def get_move_order(self, board):
         # Prefer center, then corners, then sides
         return [4, 0, 2, 6, 8, 1, 3, 5, 7]
 
-    def check_winner(self, board):
-        for combo in self.WINNING_COMBINATIONS:
-            values = [board[i] for i in combo]
-            if values[0] != ' ' and values[0] == values[1] == values[2]:
-                return values[0]
-        return None
 
-    def get_opponent(self, player):
-        return 'O' if player == 'X' else 'X'
+class UltimatePlayer(LegendPlayer):
+    """
+    Searches the whole ultimate board instead of the single sub-board it is
+    handed.  Think time is taken from the player's remaining clock and capped,
+    so a reply always comes back within MAX_THINK_TIME seconds.  Early
+    positions are answered from the opening book without searching.
+    """
+    whole_board = True
+    MIN_THINK_TIME = 0.05
+    MAX_THINK_TIME = 1.0
+    EXPECTED_MOVES_LEFT = 20
+
+    def __init__(self, max_think_time=None, node_limit=None, use_book=True, table=None):
+        self.max_think_time = self.MAX_THINK_TIME if max_think_time is None else max_think_time
+        self.node_limit = node_limit
+        self.use_book = use_book
+        # None searches with the table of the process.
+        self.table = table
+
+    def think_time(self, remaining=None):
+        if remaining is None:
+            return self.max_think_time
+        budget = remaining / self.EXPECTED_MOVES_LEFT
+        return max(self.MIN_THINK_TIME, min(self.max_think_time, budget))
+
+    def find_move(self, engine, remaining=None):
+        "Returns the (main_index, sub_index) to play on the engine position."
+        if self.use_book:
+            move = get_book().lookup(engine)
+            if move is not None:
+                return move
+        table = self.table if self.table is not None else get_transposition_table()
+        search = Search(time_limit=self.think_time(remaining), node_limit=self.node_limit, table=table)
+        return search.run(engine)
+
+
+_transposition_table = None
+
+
+def get_transposition_table():
+    """
+    Returns this worker's transposition table, shared by every search in the
+    process and sized by the AI_TRANSPOSITION_TABLE_BYTES setting.
+    """
+    global _transposition_table
+    if _transposition_table is None:
+        from django.conf import settings
+        max_bytes = DEFAULT_TRANSPOSITION_TABLE_BYTES
+        if settings.configured:
+            max_bytes = getattr(settings, 'AI_TRANSPOSITION_TABLE_BYTES', max_bytes)
+        _transposition_table = TranspositionTable(max_bytes)
+    return _transposition_table
+
+
+PLAYERS = {
+    'game.players.RandomPlayer': RandomPlayer,
+    'game.players.GoodPlayer': GoodPlayer,
+    'game.players.LegendPlayer': LegendPlayer,
+    'game.players.UltimatePlayer': UltimatePlayer,
+}
 
 
 def get_player(player_name):
-    if player_name == 'game.players.RandomPlayer':
-        return RandomPlayer()
-    elif player_name == 'game.players.GoodPlayer':
-        return GoodPlayer()
-    elif player_name == 'game.players.LegendPlayer':
-        return LegendPlayer()
-    raise ValueError(f"Unknown player: {player_name}")
+    try:
+        return PLAYERS[player_name]()
+    except KeyError:
+        raise ValueError(f"Unknown player: {player_name}") from None
+
+
+class BoardView:
+    "The part of a SubGame the sub-board players look at."
+
+    def __init__(self, board):
+        self.board = board
+
+
+def choose_move(player, engine, remaining=None):
+    """
+    Returns the (main_index, sub_index) the player picks on the engine
+    position.  Sub-board players get the active board, or a random open one
+    when the send rule leaves the choice free.
+    """
+    if getattr(player, 'whole_board', False):
+        return player.find_move(engine, remaining)
+    main_index = engine.active if engine.active is not None else random.choice(engine.open_boards())
+    return main_index, player.play(BoardView(engine.sub_board(main_index)), engine.turn)
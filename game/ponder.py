@@ -0,0 +1,197 @@
+"""
+Pondering: searching the AI's replies while the human is on the clock.
+
+As soon as the AI has moved in a single-player game, the most plausible
+human replies are queued, and for each one the AI's answer is computed on the
+move service's pondering pool, apart from the workers live moves use.  The answers go into a per-game cache which
+Game.play_auto checks before asking the scheduler, so a human move that was
+foreseen is answered without waiting for a search.
+
+Pondering is bounded on every side: at most AI_PONDER_MAX_JOBS searches run
+at once, each gets AI_PONDER_THINK_TIME seconds, only AI_PONDER_MOVES replies
+are pondered per position and only AI_PONDER_MAX_GAMES games keep a cache.
+A game's work is cancelled when the human moves, when the game ends and when
+it has been idle for AI_PONDER_TTL seconds.
+
+Settings:
+    AI_PONDER           turns pondering on; it also needs AI_SERVICE_WORKERS.
+    AI_PONDER_MOVES     human replies pondered after each AI move.
+    AI_PONDER_MAX_JOBS  pondering searches running at once, across all games.
+    AI_PONDER_MAX_GAMES games with a cache; the least recently used is dropped.
+    AI_PONDER_THINK_TIME  seconds per pondering search.
+    AI_PONDER_TTL       seconds after which an untouched game is dropped.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from . import ai_service
+from .players import get_player
+from .search import Search
+
+DEFAULT_MOVES = 8
+DEFAULT_MAX_JOBS = ai_service.DEFAULT_PONDER_WORKERS
+DEFAULT_MAX_GAMES = 100
+DEFAULT_TTL = 600
+
+
+def position_key(engine):
+    return tuple(engine.sub_board(i) for i in range(9)), engine.active, engine.turn
+
+
+def plausible_moves(engine, limit):
+    "The side to move's likeliest moves, best first."
+    return Search().ordered_moves(engine)[:limit]
+
+
+class Session:
+    "The pondering state of one game."
+
+    def __init__(self):
+        self.answers = {}
+        self.futures = []
+        self.touched = time.monotonic()
+
+
+class Ponderer:
+    def __init__(self, submit=None, moves=None, max_jobs=None, max_games=None,
+                 think_time=None, ttl=None):
+        self.submit = submit or ai_service.submit_ponder
+        self.moves = moves if moves is not None else getattr(settings, 'AI_PONDER_MOVES', DEFAULT_MOVES)
+        self.max_jobs = max_jobs if max_jobs is not None else \
+            getattr(settings, 'AI_PONDER_MAX_JOBS', DEFAULT_MAX_JOBS)
+        self.max_games = max_games if max_games is not None else \
+            getattr(settings, 'AI_PONDER_MAX_GAMES', DEFAULT_MAX_GAMES)
+        self.think_time = think_time if think_time is not None else \
+            getattr(settings, 'AI_PONDER_THINK_TIME', ai_service.get_timeout())
+        self.ttl = ttl if ttl is not None else getattr(settings, 'AI_PONDER_TTL', DEFAULT_TTL)
+        # Re-entrant: cancelling a queued future runs its done callback at once.
+        self.lock = threading.RLock()
+        # Game key -> Session, least recently used first.
+        self.sessions = OrderedDict()
+        self.jobs = deque()
+        self.running = 0
+        self.hits = 0
+        self.misses = 0
+        self.searches = 0
+
+    def start(self, game_key, player_name, engine, remaining=None):
+        """
+        Queues the AI's answers to the human's likeliest replies on the
+        engine position, replacing whatever was pondered for the game before.
+        """
+        self.cancel(game_key)
+        if engine.winner or not getattr(_player_class(player_name), 'whole_board', False):
+            return
+        session = Session()
+        with self.lock:
+            self._expire()
+            self.sessions[game_key] = session
+            while len(self.sessions) > self.max_games:
+                self._drop(next(iter(self.sessions)))
+            for move in plausible_moves(engine, self.moves):
+                reply = engine.copy()
+                reply.play(*move)
+                if not reply.winner:
+                    self.jobs.append((game_key, session, player_name, reply, remaining))
+        self._pump()
+
+    def take(self, game_key, engine):
+        """
+        Returns the pondered (main_index, sub_index) for the engine position,
+        or None.  Either way the rest of the game's pondering is cancelled,
+        since the human has made their move.
+        """
+        with self.lock:
+            session = self.sessions.get(game_key)
+            move = session.answers.get(position_key(engine)) if session else None
+            if session:
+                self._drop(game_key)
+            if move is not None and engine.is_legal(*move):
+                self.hits += 1
+                return move
+            if session:
+                self.misses += 1
+            return None
+
+    def cancel(self, game_key):
+        "Drops the game's cache and any of its searches that have not started."
+        with self.lock:
+            self._drop(game_key)
+
+    def _drop(self, game_key):
+        session = self.sessions.pop(game_key, None)
+        if session is None:
+            return
+        self.jobs = deque(job for job in self.jobs if job[1] is not session)
+        for future in session.futures:
+            future.cancel()
+
+    def _expire(self):
+        now = time.monotonic()
+        for game_key, session in list(self.sessions.items()):
+            if now - session.touched > self.ttl:
+                self._drop(game_key)
+
+    def _pump(self):
+        with self.lock:
+            while self.jobs and self.running < self.max_jobs:
+                game_key, session, player_name, engine, remaining = self.jobs.popleft()
+                try:
+                    future = self.submit(player_name, engine, remaining, self.think_time)
+                except RuntimeError:
+                    # The pool is shutting down.
+                    self.jobs.clear()
+                    return
+                self.running += 1
+                self.searches += 1
+                session.futures.append(future)
+                future.add_done_callback(
+                    lambda f, s=session, k=position_key(engine): self._finished(f, s, k))
+
+    def _finished(self, future, session, key):
+        with self.lock:
+            self.running -= 1
+            if not future.cancelled() and future.exception() is None:
+                session.answers[key] = future.result()
+                session.touched = time.monotonic()
+        self._pump()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'games': len(self.sessions),
+                'queued': len(self.jobs),
+                'running': self.running,
+                'cached': sum(len(session.answers) for session in self.sessions.values()),
+                'searches': self.searches,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _player_class(player_name):
+    try:
+        return type(get_player(player_name))
+    except ValueError:
+        return None
+
+
+def is_enabled():
+    return getattr(settings, 'AI_PONDER', False) and ai_service.get_workers() > 0
+
+
+_ponderer = None
+_ponderer_lock = threading.Lock()
+
+
+def get_ponderer():
+    global _ponderer
+    with _ponderer_lock:
+        if _ponderer is None:
+            _ponderer = Ponderer()
+        return _ponderer
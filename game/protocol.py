@@ -0,0 +1,96 @@
+"""
+The frames the game socket sends, in each version of the wire protocol.
+
+The client asks for a version when it connects (``?proto=2``); without one
+it is sent version 1.
+
+Version 1 is a JSON object per frame, with the field names in full.
+
+Version 2 is a JSON array: a one-letter frame code, then the frame's fields
+in the order FRAMES gives, with the trailing nulls left out.  A move is sent
+as a delta: ``seq`` is the ply it made, which also tells whose move it was
+(X plays the odd plies), and ``cell`` is 9 * main_index + sub_index.  A
+client that sees a gap in the sequence asks for the whole position again
+with the ``state`` action.
+
+A frame broadcast to a room is encoded once per version by its sender
+(broadcast_event); each socket of the room sends on the text of its version
+as it is, however many sockets watch the room.
+
+Frames sent before the consumer knows the version, such as the redirect
+of game.affinity, are always version-1 objects; version-2 clients tell the
+two apart by the first character.
+"""
+import json
+from urllib.parse import parse_qs
+
+LATEST_VERSION = 2
+
+# Frame type -> (version-2 code, fields in order).
+FRAMES = {
+    'move': ('m', ('seq', 'cell', 'winner', 'active_index', 'time_x', 'time_o', 'server_time', 'deadline',
+                   'winning_line')),
+    'start': ('s', ('seq', 'next_player', 'my_player', 'opponent', 'time_x', 'time_o', 'server_time',
+                    'deadline', 'cells', 'active_index')),
+    'restart': ('r', ('next_player', 'player_x', 'player_o', 'time_x', 'time_o', 'server_time', 'deadline')),
+    'sync': ('c', ('client_time', 'server_time', 'resync', 'time_x', 'time_o', 'deadline')),
+    'surrender': ('x', ('winner', 'message')),
+    'replay_vote': ('v', ('from', 'vote')),
+    'player_assignment': ('p', ('player',)),
+    'waiting': ('w', ('message',)),
+    'error': ('e', ('message',)),
+}
+TYPES = {code: frame_type for frame_type, (code, fields) in FRAMES.items()}
+# json.dumps builds an encoder on each call that is not all defaults.
+_compact = json.JSONEncoder(separators=(',', ':')).encode
+
+
+def negotiate(scope):
+    "The protocol version the socket asked for, or 1."
+    query = parse_qs(scope.get('query_string', b'').decode())
+    try:
+        requested = int(query.get('proto', ['1'])[0])
+    except ValueError:
+        return 1
+    return max(1, min(requested, LATEST_VERSION))
+
+
+def encode(message, version=1):
+    if version == 1:
+        return json.dumps(message)
+    code, fields = FRAMES[message['type']]
+    values = [code]
+    values.extend(message.get(field) for field in fields)
+    if code == 'm':
+        values[2] = message['main_index'] * 9 + message['sub_index']
+    while values[-1] is None:
+        values.pop()
+    return _compact(values)
+
+
+def decode(text):
+    "The frame as a version-1 object, whichever version it was sent in."
+    frame = json.loads(text)
+    if isinstance(frame, dict):
+        return frame
+    code, values = frame[0], frame[1:]
+    frame_type = TYPES[code]
+    fields = FRAMES[frame_type][1]
+    message = {'type': frame_type, **dict(zip(fields, values + [None] * (len(fields) - len(values))))}
+    if frame_type == 'move':
+        main_index, sub_index = divmod(message.pop('cell'), 9)
+        player = 'X' if message['seq'] % 2 else 'O'
+        message.update(main_index=main_index, sub_index=sub_index, player=player,
+                       next_player='O' if player == 'X' else 'X')
+    return message
+
+
+def broadcast_event(message):
+    """
+    The channel-layer event that sends ``message`` to every socket of a
+    room, encoded in every version (keyed by the version as a string).
+    """
+    return {
+        'type': 'room_frame',
+        'frames': {str(version): encode(message, version) for version in range(1, LATEST_VERSION + 1)},
+    }
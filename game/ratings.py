@@ -0,0 +1,170 @@
+"""
+Elo ratings, and the leaderboards built from them.
+
+Results are rated as game.results writes them, in the same transaction
+(add_results), so each result is rated once.  A game between two
+registered users moves both their ratings in the 'multi' pool; a game
+against the computer moves the user's rating in the pool of that level
+('ai:GoodPlayer'), against a computer rated DEFAULT_RATING in every pool.
+Games with a guest are not rated.
+
+The leaderboard of a pool is its top LEADERBOARD_SIZE ratings.  It is read
+from the (pool, -rating) index at most every LEADERBOARD_REFRESH seconds
+and served from memory in between, so a page view does not touch the
+ratings.  A user outside the top is ranked by counting the ratings above
+theirs on the same index.
+
+The recompute_ratings command rebuilds every rating from GameResult.
+
+Settings:
+    RATING_K             the most a rating moves in one game.
+    LEADERBOARD_SIZE     ratings on each leaderboard.
+    LEADERBOARD_REFRESH  seconds a leaderboard is served before it is read again.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from .models import Rating
+
+DEFAULT_RATING = 1500
+DEFAULT_K = 32
+DEFAULT_LEADERBOARD_SIZE = 100
+DEFAULT_LEADERBOARD_REFRESH = 60
+MULTIPLAYER = 'multi'
+
+
+def pool_for(ai_level):
+    return f"ai:{ai_level}" if ai_level else MULTIPLAYER
+
+
+def pool_label(pool):
+    return "Multiplayer" if pool == MULTIPLAYER else f"vs {pool[3:]}"
+
+
+def expected_score(rating, opponent):
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+
+def score(winner, symbol):
+    if winner == 'draw':
+        return 0.5
+    return 1.0 if winner == symbol else 0.0
+
+
+def rated_players(result):
+    "The (user id, pool, symbol) of each player the GameResult rates."
+    players = [(user_id, symbol) for user_id, symbol in [(result.player_x_id, 'X'), (result.player_o_id, 'O')]
+               if user_id is not None]
+    if not result.ai_level and len(players) < 2:
+        return []
+    return [(user_id, pool_for(result.ai_level), symbol) for user_id, symbol in players]
+
+
+def rate(results, ratings, k=None):
+    """
+    Applies the GameResults, in the order given, to ``ratings``, a dict of
+    (user id, pool) -> Rating; ratings it lacks are added to it, unsaved.
+    """
+    k = k or getattr(settings, 'RATING_K', DEFAULT_K)
+    for result in results:
+        players = rated_players(result)
+        for user_id, pool, symbol in players:
+            if (user_id, pool) not in ratings:
+                ratings[user_id, pool] = Rating(user_id=user_id, pool=pool, rating=DEFAULT_RATING)
+        before = {symbol: ratings[user_id, pool].rating for user_id, pool, symbol in players}
+        for user_id, pool, symbol in players:
+            rating = ratings[user_id, pool]
+            opponent = before.get('O' if symbol == 'X' else 'X', DEFAULT_RATING)
+            rating.rating += k * (score(result.winner, symbol) - expected_score(before[symbol], opponent))
+            rating.games += 1
+            rating.updated = result.date_played
+    return ratings
+
+
+def add_results(results):
+    "Rates newly written GameResults; called in the transaction that writes them."
+    keys = {(user_id, pool) for result in results for user_id, pool, symbol in rated_players(result)}
+    if not keys:
+        return
+    existing = Rating.objects.select_for_update().filter(
+        user_id__in={user_id for user_id, pool in keys}, pool__in={pool for user_id, pool in keys})
+    ratings = {(rating.user_id, rating.pool): rating for rating in existing}
+    rate(sorted(results, key=lambda result: result.date_played), ratings)
+    changed = [ratings[key] for key in keys]
+    Rating.objects.bulk_update([rating for rating in changed if rating.pk], ['rating', 'games', 'updated'])
+    Rating.objects.bulk_create([rating for rating in changed if not rating.pk])
+
+
+def entry(rank, username, rating, games):
+    return {'rank': rank, 'username': username, 'rating': round(rating), 'games': games}
+
+
+class Leaderboard:
+    def __init__(self, size=None, refresh=None):
+        self.size = size or getattr(settings, 'LEADERBOARD_SIZE', DEFAULT_LEADERBOARD_SIZE)
+        self.refresh = refresh if refresh is not None else \
+            getattr(settings, 'LEADERBOARD_REFRESH', DEFAULT_LEADERBOARD_REFRESH)
+        self.lock = threading.Lock()
+        self.snapshots = {}
+        self.builds = 0
+
+    def build(self, pool):
+        ratings = (Rating.objects.filter(pool=pool).order_by('-rating', 'user_id')
+                   .values_list('user_id', 'user__username', 'rating', 'games')[:self.size])
+        entries, ranks, previous = [], {}, None
+        for position, (user_id, username, rating, games) in enumerate(ratings, 1):
+            # Equal ratings share a rank, as rank() counts them.
+            rank = entries[-1]['rank'] if rating == previous else position
+            previous = rating
+            ranks[user_id] = len(entries)
+            entries.append(entry(rank, username, rating, games))
+        return {'entries': entries, 'ranks': ranks}
+
+    def cached(self, key, build):
+        with self.lock:
+            built, value = self.snapshots.get(key, (None, None))
+            if built is None or time.monotonic() - built >= self.refresh:
+                value = build()
+                self.snapshots[key] = time.monotonic(), value
+                self.builds += 1
+            return value
+
+    def snapshot(self, pool):
+        return self.cached(('pool', pool), lambda: self.build(pool))
+
+    def top(self, pool=MULTIPLAYER):
+        return self.snapshot(pool)['entries']
+
+    def rank(self, user, pool=MULTIPLAYER):
+        "The user's leaderboard entry in the pool, or None if they are not rated in it."
+        snapshot = self.snapshot(pool)
+        if user.pk in snapshot['ranks']:
+            return snapshot['entries'][snapshot['ranks'][user.pk]]
+        rating = Rating.objects.filter(user=user, pool=pool).first()
+        if rating is None:
+            return None
+        above = Rating.objects.filter(pool=pool, rating__gt=rating.rating).count()
+        return entry(above + 1, user.username, rating.rating, rating.games)
+
+    def pools(self):
+        "The pools anyone is rated in."
+        return self.cached('pools', lambda: sorted(
+            Rating.objects.order_by().values_list('pool', flat=True).distinct()))
+
+    def invalidate(self):
+        with self.lock:
+            self.snapshots.clear()
+
+
+_leaderboard = None
+_leaderboard_lock = threading.Lock()
+
+
+def get_leaderboard():
+    global _leaderboard
+    with _leaderboard_lock:
+        if _leaderboard is None:
+            _leaderboard = Leaderboard()
+        return _leaderboard
@@ -0,0 +1,246 @@
+"""
+Settling finished games into GameResult.
+
+Every path that ends a game (the game view, the multiplayer consumer and
+the flag fall of a room's clock, game.rooms) calls record_game_result, which
+only queues the result: nothing is written on the path of the move that
+ended the game.  A
+writer thread turns the queue into one row per game that had a registered
+player, looking up the players of a whole batch in one query and inserting
+its rows in one bulk_create.  A batch is RESULT_BATCH_SIZE results, or what
+was queued within RESULT_FLUSH_INTERVAL seconds of its first one.  A batch
+that fails to write is logged and queued again RESULT_RETRY_DELAY seconds
+later; a result is only given up, and logged, after RESULT_WRITE_ATTEMPTS
+failed writes.
+
+A result is identified by its game and round (result_identifier), and
+GameResult is unique on it, so a result recorded more than once, by two
+paths or two processes, is written once.  The players' PlayerStats are
+updated in the transaction that writes the result, with the results that
+were new, so they are counted once too; so are their ratings (game.ratings).
+
+Settings:
+    RESULT_BATCH_SIZE      results written per batch at most.
+    RESULT_FLUSH_INTERVAL  seconds a result waits for others to join its batch.
+    RESULT_WRITE_ATTEMPTS  writes of a result tried before it is given up.
+    RESULT_RETRY_DELAY     seconds before a batch that failed is queued again.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import ratings
+from .models import WRITE_RETRIES, GameResult, PlayerStats
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_WRITE_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 1.0
+# Names the views give the computer opponent, besides the game.players paths.
+COMPUTER_NAMES = ('random', 'minimax', 'computer')
+STATS_FIELDS = {'win': 'wins', 'loss': 'losses', 'draw': 'draws'}
+
+logger = logging.getLogger(__name__)
+
+
+def is_computer(name):
+    name = name.lower()
+    return name in COMPUTER_NAMES or name.startswith('game.players.')
+
+
+def result_identifier(game):
+    "The same for every recording of one round of one game."
+    return f"{game.pk}:{game.round}"
+
+
+def snapshot(game, winner):
+    "What the writer needs of a finished game, taken before the game changes again."
+    now = timezone.now()
+    return {
+        'game_identifier': result_identifier(game),
+        'player_x': game.player_x,
+        'player_o': game.player_o,
+        'winner': winner,
+        'moves': game.ply,
+        'date_played': now,
+        'duration': now - game.date_created if game.date_created else None,
+    }
+
+
+def display_name(name):
+    if not name:
+        return "Unknown"
+    return "Computer" if is_computer(name) else name
+
+
+def result_rows(results):
+    "Unsaved GameResult rows for the results with a registered player."
+    names = {name for result in results for name in (result['player_x'], result['player_o']) if name}
+    users = User.objects.in_bulk(names, field_name='username')
+    rows = []
+    for result in results:
+        player_x, player_o = users.get(result['player_x']), users.get(result['player_o'])
+        if player_x is None and player_o is None:
+            continue
+        computers = [name for name in (result['player_x'], result['player_o']) if name and is_computer(name)]
+        rows.append(GameResult(
+            game_identifier=result['game_identifier'],
+            player_x=player_x,
+            player_o=player_o,
+            name_x=display_name(result['player_x']),
+            name_o=display_name(result['player_o']),
+            winner='draw' if result['winner'] in ('draw', ' ') else result['winner'],
+            mode='single' if computers else 'multi',
+            ai_level=computers[0].rsplit('.', 1)[-1] if len(computers) == 1 else '',
+            date_played=result['date_played'],
+            duration=result['duration'],
+            moves=result['moves'],
+        ))
+    return rows
+
+
+def outcome(winner, symbol):
+    "The result for the player of ``symbol``: 'win', 'loss' or 'draw'."
+    if winner == 'draw':
+        return 'draw'
+    return 'win' if winner == symbol else 'loss'
+
+
+def add_to_stats(rows):
+    "Adds the new GameResult rows to their players' PlayerStats."
+    totals = {}
+    for row in rows:
+        for symbol, user_id in [('X', row.player_x_id), ('O', row.player_o_id)]:
+            if user_id is not None:
+                counts = totals.setdefault(user_id, {'games': 0, 'wins': 0, 'losses': 0, 'draws': 0})
+                counts['games'] += 1
+                counts[STATS_FIELDS[outcome(row.winner, symbol)]] += 1
+    PlayerStats.objects.bulk_create([PlayerStats(user_id=user_id) for user_id in totals], ignore_conflicts=True)
+    for user_id, counts in totals.items():
+        PlayerStats.objects.filter(user_id=user_id).update(
+            **{field: F(field) + count for field, count in counts.items() if count})
+
+
+def write_results(results, retries=WRITE_RETRIES):
+    """
+    Writes the results not written yet, and adds them to the players'
+    stats and ratings in the same transaction; returns how many were new.
+    """
+    rows = {}
+    for row in result_rows(results):
+        rows.setdefault(row.game_identifier, row)
+    for attempt in range(retries):
+        written = set(GameResult.objects.filter(game_identifier__in=rows)
+                      .values_list('game_identifier', flat=True))
+        new = [row for identifier, row in rows.items() if identifier not in written]
+        try:
+            with transaction.atomic():
+                GameResult.objects.bulk_create(new)
+                add_to_stats(new)
+                ratings.add_results(new)
+            return len(new)
+        except IntegrityError:
+            # Another process wrote one of them first.
+            if attempt == retries - 1:
+                raise
+
+
+class ResultWriter:
+    def __init__(self, batch_size=None, flush_interval=None, max_attempts=None, retry_delay=None):
+        self.batch_size = batch_size or getattr(settings, 'RESULT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        self.flush_interval = flush_interval if flush_interval is not None else \
+            getattr(settings, 'RESULT_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        self.max_attempts = max_attempts or getattr(settings, 'RESULT_WRITE_ATTEMPTS', DEFAULT_WRITE_ATTEMPTS)
+        self.retry_delay = retry_delay if retry_delay is not None else \
+            getattr(settings, 'RESULT_RETRY_DELAY', DEFAULT_RETRY_DELAY)
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.submitted = 0
+        self.batches = 0
+        self.failures = 0
+        self.retried = 0
+        self.dropped = 0
+
+    def submit(self, game, winner):
+        self.queue.put(snapshot(game, winner))
+        with self.lock:
+            self.submitted += 1
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='result-writer', daemon=True)
+                self.thread.start()
+
+    def flush(self):
+        "Waits until every result submitted so far is written."
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                write_results(batch)
+                self.batches += 1
+            except Exception:
+                self.failures += 1
+                logger.exception("Error writing %d game results", len(batch))
+                self._retry(batch)
+            finally:
+                close_old_connections()
+                # Retried results are back on the queue first, so flush() waits for them.
+                for result in batch:
+                    self.queue.task_done()
+
+    def _retry(self, batch):
+        "Queues the results of a failed batch again, giving up on those out of attempts."
+        time.sleep(self.retry_delay)
+        for result in batch:
+            result['attempts'] = result.get('attempts', 1) + 1
+            if result['attempts'] > self.max_attempts:
+                self.dropped += 1
+                logger.error("Gave up writing the result of game %s after %d attempts: %r",
+                             result['game_identifier'], self.max_attempts, result)
+            else:
+                self.retried += 1
+                self.queue.put(result)
+
+    def stats(self):
+        return {
+            'submitted': self.submitted,
+            'pending': self.queue.qsize(),
+            'batches': self.batches,
+            'failures': self.failures,
+            'retried': self.retried,
+            'dropped': self.dropped,
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_result_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ResultWriter()
+            atexit.register(_writer.flush)
+        return _writer
+
+
+def record_game_result(game, winner):
+    "Queues the result of the game's current round; ``winner`` is 'X', 'O' or 'draw'."
+    get_result_writer().submit(game, winner)
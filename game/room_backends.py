@@ -0,0 +1,374 @@
+"""
+Stores for the live state of multiplayer rooms (see game.rooms).
+
+A backend keeps, for each room:
+
+- the live fields of its game, serialized, and a revision.  Each commit
+  bumps the revision and only applies over the revision it was made from, so
+  of two workers changing a room from the same state only the first commits;
+- the moves committed since the last flush, and the database version of
+  the game, which the next flush writes over;
+- the replay votes, the number of sockets in the room across workers, and
+  the lease of the worker that runs the room's clock and flushes it.
+
+MemoryRoomBackend serves rooms whose sockets are all in one process.
+RedisRoomBackend shares them between processes and nodes; every change of
+the state above is one Lua script, so it is atomic.  Select one with
+ROOM_STATE_BACKEND.
+
+Settings:
+    ROOM_STATE_BACKEND    dotted path of the backend class.
+    ROOM_STATE_REDIS_URL  server used by RedisRoomBackend.
+"""
+import asyncio
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'game.room_backends.MemoryRoomBackend'
+DEFAULT_REDIS_URL = 'redis://localhost:6379/0'
+DEFAULT_PREFIX = 'tictactoe:room:'
+
+
+class RoomBackend:
+    "The operations game.rooms needs; all of them are coroutines."
+
+    # Whether other processes see the same rooms.
+    shared = False
+
+    async def get(self, room_code):
+        "Returns (revision, fields), or None for a room that is not live."
+        raise NotImplementedError
+
+    async def create(self, room_code, fields, version):
+        "Makes the room live from a game loaded at ``version``, unless it is already; returns get()."
+        raise NotImplementedError
+
+    async def commit(self, room_code, revision, fields, moves=()):
+        "Stores fields and appends moves if the room is still at ``revision``; returns the new revision or None."
+        raise NotImplementedError
+
+    async def take(self, room_code):
+        """
+        Returns (version, fields, moves) to flush and detaches the moves, or
+        None when nothing was committed since the last take.
+        """
+        raise NotImplementedError
+
+    async def reset(self, room_code, fields, version):
+        "Replaces the room's state after a failed flush; returns the new revision."
+        raise NotImplementedError
+
+    async def vote(self, room_code, player, vote):
+        "Records a replay vote; returns 'restart', 'cancel' (clearing the votes) or None."
+        raise NotImplementedError
+
+    async def clear_votes(self, room_code):
+        raise NotImplementedError
+
+    async def acquire(self, room_code, owner, ttl):
+        "Takes or renews the room's lease for ``ttl`` seconds; returns whether ``owner`` holds it."
+        raise NotImplementedError
+
+    async def release(self, room_code, owner):
+        raise NotImplementedError
+
+    async def join(self, room_code):
+        "Counts a socket into the room; returns the sockets in it."
+        raise NotImplementedError
+
+    async def leave(self, room_code):
+        "Counts a socket out of the room; returns the sockets left."
+        raise NotImplementedError
+
+    async def delete(self, room_code):
+        raise NotImplementedError
+
+
+def vote_outcome(votes):
+    if votes.get('yes:X') and votes.get('yes:O'):
+        return 'restart'
+    if votes.get('no:X') or votes.get('no:O'):
+        return 'cancel'
+    return None
+
+
+class MemoryRoomBackend(RoomBackend):
+    def __init__(self):
+        self.rooms = {}
+
+    def _room(self, room_code):
+        return self.rooms.setdefault(room_code, {
+            'revision': None, 'fields': None, 'version': 0, 'taken': None, 'moves': [],
+            'votes': {}, 'owner': None, 'expires': 0, 'sockets': 0,
+        })
+
+    async def get(self, room_code):
+        room = self.rooms.get(room_code)
+        if room is None or room['revision'] is None:
+            return None
+        return room['revision'], room['fields']
+
+    async def create(self, room_code, fields, version):
+        room = self._room(room_code)
+        if room['revision'] is None:
+            room.update(revision=0, taken=0, fields=fields, version=version)
+        return room['revision'], room['fields']
+
+    async def commit(self, room_code, revision, fields, moves=()):
+        room = self.rooms.get(room_code)
+        if room is None or room['revision'] != revision:
+            return None
+        room['revision'] += 1
+        room['fields'] = fields
+        room['moves'].extend(moves)
+        return room['revision']
+
+    async def take(self, room_code):
+        room = self.rooms.get(room_code)
+        if room is None or room['revision'] is None or \
+                (not room['moves'] and room['taken'] == room['revision']):
+            return None
+        batch = room['version'], room['fields'], room['moves']
+        room.update(moves=[], version=room['version'] + 1, taken=room['revision'])
+        return batch
+
+    async def reset(self, room_code, fields, version):
+        room = self._room(room_code)
+        room['revision'] = (room['revision'] or 0) + 1
+        room.update(fields=fields, version=version, taken=room['revision'], moves=[])
+        return room['revision']
+
+    async def vote(self, room_code, player, vote):
+        votes = self._room(room_code)['votes']
+        votes[f"{'yes' if vote == 'yes' else 'no'}:{player}"] = True
+        outcome = vote_outcome(votes)
+        if outcome:
+            votes.clear()
+        return outcome
+
+    async def clear_votes(self, room_code):
+        self._room(room_code)['votes'].clear()
+
+    async def acquire(self, room_code, owner, ttl):
+        room = self._room(room_code)
+        now = time.monotonic()
+        if room['owner'] in (None, owner) or room['expires'] <= now:
+            room.update(owner=owner, expires=now + ttl)
+            return True
+        return False
+
+    async def release(self, room_code, owner):
+        room = self.rooms.get(room_code)
+        if room and room['owner'] == owner:
+            room['owner'] = None
+
+    async def join(self, room_code):
+        room = self._room(room_code)
+        room['sockets'] += 1
+        return room['sockets']
+
+    async def leave(self, room_code):
+        room = self._room(room_code)
+        room['sockets'] = max(0, room['sockets'] - 1)
+        return room['sockets']
+
+    async def delete(self, room_code):
+        self.rooms.pop(room_code, None)
+
+
+# KEYS: state hash, moves list.  ARGV: fields, version.
+CREATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('HSET', KEYS[1], 'revision', 0, 'taken', 0, 'fields', ARGV[1], 'version', ARGV[2])
+    redis.call('DEL', KEYS[2])
+end
+return redis.call('HMGET', KEYS[1], 'revision', 'fields')
+"""
+
+# KEYS: state hash, moves list.  ARGV: revision, fields, moves...
+COMMIT_SCRIPT = """
+local revision = redis.call('HGET', KEYS[1], 'revision')
+if not revision or revision ~= ARGV[1] then
+    return false
+end
+revision = tonumber(revision) + 1
+redis.call('HSET', KEYS[1], 'revision', revision, 'fields', ARGV[2])
+for i = 3, #ARGV do
+    redis.call('RPUSH', KEYS[2], ARGV[i])
+end
+return revision
+"""
+
+# KEYS: state hash, moves list.
+TAKE_SCRIPT = """
+local revision = redis.call('HGET', KEYS[1], 'revision')
+if not revision then
+    return false
+end
+local moves = redis.call('LRANGE', KEYS[2], 0, -1)
+if #moves == 0 and redis.call('HGET', KEYS[1], 'taken') == revision then
+    return false
+end
+redis.call('DEL', KEYS[2])
+local version = tonumber(redis.call('HGET', KEYS[1], 'version'))
+redis.call('HSET', KEYS[1], 'version', version + 1, 'taken', revision)
+return {version, redis.call('HGET', KEYS[1], 'fields'), moves}
+"""
+
+# KEYS: state hash, moves list.  ARGV: fields, version.
+RESET_SCRIPT = """
+local revision = tonumber(redis.call('HGET', KEYS[1], 'revision') or '0') + 1
+redis.call('HSET', KEYS[1], 'revision', revision, 'taken', revision, 'fields', ARGV[1], 'version', ARGV[2])
+redis.call('DEL', KEYS[2])
+return revision
+"""
+
+# KEYS: votes hash.  ARGV: field to set.
+VOTE_SCRIPT = """
+redis.call('HSET', KEYS[1], ARGV[1], 1)
+local outcome = false
+if redis.call('HGET', KEYS[1], 'yes:X') and redis.call('HGET', KEYS[1], 'yes:O') then
+    outcome = 'restart'
+elseif redis.call('HGET', KEYS[1], 'no:X') or redis.call('HGET', KEYS[1], 'no:O') then
+    outcome = 'cancel'
+end
+if outcome then
+    redis.call('DEL', KEYS[1])
+end
+return outcome
+"""
+
+# KEYS: lease.  ARGV: owner, milliseconds.
+ACQUIRE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if not owner or owner == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# KEYS: lease.  ARGV: owner.
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+"""
+
+# KEYS: socket counter.
+LEAVE_SCRIPT = """
+local sockets = redis.call('DECR', KEYS[1])
+if sockets <= 0 then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+return sockets
+"""
+
+SCRIPTS = {
+    'create': CREATE_SCRIPT,
+    'commit': COMMIT_SCRIPT,
+    'take': TAKE_SCRIPT,
+    'reset': RESET_SCRIPT,
+    'vote': VOTE_SCRIPT,
+    'acquire': ACQUIRE_SCRIPT,
+    'release': RELEASE_SCRIPT,
+    'leave': LEAVE_SCRIPT,
+}
+
+
+class RedisRoomBackend(RoomBackend):
+    shared = True
+
+    def __init__(self, url=None, prefix=DEFAULT_PREFIX, connect=None):
+        """
+        ``connect`` returns a new client with decode_responses set; by
+        default one for ``url``.
+        """
+        self.url = url or getattr(settings, 'ROOM_STATE_REDIS_URL', DEFAULT_REDIS_URL)
+        self.prefix = prefix
+        self.connect = connect or self._connect
+        # Event loop -> (client, scripts); a client only works on the loop it was made on.
+        self.clients = {}
+
+    def _connect(self):
+        import redis.asyncio
+
+        return redis.asyncio.from_url(self.url, decode_responses=True)
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        entry = self.clients.get(loop)
+        if entry is None:
+            for closed in [loop for loop in self.clients if loop.is_closed()]:
+                del self.clients[closed]
+            client = self.connect()
+            scripts = {name: client.register_script(source) for name, source in SCRIPTS.items()}
+            entry = self.clients[loop] = client, scripts
+        return entry
+
+    def _keys(self, room_code, *names):
+        return [f"{self.prefix}{room_code}:{name}" for name in names]
+
+    async def _run(self, script, keys, args=()):
+        return await self._client()[1][script](keys=keys, args=list(args))
+
+    async def get(self, room_code):
+        revision, fields = await self._client()[0].hmget(*self._keys(room_code, 'state'), 'revision', 'fields')
+        return None if revision is None else (int(revision), fields)
+
+    async def create(self, room_code, fields, version):
+        revision, fields = await self._run('create', self._keys(room_code, 'state', 'moves'), [fields, version])
+        return int(revision), fields
+
+    async def commit(self, room_code, revision, fields, moves=()):
+        revision = await self._run('commit', self._keys(room_code, 'state', 'moves'),
+                                   [revision, fields, *moves])
+        return None if revision is None else int(revision)
+
+    async def take(self, room_code):
+        batch = await self._run('take', self._keys(room_code, 'state', 'moves'))
+        if batch is None:
+            return None
+        version, fields, moves = batch
+        return int(version), fields, moves
+
+    async def reset(self, room_code, fields, version):
+        return int(await self._run('reset', self._keys(room_code, 'state', 'moves'), [fields, version]))
+
+    async def vote(self, room_code, player, vote):
+        return await self._run('vote', self._keys(room_code, 'votes'),
+                               [f"{'yes' if vote == 'yes' else 'no'}:{player}"])
+
+    async def clear_votes(self, room_code):
+        await self._client()[0].delete(*self._keys(room_code, 'votes'))
+
+    async def acquire(self, room_code, owner, ttl):
+        return bool(await self._run('acquire', self._keys(room_code, 'owner'), [owner, int(ttl * 1000)]))
+
+    async def release(self, room_code, owner):
+        await self._run('release', self._keys(room_code, 'owner'), [owner])
+
+    async def join(self, room_code):
+        return await self._client()[0].incr(*self._keys(room_code, 'sockets'))
+
+    async def leave(self, room_code):
+        return int(await self._run('leave', self._keys(room_code, 'sockets')))
+
+    async def delete(self, room_code):
+        await self._client()[0].delete(*self._keys(room_code, 'state', 'moves', 'votes'))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = import_string(getattr(settings, 'ROOM_STATE_BACKEND', DEFAULT_BACKEND))()
+        return _backend
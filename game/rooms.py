@@ -0,0 +1,502 @@
+"""
+Live state of the multiplayer rooms.
+
+While a room has sockets, its position, clocks and replay votes live in a
+room-state backend (game.room_backends): in this process's memory, or in
+Redis when several processes serve the same rooms.  Each process keeps a
+copy of the room's game; a change is played on the copy, checked there, and
+committed to the backend over the revision the copy was at.  When another
+process committed first, the copy is brought up to date and the change
+tried again on it, which re-validates a move against the new position.
+Moves are broadcast as soon as they are committed, without waiting on the
+database.
+
+One process at a time holds a room's lease.  It watches the room's clock and
+writes the room behind it: at most every ROOM_FLUSH_INTERVAL seconds the
+moves committed since the last flush and the game's live fields are written
+as one batch (Game.write_changes).  The lease holder also flushes a room when
+its game ends and when its last socket leaves, and flushes every room when
+the process exits.  Another process takes the lease over when it has not
+been renewed for ROOM_LEASE_TIMEOUT seconds.
+
+Clocks are not ticked: the player to move is charged lazily from the start
+of the turn, and the lease holder only keeps the flag-fall deadline of the
+room in the process's ClockScheduler (game.clocks).  An idle room makes no
+commits and no queries until then; when the deadline comes, the game is
+ended if the player to move is still out of time.  Clients are not sent the
+clocks every second either: the events of the room carry the deadline of
+the player to move, which the client counts down to (see game_data).
+
+A batch that fails to write stays on the room and is written again, before
+anything newer, by the next flushes.  Only once ROOM_FLUSH_RETRIES flushes
+of it have failed is the database taken as the last good copy: the room is
+loaded again from it and its sockets are sent that position.
+
+With room affinity (game.affinity) each room is served by one worker.  When
+the membership changes, a worker hands each room it lost over: the room stops
+taking changes, is flushed, and its sockets are told to connect again, which
+takes them to the new owner; a move sent meanwhile is answered the same way
+and sent again by the client.
+
+Settings:
+    ROOM_FLUSH_INTERVAL  seconds between write-behind flushes of a room.
+    ROOM_LEASE_TIMEOUT   seconds before another process takes a room over.
+    ROOM_FLUSH_RETRIES   flushes of a failed batch tried before the room is reloaded.
+    CLOCK_RESYNC_INTERVAL  seconds between a client's clock resyncs.
+"""
+import asyncio
+import atexit
+import json
+import logging
+import threading
+import uuid
+from datetime import datetime
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+
+from . import affinity
+from .models import WRITE_RETRIES, Game, GameConflict, Move
+from .protocol import broadcast_event
+from .results import record_game_result
+from .clocks import ClockScheduler
+from .room_backends import get_backend
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_LEASE_TIMEOUT = 10.0
+DEFAULT_FLUSH_RETRIES = 3
+DEFAULT_CLOCK_RESYNC_INTERVAL = 60
+
+# The fields of a game that change while it is played.
+LIVE_FIELDS = (
+    'player_x', 'player_o', 'state', 'board', 'ply', 'round', 'last_player', 'last_main_index',
+    'last_sub_index', 'active_index', 'winner', 'time_x', 'time_o', 'remaining_x', 'remaining_o',
+    'last_move_time',
+)
+MOVE_FIELDS = ('round', 'ply', 'symbol', 'main_index', 'sub_index', 'remaining_x', 'remaining_o', 'created')
+
+logger = logging.getLogger(__name__)
+
+
+def dump_fields(game):
+    values = {name: getattr(game, name) for name in LIVE_FIELDS}
+    if values['last_move_time']:
+        values['last_move_time'] = values['last_move_time'].isoformat()
+    return json.dumps(values)
+
+
+def field_values(fields):
+    values = json.loads(fields)
+    if values['last_move_time']:
+        values['last_move_time'] = datetime.fromisoformat(values['last_move_time'])
+    return values
+
+
+def load_fields(game, fields):
+    for name, value in field_values(fields).items():
+        setattr(game, name, value)
+    game._engine = None
+    game.pending_moves.clear()
+
+
+def dump_move(move):
+    values = {name: getattr(move, name) for name in MOVE_FIELDS}
+    values['created'] = values['created'].isoformat()
+    return json.dumps(values)
+
+
+def load_move(game_id, move):
+    values = json.loads(move)
+    values['created'] = datetime.fromisoformat(values['created'])
+    return Move(game_id=game_id, **values)
+
+
+def load_game(room_code):
+    return Game.objects.get_or_create(room_code=room_code)[0]
+
+
+def write_batch(game_id, batch, retry=False):
+    """
+    Writes a batch from RoomBackend.take to the database.  Written again
+    after a failure (``retry``), the moves the first write committed are
+    left out.
+    """
+    version, fields, moves = batch
+    moves = [load_move(game_id, move) for move in moves]
+    if retry and moves:
+        written = set(Move.objects.filter(game_id=game_id).values_list('round', 'ply'))
+        moves = [move for move in moves if (move.round, move.ply) not in written]
+    Game.write_changes(game_id, moves, field_values(fields), version)
+
+
+def epoch_ms(moment):
+    return round(moment.timestamp() * 1000)
+
+
+def game_data(game, now=None):
+    """
+    The game as sent to clients.  The clocks are what is left as of
+    ``server_time``; while a clock runs, ``deadline`` is when the player to
+    move runs out of time.  Both are epoch milliseconds of the server's clock.
+    """
+    now = now or timezone.now()
+    deadline = game.flag_deadline()
+    return {
+        'next_player': game.next_player,
+        'player_x': game.player_x,
+        'player_o': game.player_o,
+        'winner': game.winner,
+        'board': game.board,
+        'active_index': game.active_index,
+        'time_x': game.time_x,
+        'time_o': game.time_o,
+        'remaining_x': round(game.clock_remaining('X', now)),
+        'remaining_o': round(game.clock_remaining('O', now)),
+        'server_time': epoch_ms(now),
+        'deadline': epoch_ms(deadline) if deadline else None,
+    }
+
+
+def clock_data(game, now=None):
+    "The clock fields of game_data, as events name them."
+    data = game_data(game, now)
+    return {
+        'time_x': data['remaining_x'],
+        'time_o': data['remaining_o'],
+        'server_time': data['server_time'],
+        'deadline': data['deadline'],
+    }
+
+
+def sync_data(client_time, game=None):
+    """
+    The reply to a client's clock sync: the server's time, against which the
+    client works out its offset from the round trip, and the room's clocks.
+    """
+    data = clock_data(game) if game is not None and game.state else {'server_time': epoch_ms(timezone.now())}
+    data.update(
+        type='sync',
+        client_time=client_time,
+        resync=getattr(settings, 'CLOCK_RESYNC_INTERVAL', DEFAULT_CLOCK_RESYNC_INTERVAL),
+    )
+    return data
+
+
+def timeout_event(flagged, winner):
+    return {
+        'type': 'surrender',
+        'winner': winner,
+        'message': f"⏰ {flagged} ran out of time. {winner} wins!",
+    }
+
+
+class RoomMoved(Exception):
+    "The room was handed over to another worker."
+
+    def __init__(self, url=None):
+        super().__init__("The room moved to another worker")
+        self.url = url
+
+
+class Room:
+    "This process's copy of a room."
+
+    def __init__(self, room_code, game, revision):
+        self.room_code = room_code
+        self.group_name = f"game_{room_code}"
+        self.game = game
+        self.revision = revision
+        # Serializes this process's changes; the backend orders processes.
+        self.lock = asyncio.Lock()
+        self.connections = 0
+        self.owned = False
+        # Set once the room is handed over; the URL clients connect to, or
+        # '' to connect to the same one again.
+        self.moved_to = None
+        # A batch taken from the backend that failed to write, and how many
+        # flushes of it failed.
+        self.unflushed = None
+        self.flush_failures = 0
+
+    def data(self):
+        return game_data(self.game)
+
+
+class RoomRegistry:
+    def __init__(self, backend=None, flush_interval=None, lease_timeout=None, flush_retries=None):
+        self.backend = backend or get_backend()
+        self.flush_interval = flush_interval if flush_interval is not None else \
+            getattr(settings, 'ROOM_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        self.lease_timeout = lease_timeout if lease_timeout is not None else \
+            getattr(settings, 'ROOM_LEASE_TIMEOUT', DEFAULT_LEASE_TIMEOUT)
+        self.flush_retries = flush_retries or getattr(settings, 'ROOM_FLUSH_RETRIES', DEFAULT_FLUSH_RETRIES)
+        self.owner = uuid.uuid4().hex
+        self.rooms = {}
+        self.clocks = ClockScheduler()
+        self.flusher = None
+        self.listener = None
+        self.flushes = 0
+        self.failures = 0
+        self.migrations = 0
+
+    async def join(self, room_code):
+        "Returns the room, making it live on the first join."
+        room = self.rooms.get(room_code)
+        if room is None:
+            game = await database_sync_to_async(load_game)(room_code)
+            revision, fields = await self.backend.create(room_code, dump_fields(game), game.version)
+            # Another socket may have loaded the room meanwhile.
+            room = self.rooms.setdefault(room_code, Room(room_code, game, None))
+            if room.revision is None:
+                room.revision = revision
+                load_fields(game, fields)
+        room.connections += 1
+        await self.backend.join(room_code)
+        await self._claim(room)
+        loop = asyncio.get_running_loop()
+        if self.flusher is None or self.flusher.done() or self.flusher.get_loop() is not loop:
+            self.flusher = loop.create_task(self._flush_loop())
+        if affinity.get_ring().workers and (
+                self.listener is None or self.listener.done() or self.listener.get_loop() is not loop):
+            self.listener = loop.create_task(self._listen())
+        return room
+
+    async def leave(self, room):
+        "Flushes and forgets the room once this process's last socket has left it."
+        room.connections -= 1
+        remaining = await self.backend.leave(room.room_code)
+        if room.connections > 0 or room.moved_to is not None:
+            return
+        if remaining == 0:
+            # Whoever holds the lease, the last socket out writes the room.
+            await self._claim(room)
+        self.clocks.cancel(room.room_code)
+        await self.flush(room)
+        while room.unflushed is not None:
+            # Nothing else would write it once the room is forgotten.
+            await asyncio.sleep(self.flush_interval)
+            await self.flush(room)
+        if remaining == 0:
+            await self.backend.delete(room.room_code)
+        if room.owned:
+            await self.backend.release(room.room_code, self.owner)
+            room.owned = False
+        if room.connections <= 0 and self.rooms.get(room.room_code) is room:
+            del self.rooms[room.room_code]
+
+    async def refresh(self, room):
+        "Brings the room's copy up to date with the backend."
+        async with room.lock:
+            await self._sync(room)
+
+    async def _sync(self, room):
+        current = await self.backend.get(room.room_code)
+        if current is None:
+            # Made live again from the database after the room emptied.
+            game = await database_sync_to_async(load_game)(room.room_code)
+            current = await self.backend.create(room.room_code, dump_fields(game), game.version)
+            room.game = game
+        revision, fields = current
+        if revision != room.revision:
+            room.revision = revision
+            load_fields(room.game, fields)
+            self._watch_clock(room)
+
+    async def update(self, room, change):
+        """
+        Runs ``change(game)`` on the room's game and commits the result,
+        with the moves it applied with ``persist=False``.  Returns what
+        ``change`` returned; exceptions from it are raised as they are.
+        """
+        async with room.lock:
+            for attempt in range(WRITE_RETRIES):
+                if room.moved_to is not None:
+                    raise RoomMoved(room.moved_to)
+                game = room.game
+                result = change(game)
+                moves = [dump_move(move) for move in game.pending_moves]
+                game.pending_moves.clear()
+                revision = await self.backend.commit(room.room_code, room.revision, dump_fields(game), moves)
+                if revision is not None:
+                    room.revision = revision
+                    self._watch_clock(room)
+                    return result
+                await self._sync(room)
+            raise GameConflict("The room was changed by another process")
+
+    async def rebalance(self):
+        "Hands over the rooms that the ring now gives to other workers."
+        for room in list(self.rooms.values()):
+            url = affinity.remote_url(room.room_code)
+            if url is not None:
+                await self.migrate(room, url)
+
+    async def migrate(self, room, url):
+        """
+        Hands the room over to the worker at ``url``: once the change in
+        progress is committed, the room takes no more changes; it is
+        flushed, so the new owner loads every move, and its sockets are told
+        to connect again.
+        """
+        async with room.lock:
+            if getattr(settings, 'ROOM_AFFINITY_MODE', 'forward') == 'redirect':
+                room.moved_to = url + f"/ws/game/{room.room_code}/"
+            else:
+                room.moved_to = ''
+        await self._claim(room)
+        self.clocks.cancel(room.room_code)
+        await self.flush(room)
+        if not self.backend.shared:
+            # The new owner's backend loads the room from the database.
+            await self.backend.delete(room.room_code)
+        await self.backend.release(room.room_code, self.owner)
+        room.owned = False
+        if self.rooms.get(room.room_code) is room:
+            del self.rooms[room.room_code]
+        self.migrations += 1
+        await get_channel_layer().group_send(room.group_name, {'type': 'room_moved', 'url': room.moved_to})
+
+    async def _listen(self):
+        "Follows membership changes sent by ``manage.py rebalance_rooms``."
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(affinity.WORKERS_GROUP, channel)
+        try:
+            while True:
+                message = await layer.receive(channel)
+                if message.get('type') == 'workers.changed':
+                    affinity.set_workers(message['workers'])
+                    await self.rebalance()
+        finally:
+            await layer.group_discard(affinity.WORKERS_GROUP, channel)
+
+    async def vote(self, room, player, vote):
+        return await self.backend.vote(room.room_code, player, vote)
+
+    async def clear_votes(self, room):
+        await self.backend.clear_votes(room.room_code)
+
+    async def _claim(self, room):
+        "Takes or renews the room's lease, watching its clock while it is held."
+        owned = await self.backend.acquire(room.room_code, self.owner, self.lease_timeout)
+        if owned != room.owned:
+            room.owned = owned
+            self._watch_clock(room)
+
+    def _watch_clock(self, room):
+        "Schedules the flag fall of the room's player to move, if this process holds the room."
+        deadline = room.game.flag_deadline() if room.owned and room.moved_to is None else None
+        if deadline is None:
+            self.clocks.cancel(room.room_code)
+        elif self.clocks.deadline(room.room_code) != deadline:
+            self.clocks.schedule(room.room_code, deadline, lambda: self._flag_fall(room))
+
+    async def _flag_fall(self, room):
+        if self.rooms.get(room.room_code) is not room or not room.owned:
+            return
+        await self.refresh(room)
+        try:
+            flagged = await self.update(room, lambda game: game.check_flag())
+        except (GameConflict, RoomMoved):
+            return
+        if flagged:
+            await get_channel_layer().group_send(room.group_name,
+                                                 broadcast_event(timeout_event(flagged, room.game.winner)))
+            await self.flush(room)
+            record_game_result(room.game, room.game.winner)
+        else:
+            # The deadline moved on meanwhile; update rescheduled it.
+            self._watch_clock(room)
+
+    async def _flush_loop(self):
+        while self.rooms:
+            await asyncio.sleep(self.flush_interval)
+            for room in list(self.rooms.values()):
+                await self._claim(room)
+                if room.owned and self.backend.shared:
+                    # Picks up the deadline of moves made in other processes.
+                    await self.refresh(room)
+                await self.flush(room)
+
+    async def flush(self, room):
+        """
+        Writes what was committed to the room since its last flush, if this
+        process holds the room's lease; otherwise the holder writes it.
+        The batch is taken from the backend at once, so moves keep being
+        played while it is written.  A batch that failed is written again
+        first, and nothing newer is taken until it is.
+        """
+        if not room.owned:
+            return
+        retry = room.unflushed is not None
+        batch = room.unflushed if retry else await self.backend.take(room.room_code)
+        if batch is None:
+            return
+        try:
+            await database_sync_to_async(write_batch)(room.game.pk, batch, retry)
+        except Exception:
+            self.failures += 1
+            room.flush_failures += 1
+            logger.exception("Error flushing room %s (attempt %d of %d)",
+                             room.room_code, room.flush_failures, self.flush_retries)
+            room.unflushed = batch
+            if room.flush_failures >= self.flush_retries:
+                await self._reload(room)
+            return
+        self.flushes += 1
+        room.unflushed = None
+        room.flush_failures = 0
+        if retry:
+            await self.flush(room)
+
+    async def _reload(self, room):
+        "Gives up the room's unwritten changes and sends its sockets the position in the database."
+        room.unflushed = None
+        room.flush_failures = 0
+        game = await database_sync_to_async(Game.objects.get)(pk=room.game.pk)
+        async with room.lock:
+            room.revision = await self.backend.reset(room.room_code, dump_fields(game), game.version)
+            room.game = game
+            self._watch_clock(room)
+        await get_channel_layer().group_send(room.group_name, {'type': 'start_game'})
+
+    def flush_all(self):
+        "Writes every room this process holds; for when its event loop is gone."
+        for room in list(self.rooms.values()):
+            if not room.owned:
+                continue
+            try:
+                if room.unflushed is not None:
+                    write_batch(room.game.pk, room.unflushed, retry=True)
+                    room.unflushed = None
+                batch = asyncio.run(self.backend.take(room.room_code))
+                if batch is not None:
+                    write_batch(room.game.pk, batch)
+            except Exception:
+                logger.exception("Error flushing room %s", room.room_code)
+
+    def stats(self):
+        return {
+            'rooms': len(self.rooms),
+            'owned': sum(room.owned for room in self.rooms.values()),
+            'flushes': self.flushes,
+            'failures': self.failures,
+            'migrations': self.migrations,
+            'clocks': len(self.clocks),
+            'flags': self.clocks.fired,
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = RoomRegistry()
+            atexit.register(_registry.flush_all)
+        return _registry
@@ -1,8 +1,9 @@
 from django.urls import path, re_path
+from game.affinity import RoomAffinityMiddleware
 from game.consumers import GameConsumer
 
 
 websocket_urlpatterns = [
-    re_path(r"ws/game/(?P<room_code>\w+)/$", GameConsumer.as_asgi()),
+    re_path(r"ws/game/(?P<room_code>\w+)/$", RoomAffinityMiddleware(GameConsumer.as_asgi())),
 ]
 
@@ -0,0 +1,151 @@
+"""
+Admission-controlled, fair scheduling of AI moves across games.
+
+Every AI move asks the scheduler for one of a fixed number of compute slots
+(AI_SCHEDULER_SLOTS, by default one per move-service worker).  Waiting
+requests are granted slots round-robin by game, so a game that queues many
+moves cannot starve the others.  The think time of each granted move shrinks
+as the backlog grows, which trades AI strength for latency under load, and
+when the backlog is over AI_SCHEDULER_MAX_QUEUE new requests are shed straight
+to the fallback player instead of being queued.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+from . import ai_service
+
+DEFAULT_MAX_QUEUE = 100
+DEFAULT_MIN_THINK_TIME = 0.05
+
+
+class MoveScheduler:
+    def __init__(self, slots=None, max_queue=None, min_think_time=None):
+        self.slots = slots if slots is not None else \
+            getattr(settings, 'AI_SCHEDULER_SLOTS', None) or max(1, ai_service.get_workers())
+        self.max_queue = max_queue if max_queue is not None else \
+            getattr(settings, 'AI_SCHEDULER_MAX_QUEUE', DEFAULT_MAX_QUEUE)
+        self.min_think_time = min_think_time if min_think_time is not None else \
+            getattr(settings, 'AI_MIN_THINK_TIME', DEFAULT_MIN_THINK_TIME)
+        self.lock = threading.Condition()
+        self.running = 0
+        # Game key -> deque of waiting tickets, in round-robin order.
+        self.waiting = OrderedDict()
+        self.queued = 0
+        self.requests = 0
+        self.shed = 0
+        self.degraded = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_queue_seen = 0
+
+    # -------------------------------------------------------------- admission
+
+    def acquire(self, game_key):
+        """
+        Waits for a slot and returns the think time granted to the move, or
+        None when the request was shed.
+        """
+        ticket = object()
+        started = time.monotonic()
+        with self.lock:
+            self.requests += 1
+            if self.queued >= self.max_queue:
+                self.shed += 1
+                return None
+            self.waiting.setdefault(game_key, deque()).append(ticket)
+            self.queued += 1
+            self.max_queue_seen = max(self.max_queue_seen, self.queued)
+            while not (self.running < self.slots and self._next_ticket() is ticket):
+                self.lock.wait()
+            self._pop_next()
+            self.running += 1
+            waited = time.monotonic() - started
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            budget = self.think_time()
+            if budget < ai_service.get_timeout():
+                self.degraded += 1
+            # Another slot may still be free for the next game in line.
+            self.lock.notify_all()
+            return budget
+
+    def release(self):
+        with self.lock:
+            self.running -= 1
+            self.lock.notify_all()
+
+    def think_time(self):
+        "Per-move budget: the full timeout, divided by the load per slot."
+        load = (self.running + self.queued) / self.slots
+        return max(self.min_think_time, ai_service.get_timeout() / max(1.0, load))
+
+    def _next_ticket(self):
+        for tickets in self.waiting.values():
+            return tickets[0]
+        return None
+
+    def _pop_next(self):
+        game_key, tickets = next(iter(self.waiting.items()))
+        tickets.popleft()
+        self.queued -= 1
+        del self.waiting[game_key]
+        if tickets:
+            # The game goes to the back of the rotation with its other moves.
+            self.waiting[game_key] = tickets
+
+    # ------------------------------------------------------------------ moves
+
+    def request_move(self, game_key, player_name, engine, remaining=None):
+        "Schedules an AI move and returns its (main_index, sub_index)."
+        budget = self.acquire(game_key)
+        if budget is None:
+            return ai_service.fallback_move(engine)
+        try:
+            return ai_service.request_move(player_name, engine, remaining, timeout=budget)
+        finally:
+            self.release()
+
+    async def request_move_async(self, game_key, player_name, engine, remaining=None):
+        """
+        Awaitable request_move: only the wait for a slot takes a thread; the
+        move itself is awaited on the move service.
+        """
+        budget = await asyncio.to_thread(self.acquire, game_key)
+        if budget is None:
+            return ai_service.fallback_move(engine)
+        try:
+            return await ai_service.request_move_async(player_name, engine, remaining, timeout=budget)
+        finally:
+            self.release()
+
+    def stats(self):
+        with self.lock:
+            granted = self.requests - self.shed - self.queued
+            return {
+                'slots': self.slots,
+                'running': self.running,
+                'queue_depth': self.queued,
+                'max_queue_depth': self.max_queue_seen,
+                'requests': self.requests,
+                'shed': self.shed,
+                'degraded': self.degraded,
+                'avg_wait': self.total_wait / granted if granted else 0.0,
+                'max_wait': self.max_wait,
+                'think_time': self.think_time(),
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = MoveScheduler()
+        return _scheduler
@@ -0,0 +1,267 @@
+"""
+Anytime whole-board search for ultimate tic-tac-toe.
+
+Iterative-deepening negamax with alpha-beta pruning over the bitboard engine.
+The search checks its wall-clock and node budget every few hundred nodes and
+always returns the best move of the deepest finished iteration, so the caller
+gets an answer in bounded time no matter how large the position is.
+"""
+import time
+from array import array
+
+from .engine import BITS, FULL, IS_WIN, WIN_MASKS
+from .tables import STATES, TERNARY, decode, get_table
+from .transposition import EXACT, LOWER, UPPER, PositionHash, from_canonical, to_canonical
+
+WIN_SCORE = 100000
+INFINITY = 10 * WIN_SCORE
+
+POPCOUNT = tuple(len(bits) for bits in BITS)
+
+# Number of winning lines through each cell, used to weigh cells and boards.
+CELL_WEIGHT = (3, 2, 3, 2, 4, 2, 3, 2, 3)
+CELL_RANK = tuple(sorted(range(9), key=lambda i: -CELL_WEIGHT[i]).index(i) for i in range(9))
+
+# Value of an open line holding 0-3 marks of one side and none of the other.
+SUB_LINE = (0, 1, 6, 0)
+META_LINE = (0, 30, 200, 0)
+BOARD_WON = 60
+# Bonus per side that wins a sub-board under perfect play, and per threat.
+BOARD_VALUE = 8
+BOARD_THREAT = 3
+
+CHECK_EVERY = 256
+# Nodes this close to the horizon are cheaper to search than to look up.
+TABLE_MIN_DEPTH = 2
+
+_board_scores = None
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def board_scores():
+    """
+    Heuristic score of every sub-board state from X's point of view, indexed
+    like the sub-board table and built from it on first use.
+    """
+    global _board_scores
+    if _board_scores is None:
+        table = get_table()
+        scores = array('h', bytes(2 * STATES))
+        for code in range(STATES):
+            x, o = decode(code)
+            lines = 0
+            for win in WIN_MASKS:
+                if not win & o:
+                    lines += SUB_LINE[POPCOUNT[win & x]]
+                if not win & x:
+                    lines -= SUB_LINE[POPCOUNT[win & o]]
+            value = (table.score_x[code] > 0) - (table.score_o[code] > 0)
+            threats = POPCOUNT[table.threats_x[code]] - POPCOUNT[table.threats_o[code]]
+            scores[code] = lines + BOARD_VALUE * value + BOARD_THREAT * threats
+        _board_scores = scores
+    return _board_scores
+
+
+def evaluate(engine):
+    "Static score of the position from X's point of view."
+    table = get_table()
+    scores = board_scores()
+    won_x, won_o = engine.won_x, engine.won_o
+    # Drawn boards and open boards nobody can win any more block meta lines.
+    blocked = engine.drawn
+    score = 0
+    for i in BITS[FULL & ~engine.closed]:
+        code = TERNARY[engine.x[i]] + 2 * TERNARY[engine.o[i]]
+        if table.dead[code]:
+            blocked |= 1 << i
+        else:
+            score += scores[code] * CELL_WEIGHT[i]
+    for win in WIN_MASKS:
+        if win & blocked:
+            continue
+        if not win & won_o:
+            score += META_LINE[POPCOUNT[win & won_x]]
+        if not win & won_x:
+            score -= META_LINE[POPCOUNT[win & won_o]]
+    for i in BITS[won_x]:
+        score += BOARD_WON * CELL_WEIGHT[i]
+    for i in BITS[won_o]:
+        score -= BOARD_WON * CELL_WEIGHT[i]
+    return score
+
+
+class Search:
+    """
+    One search over a position.  ``time_limit`` is in seconds and
+    ``node_limit`` counts visited positions; either may be None but at least
+    one should be set.  ``table`` is an optional TranspositionTable, which
+    may be shared between searches.
+    """
+
+    def __init__(self, time_limit=None, node_limit=None, max_depth=None, table=None):
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.max_depth = max_depth
+        self.table = table
+        self.position = None
+        self.nodes = 0
+        self.depth = 0
+        self.score = 0
+        self.best_move = None
+        self.deadline = None
+
+    def run(self, engine):
+        "Returns the best (main_index, sub_index) found within the budget."
+        engine = engine.copy()
+        moves = self.ordered_moves(engine)
+        if not moves:
+            return None
+        self.best_move = moves[0]
+        if len(moves) == 1:
+            return self.best_move
+
+        self.nodes = 0
+        self.deadline = time.monotonic() + self.time_limit if self.time_limit is not None else None
+        if self.table is not None:
+            self.position = PositionHash(engine)
+        max_depth = min(self.max_depth or 81, 81 - sum(POPCOUNT[x | o] for x, o in zip(engine.x, engine.o)))
+        depth = 1
+        try:
+            while depth <= max_depth:
+                self.search_root(engine, moves, depth)
+                self.depth = depth
+                if abs(self.score) >= WIN_SCORE - 100:
+                    break
+                depth += 1
+        except SearchTimeout:
+            pass
+        return self.best_move
+
+    def search_root(self, engine, moves, depth):
+        # Search the previous best move first so an interrupted iteration is
+        # still at least as good as the last finished one.
+        moves.remove(self.best_move)
+        moves.insert(0, self.best_move)
+        alpha = -INFINITY
+        for move in moves:
+            self.play(engine, move)
+            try:
+                score = -self.negamax(engine, depth - 1, -INFINITY, -alpha, 1)
+            finally:
+                self.undo(engine)
+            if score > alpha:
+                alpha = score
+                self.best_move = move
+                self.score = score
+        return alpha
+
+    def negamax(self, engine, depth, alpha, beta, ply):
+        self.nodes += 1
+        if not self.nodes % CHECK_EVERY:
+            self.check_budget()
+
+        if engine.winner:
+            return 0 if engine.winner == 'draw' else ply - WIN_SCORE
+        if depth <= 0:
+            score = evaluate(engine)
+            return score if engine.turn == 'X' else -score
+
+        hash_move = None
+        use_table = self.table is not None and depth >= TABLE_MIN_DEPTH
+        if use_table:
+            key, symmetry = self.position.key(engine)
+            entry = self.table.probe(key)
+            if entry is not None:
+                entry_depth, flag, score, move = entry
+                if move is not None:
+                    hash_move = from_canonical(move, symmetry)
+                if entry_depth >= depth:
+                    score = from_table_score(score, ply)
+                    if flag == EXACT:
+                        return score
+                    if flag == LOWER and score >= beta:
+                        return score
+                    if flag == UPPER and score <= alpha:
+                        return score
+
+        original_alpha = alpha
+        best, best_move = -INFINITY, None
+        moves = self.ordered_moves(engine)
+        if hash_move in moves:
+            moves.remove(hash_move)
+            moves.insert(0, hash_move)
+        for move in moves:
+            self.play(engine, move)
+            try:
+                score = -self.negamax(engine, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                self.undo(engine)
+            if score > best:
+                best, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+
+        if use_table:
+            if best <= original_alpha:
+                flag = UPPER
+            elif best >= beta:
+                flag = LOWER
+            else:
+                flag = EXACT
+            self.table.store(key, depth, flag, to_table_score(best, ply), to_canonical(best_move, symmetry))
+        return best
+
+    def play(self, engine, move):
+        symbol = engine.turn
+        engine.play(*move)
+        if self.position is not None:
+            self.position.toggle(move[0], move[1], symbol)
+
+    def undo(self, engine):
+        main_index, sub_index = engine.history[-1][:2]
+        if self.position is not None:
+            self.position.toggle(main_index, sub_index, engine.cell(main_index, sub_index))
+        engine.undo()
+
+    def ordered_moves(self, engine):
+        "Sub-board wins first, then blocks, then cells on the most lines."
+        own, other = (engine.x, engine.o) if engine.turn == 'X' else (engine.o, engine.x)
+
+        def key(move):
+            main_index, sub_index = move
+            bit = 1 << sub_index
+            if IS_WIN[own[main_index] | bit]:
+                return 0
+            if IS_WIN[other[main_index] | bit]:
+                return 1
+            return 2 + CELL_RANK[sub_index]
+
+        return sorted(engine.legal_moves(), key=key)
+
+    def check_budget(self):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise SearchTimeout()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+
+
+def to_table_score(score, ply):
+    "Win scores are stored relative to the stored node, not the root."
+    if score >= WIN_SCORE - 100:
+        return score + ply
+    if score <= 100 - WIN_SCORE:
+        return score - ply
+    return score
+
+
+def from_table_score(score, ply):
+    if score >= WIN_SCORE - 100:
+        return score - ply
+    if score <= 100 - WIN_SCORE:
+        return score + ply
+    return score
@@ -0,0 +1,160 @@
+"""
+In-memory self-play between the registered players, for benchmarks and
+offline generation.  Nothing here touches the database.
+"""
+import concurrent.futures
+import math
+import random
+import time
+
+from .engine import UltimateBoard
+from .players import PLAYERS, choose_move, get_player, get_transposition_table
+from .transposition import TranspositionTable
+
+
+def resolve_player(name):
+    "Accepts a full player name, a class name or a short name like 'good'."
+    if name in PLAYERS:
+        return name
+    for full_name in PLAYERS:
+        class_name = full_name.rsplit('.', 1)[1]
+        if name.lower() in (class_name.lower(), class_name.lower().replace('player', '')):
+            return full_name
+    raise ValueError(f"Unknown player: {name}")
+
+
+def make_player(name, think_time=None):
+    "A player for one game; a searching player gets a table of its own."
+    player = get_player(name)
+    if think_time is not None and hasattr(player, 'max_think_time'):
+        player.max_think_time = think_time
+    if hasattr(player, 'table'):
+        player.table = TranspositionTable(get_transposition_table().memory_bytes)
+    return player
+
+
+def play_game(player_x, player_o, seed, think_time=None):
+    """
+    Plays one game and returns a dict with the winner ('X', 'O' or 'draw'),
+    the moves played and each side's per-move latencies in seconds.
+    """
+    random.seed(seed)
+    players = {'X': make_player(player_x, think_time), 'O': make_player(player_o, think_time)}
+    engine = UltimateBoard()
+    moves = []
+    latencies = {'X': [], 'O': []}
+    while not engine.winner:
+        symbol = engine.turn
+        started = time.perf_counter()
+        move = choose_move(players[symbol], engine)
+        latencies[symbol].append(time.perf_counter() - started)
+        if move is None or not engine.is_legal(*move):
+            # An illegal move forfeits the game.
+            engine.winner = 'O' if symbol == 'X' else 'X'
+            break
+        engine.play(*move)
+        moves.append(move)
+    return {'seed': seed, 'winner': engine.winner, 'moves': moves, 'latencies': latencies}
+
+
+def _play_pairing(args):
+    first, second, seed, think_time, swap = args
+    if swap:
+        result = play_game(second, first, seed, think_time)
+        first_symbol = 'O'
+    else:
+        result = play_game(first, second, seed, think_time)
+        first_symbol = 'X'
+    second_symbol = 'O' if first_symbol == 'X' else 'X'
+    return {
+        'seed': seed,
+        'first_symbol': first_symbol,
+        'winner': result['winner'],
+        'plies': len(result['moves']),
+        'first_latencies': result['latencies'][first_symbol],
+        'second_latencies': result['latencies'][second_symbol],
+    }
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+def latency_summary(values):
+    return {
+        'moves': len(values),
+        'mean': sum(values) / len(values) if values else 0.0,
+        'p50': percentile(values, 0.5),
+        'p90': percentile(values, 0.9),
+        'p99': percentile(values, 0.99),
+        'max': max(values) if values else 0.0,
+    }
+
+
+def elo_difference(score):
+    "Elo difference implied by a score fraction, clamped to +/-800."
+    if score <= 0:
+        return -800.0
+    if score >= 1:
+        return 800.0
+    return max(-800.0, min(800.0, -400 * math.log10(1 / score - 1)))
+
+
+def run_tournament(first, second, games, seed=0, think_time=None, workers=1):
+    """
+    Plays ``games`` games between two players, alternating who plays X, and
+    returns the summary from the first player's point of view.  Latencies
+    are by seat, 'first' and 'second', so a player can play itself.
+    """
+    first, second = resolve_player(first), resolve_player(second)
+    pairings = [(first, second, seed + i, think_time, bool(i % 2)) for i in range(games)]
+    started = time.perf_counter()
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_play_pairing, pairings))
+    else:
+        results = [_play_pairing(pairing) for pairing in pairings]
+    elapsed = time.perf_counter() - started
+
+    wins = sum(1 for r in results if r['winner'] == r['first_symbol'])
+    draws = sum(1 for r in results if r['winner'] == 'draw')
+    losses = len(results) - wins - draws
+    score = (wins + draws / 2) / len(results) if results else 0.0
+    return {
+        'first': first,
+        'second': second,
+        'games': len(results),
+        'seed': seed,
+        'think_time': think_time,
+        'wins': wins,
+        'draws': draws,
+        'losses': losses,
+        'score': score,
+        'elo': elo_difference(score) if results else 0.0,
+        'elapsed': elapsed,
+        'games_per_second': len(results) / elapsed if elapsed else 0.0,
+        'avg_plies': sum(r['plies'] for r in results) / len(results) if results else 0.0,
+        'latency': {
+            'first': latency_summary([t for r in results for t in r['first_latencies']]),
+            'second': latency_summary([t for r in results for t in r['second_latencies']]),
+        },
+    }
+
+
+def compare(result, baseline):
+    """
+    Returns the changes between two tournament results as a dict of
+    metric -> (baseline, current).
+    """
+    changes = {}
+    for key in ('score', 'elo', 'games_per_second'):
+        changes[key] = (baseline.get(key), result.get(key))
+    for seat, summary in result['latency'].items():
+        base = baseline.get('latency', {}).get(seat, {})
+        for key in ('p50', 'p90', 'p99'):
+            changes[f'{seat}.{key}'] = (base.get(key), summary[key])
+    return changes
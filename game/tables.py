@@ -0,0 +1,203 @@
+"""
+Precomputed outcome table for every 3x3 sub-board.
+
+A sub-board is indexed by its base-3 encoding (cell i contributes 3**i for
+X and 2 * 3**i for O), which is what ``index(x, o)`` computes from the engine
+bitmasks with two lookups.  For each of the 19,683 states the table stores,
+for X to move and for O to move, the minimax score and the mask of optimal
+moves, plus the winning threats of each side and whether the board is dead
+(decided, or no line can be completed by either side any more).
+
+The table is built once per process.  ``load_table`` reads it from the
+compressed file shipped in ``game/data`` and falls back to solving it from
+scratch; ``write_table`` regenerates that file.
+"""
+import os
+import zlib
+from array import array
+
+from .engine import BITS, FULL, IS_WIN, WIN_MASKS
+
+STATES = 3 ** 9
+TABLE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'subboard_table.bin')
+TABLE_VERSION = 1
+
+TERNARY = tuple(sum(3 ** i for i in BITS[mask]) for mask in range(512))
+
+# Order in which equally good moves are listed: center, corners, sides.
+MOVE_ORDER = (4, 0, 2, 6, 8, 1, 3, 5, 7)
+
+
+def index(x, o):
+    return TERNARY[x] + 2 * TERNARY[o]
+
+
+def decode(code):
+    "Returns the (x, o) masks of a base-3 board code."
+    x = o = 0
+    for i in range(9):
+        code, digit = divmod(code, 3)
+        if digit == 1:
+            x |= 1 << i
+        elif digit == 2:
+            o |= 1 << i
+    return x, o
+
+
+def threats(own, other):
+    "Empty cells that would complete a line for the owner of ``own``."
+    empty = FULL & ~(own | other)
+    mask = 0
+    for win in WIN_MASKS:
+        if not win & other:
+            missing = win & ~own
+            if missing & empty and not missing & (missing - 1):
+                mask |= missing
+    return mask
+
+
+def is_dead(x, o):
+    if IS_WIN[x] or IS_WIN[o] or x | o == FULL:
+        return True
+    return all(win & x and win & o for win in WIN_MASKS)
+
+
+class SubBoardTable:
+    """
+    Scores are from the point of view of the side to move: positive wins,
+    negative loses, zero draws, and a larger magnitude means the game ends
+    sooner (so quick wins and slow losses are preferred).
+    """
+
+    def __init__(self, score_x, score_o, best_x, best_o, threats_x, threats_o, dead):
+        self.score_x = score_x
+        self.score_o = score_o
+        self.best_x = best_x
+        self.best_o = best_o
+        self.threats_x = threats_x
+        self.threats_o = threats_o
+        self.dead = dead
+
+    @classmethod
+    def build(cls):
+        score_x, score_o = array('b', bytes(STATES)), array('b', bytes(STATES))
+        best_x, best_o = array('H', bytes(2 * STATES)), array('H', bytes(2 * STATES))
+        threats_x, threats_o = array('H', bytes(2 * STATES)), array('H', bytes(2 * STATES))
+        dead = bytearray(STATES)
+        scores = {'X': score_x, 'O': score_o}
+        bests = {'X': best_x, 'O': best_o}
+        solved = {'X': bytearray(STATES), 'O': bytearray(STATES)}
+
+        def solve(x, o, turn):
+            code = index(x, o)
+            if solved[turn][code]:
+                return scores[turn][code]
+            empty = FULL & ~(x | o)
+            empties = len(BITS[empty])
+            if IS_WIN[x] or IS_WIN[o]:
+                winner = 'X' if IS_WIN[x] else 'O'
+                score = empties + 1 if winner == turn else -(empties + 1)
+                best = 0
+            elif not empty:
+                score, best = 0, 0
+            else:
+                score, best = None, 0
+                for cell in BITS[empty]:
+                    bit = 1 << cell
+                    if turn == 'X':
+                        child = -solve(x | bit, o, 'O')
+                    else:
+                        child = -solve(x, o | bit, 'X')
+                    if score is None or child > score:
+                        score, best = child, bit
+                    elif child == score:
+                        best |= bit
+            scores[turn][code] = score
+            bests[turn][code] = best
+            solved[turn][code] = 1
+            return score
+
+        for code in range(STATES):
+            x, o = decode(code)
+            solve(x, o, 'X')
+            solve(x, o, 'O')
+            threats_x[code] = threats(x, o)
+            threats_o[code] = threats(o, x)
+            dead[code] = is_dead(x, o)
+        return cls(score_x, score_o, best_x, best_o, threats_x, threats_o, dead)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = zlib.decompress(data)
+        if data[0] != TABLE_VERSION:
+            raise ValueError("Unsupported sub-board table version")
+        offset = 1
+        columns = []
+        for typecode in ('b', 'b', 'H', 'H', 'H', 'H'):
+            column = array(typecode)
+            size = STATES * column.itemsize
+            column.frombytes(data[offset:offset + size])
+            columns.append(column)
+            offset += size
+        dead = bytearray(data[offset:offset + STATES])
+        if len(dead) != STATES:
+            raise ValueError("Truncated sub-board table")
+        return cls(*columns, dead)
+
+    def to_bytes(self):
+        parts = [bytes([TABLE_VERSION])]
+        for column in (self.score_x, self.score_o, self.best_x, self.best_o, self.threats_x, self.threats_o):
+            parts.append(column.tobytes())
+        parts.append(bytes(self.dead))
+        return zlib.compress(b''.join(parts), 9)
+
+    # ------------------------------------------------------------------ lookups
+
+    def score(self, x, o, turn):
+        code = index(x, o)
+        return self.score_x[code] if turn == 'X' else self.score_o[code]
+
+    def value(self, x, o, turn):
+        "Game-theoretic value with ``turn`` to move: 1 win, 0 draw, -1 loss."
+        score = self.score(x, o, turn)
+        return (score > 0) - (score < 0)
+
+    def best_moves(self, x, o, turn):
+        "Optimal moves for ``turn``, ordered center, corners, sides."
+        code = index(x, o)
+        mask = self.best_x[code] if turn == 'X' else self.best_o[code]
+        return [cell for cell in MOVE_ORDER if mask >> cell & 1]
+
+    def threats(self, x, o, symbol):
+        "Mask of empty cells that complete a line for ``symbol``."
+        code = index(x, o)
+        return self.threats_x[code] if symbol == 'X' else self.threats_o[code]
+
+    def is_dead(self, x, o):
+        return bool(self.dead[index(x, o)])
+
+
+def write_table(path=TABLE_PATH):
+    table = SubBoardTable.build()
+    with open(path, 'wb') as f:
+        f.write(table.to_bytes())
+    return table
+
+
+def load_table(path=TABLE_PATH):
+    try:
+        with open(path, 'rb') as f:
+            return SubBoardTable.from_bytes(f.read())
+    except (OSError, ValueError, zlib.error):
+        return SubBoardTable.build()
+
+
+_table = None
+
+
+def get_table():
+    "Returns the process-wide table, loading it on first use."
+    global _table
+    if _table is None:
+        _table = load_table()
+    return _table
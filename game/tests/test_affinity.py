@@ -0,0 +1,201 @@
+import asyncio
+from io import StringIO
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from game.affinity import WORKERS_GROUP, HashRing, forwarded_value, remote_url, set_workers
+from game.models import Game
+from game.rooms import get_registry
+from game.tests.test_consumers import application, connect, drain
+
+HERE = {'here': 'ws://here:8001'}
+BOTH = {'here': 'ws://here:8001', 'there': 'ws://there:8001'}
+
+
+async def closed(socket):
+    "The close code of the socket, skipping what was sent before."
+    while True:
+        output = await socket.receive_output(timeout=2)
+        if output['type'] == 'websocket.close':
+            return output.get('code')
+
+
+def room_owned_by(ring, owner, prefix):
+    return next(code for code in (f"{prefix}{i:03d}" for i in range(1000)) if ring.owner(code) == owner)
+
+
+class HashRingTest(TestCase):
+    codes = [f"{i:06X}" for i in range(3000)]
+
+    def test_owner(self):
+        ring = HashRing({'a': 'ws://a', 'b': 'ws://b', 'c': 'ws://c'})
+        owners = [ring.owner(code) for code in self.codes]
+        self.assertEqual(owners, [HashRing(ring.workers).owner(code) for code in self.codes])
+        for name in 'abc':
+            self.assertGreater(owners.count(name), len(self.codes) / 6)
+        self.assertIsNone(HashRing().owner('ABC123'))
+
+    def test_membership_changes_move_few_rooms(self):
+        before = HashRing({'a': 'ws://a', 'b': 'ws://b', 'c': 'ws://c'})
+        after = HashRing({'a': 'ws://a', 'b': 'ws://b', 'c': 'ws://c', 'd': 'ws://d'})
+        moved = [code for code in self.codes if before.owner(code) != after.owner(code)]
+        self.assertTrue(all(after.owner(code) == 'd' for code in moved))
+        self.assertLess(len(moved), len(self.codes) / 3)
+        # Leaving only moves the rooms of the worker that left.
+        without_a = HashRing({'b': 'ws://b', 'c': 'ws://c'})
+        self.assertTrue(all(before.owner(code) == 'a' for code in self.codes
+                            if without_a.owner(code) != before.owner(code)))
+
+    @override_settings(ROOM_WORKER_NAME='here')
+    def test_remote_url(self):
+        try:
+            set_workers(BOTH)
+            ring = HashRing(BOTH)
+            self.assertIsNone(remote_url(room_owned_by(ring, 'here', 'H')))
+            self.assertEqual(remote_url(room_owned_by(ring, 'there', 'T')), 'ws://there:8001')
+            set_workers({})
+            self.assertIsNone(remote_url(room_owned_by(ring, 'there', 'T')))
+        finally:
+            set_workers({})
+
+
+@override_settings(ROOM_WORKER_NAME='here')
+class AffinityMiddlewareTest(TransactionTestCase):
+    def tearDown(self):
+        set_workers({})
+
+    @override_settings(ROOM_AFFINITY_MODE='redirect')
+    def test_redirect(self):
+        set_workers(BOTH)
+        code = room_owned_by(HashRing(BOTH), 'there', 'R')
+
+        async def run():
+            socket = await connect(code)
+            message = await socket.receive_json_from()
+            closed = await socket.receive_output()
+            return message, closed
+
+        message, closed = asyncio.run(run())
+        self.assertEqual(message, {'type': 'redirect', 'url': f"ws://there:8001/ws/game/{code}/", 'seat': None})
+        self.assertEqual(closed, {'type': 'websocket.close', 'code': 4000})
+        self.assertFalse(Game.objects.filter(room_code=code).exists())
+
+    def test_forward(self):
+        seen = []
+
+        async def echo(request):
+            seen.append((request.path, request.headers.get('X-Room-Forwarded')))
+            ws = web.WebSocketResponse()
+            await ws.prepare(request)
+            async for message in ws:
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    await ws.send_str(message.data.upper())
+            return ws
+
+        async def run():
+            app = web.Application()
+            app.router.add_get('/ws/game/{code}/', echo)
+            server = TestServer(app)
+            await server.start_server()
+            try:
+                workers = {'here': 'ws://here:8001', 'there': f"ws://{server.host}:{server.port}"}
+                set_workers(workers)
+                code = room_owned_by(HashRing(workers), 'there', 'F')
+                socket = await connect(code)
+                await socket.send_to(text_data='hello')
+                reply = await socket.receive_from()
+                await socket.disconnect()
+                return code, reply
+            finally:
+                await server.close()
+
+        code, reply = asyncio.run(run())
+        self.assertEqual(reply, 'HELLO')
+        self.assertEqual(seen, [(f"/ws/game/{code}/", forwarded_value(code))])
+
+    @override_settings(ROOM_AFFINITY_MODE='redirect')
+    def test_forwarded_header_must_be_signed(self):
+        set_workers(BOTH)
+        code = room_owned_by(HashRing(BOTH), 'there', 'S')
+
+        async def run(value):
+            socket = WebsocketCommunicator(application, f"/ws/game/{code}/",
+                                           headers=[(b'x-room-forwarded', value.encode())])
+            await socket.connect()
+            message = await socket.receive_json_from()
+            await socket.disconnect()
+            return message['type']
+
+        # A client cannot claim it was forwarded, nor reuse another room's header.
+        self.assertEqual(asyncio.run(run('1')), 'redirect')
+        self.assertEqual(asyncio.run(run(forwarded_value('OTHER1'))), 'redirect')
+        self.assertEqual(asyncio.run(run(forwarded_value(code))), 'player_assignment')
+
+
+@override_settings(ROOM_WORKER_NAME='here')
+class RebalanceTest(TransactionTestCase):
+    def setUp(self):
+        set_workers(HERE)
+        self.code = room_owned_by(HashRing(BOTH), 'there', 'M')
+
+    def tearDown(self):
+        set_workers({})
+
+    def test_rooms_move_without_losing_moves(self):
+        registry = get_registry()
+
+        async def run():
+            sockets = [await connect(self.code), await connect(self.code)]
+            for socket in sockets:
+                await drain(socket)
+            await sockets[0].send_json_to({'action': 'move', 'main_index': 4, 'sub_index': 4, 'player': 'X'})
+            for socket in sockets:
+                await drain(socket)
+
+            await get_channel_layer().group_send(WORKERS_GROUP, {'type': 'workers.changed', 'workers': BOTH})
+            redirects = []
+            for socket in sockets:
+                redirects.append(await socket.receive_json_from(timeout=2))
+                self.assertEqual(await closed(socket), 4000)
+            self.assertNotIn(self.code, registry.rooms)
+
+            # Back on the new owner, the guest keeps its seat and the game
+            # goes on from the flushed move.
+            set_workers({})
+            again = WebsocketCommunicator(application, f"/ws/game/{self.code}/?seat=O")
+            connected, _ = await again.connect()
+            self.assertTrue(connected)
+            messages = await drain(again)
+            await again.disconnect()
+            return redirects, messages
+
+        redirects, messages = asyncio.run(run())
+        self.assertEqual(redirects, [{'type': 'redirect', 'url': None, 'seat': 'X'},
+                                     {'type': 'redirect', 'url': None, 'seat': 'O'}])
+        self.assertEqual(messages[0], {'type': 'player_assignment', 'player': 'O'})
+        start = next(m for m in messages if m['type'] == 'start')
+        self.assertEqual((start['next_player'], start['cells'][40]), ('O', 'X'))
+        self.assertEqual(Game.objects.get(room_code=self.code).moves.count(), 1)
+
+    def test_command(self):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(WORKERS_GROUP, channel)
+        try:
+            out = StringIO()
+            call_command('rebalance_rooms', 'here=ws://here:8001', 'there=ws://there:8001', sample=1000,
+                         stdout=out)
+            self.assertEqual(async_to_sync(layer.receive)(channel), {'type': 'workers.changed', 'workers': BOTH})
+            self.assertIn('2 workers', out.getvalue())
+            with self.assertRaises(CommandError):
+                call_command('rebalance_rooms', 'here', stdout=StringIO())
+        finally:
+            async_to_sync(layer.group_discard)(WORKERS_GROUP, channel)
+
@@ -0,0 +1,92 @@
+import asyncio
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from game import ai_service
+from game.engine import UltimateBoard
+from game.models import Game
+
+
+class InProcessServiceTest(TestCase):
+    @override_settings(AI_SERVICE_WORKERS=0)
+    def test_request_move(self):
+        engine = UltimateBoard()
+        engine.play(0, 4)
+        move = ai_service.request_move('game.players.LegendPlayer', engine)
+        self.assertEqual(move[0], 4)
+        self.assertTrue(engine.is_legal(*move))
+
+    @override_settings(AI_SERVICE_WORKERS=0)
+    def test_request_move_async(self):
+        engine = UltimateBoard()
+        move = asyncio.run(ai_service.request_move_async('game.players.UltimatePlayer', engine, timeout=0.2))
+        self.assertTrue(engine.is_legal(*move))
+
+    @override_settings(AI_SERVICE_WORKERS=0)
+    def test_play_auto_uses_service(self):
+        game = Game.objects.create(player_x='game.players.UltimatePlayer', player_o='human')
+        game.create_subgames()
+        game.play_auto()
+        game = Game.objects.get(pk=game.pk)
+        self.assertEqual(game.last_player, 'X')
+        self.assertEqual(game.board, " " * 9)
+
+
+@override_settings(AI_SERVICE_WORKERS=1)
+class PoolServiceTest(TestCase):
+    def tearDown(self):
+        ai_service.shutdown()
+
+    def test_request_move(self):
+        engine = UltimateBoard()
+        engine.play(2, 6)
+        move = ai_service.request_move('game.players.UltimatePlayer', engine, timeout=10)
+        self.assertEqual(move[0], 6)
+        self.assertTrue(engine.is_legal(*move))
+
+    def test_table_stats(self):
+        engine = UltimateBoard()
+        for move in [(4, 4), (4, 0), (0, 4), (4, 8), (8, 4)]:  # Out of the opening book
+            engine.play(*move)
+        ai_service.request_move('game.players.UltimatePlayer', engine, timeout=10)
+        workers = ai_service.table_stats()['live']
+        self.assertEqual(len(workers), 1)
+        stats = next(iter(workers.values()))
+        self.assertGreater(stats['probes'], 0)
+        self.assertGreater(stats['used'], 0)
+        self.assertEqual(ai_service.table_stats()['ponder'], {})
+
+    def test_cancel_queued_move(self):
+        engine = UltimateBoard()
+        running = ai_service.submit_move('game.players.UltimatePlayer', engine, timeout=1)
+        queued = ai_service.submit_move('game.players.UltimatePlayer', engine, timeout=1)
+        self.assertTrue(queued.cancel())
+        self.assertTrue(queued.cancelled())
+        self.assertTrue(engine.is_legal(*running.result(timeout=10)))
+
+    @override_settings(AI_PONDER=False)
+    def test_game_view_awaits_the_reply(self):
+        game = Game.objects.create(player_x='Guest', player_o='game.players.UltimatePlayer')
+        game.create_subgames()
+        with patch('game.ai_service.request_move', side_effect=AssertionError("blocking wait")), \
+                patch('game.ai_service.request_move_async', wraps=ai_service.request_move_async) as awaited:
+            response = self.client.post(reverse('game:detail', kwargs={'pk': game.pk}),
+                                        {'main_index': 4, 'sub_index': 4})
+        self.assertEqual(response.status_code, 302)
+        awaited.assert_called_once()
+        game = Game.objects.get(pk=game.pk)
+        self.assertEqual((game.ply, game.last_player), (2, 'O'))
+
+    def test_deadline_falls_back(self):
+        engine = UltimateBoard()
+        engine.play(2, 6)
+        move = ai_service.request_move('game.players.UltimatePlayer', engine, timeout=0.001)
+        self.assertEqual(move, ai_service.fallback_move(engine))
+
+    def test_deadline_falls_back_async(self):
+        engine = UltimateBoard()
+        engine.play(2, 6)
+        move = asyncio.run(ai_service.request_move_async('game.players.UltimatePlayer', engine, timeout=0.001))
+        self.assertEqual(move, ai_service.fallback_move(engine))
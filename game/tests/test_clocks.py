@@ -0,0 +1,165 @@
+import asyncio
+from datetime import timedelta
+
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from game.clocks import ClockScheduler
+from game.models import Game
+from game.room_backends import MemoryRoomBackend
+from game.rooms import RoomRegistry
+from game.tests.test_consumers import application, drain
+
+
+def clocked_game(room_code=None, time_x=60, time_o=60, increment=0):
+    game = Game(room_code=room_code, player_x='Guest_1', player_o='Guest_2', time_x=time_x, time_o=time_o,
+                increment=increment)
+    game.create_subgames(persist=room_code is not None)
+    return game
+
+
+class GameClockTest(TestCase):
+    def test_lazy_clock_and_increment(self):
+        game = clocked_game(increment=5)
+        start = game.last_move_time
+        self.assertEqual(game.clock_remaining('X', start + timedelta(seconds=10)), 50)
+        self.assertEqual(game.clock_remaining('O', start + timedelta(seconds=10)), 60)
+        self.assertEqual(game.flag_deadline(), start + timedelta(seconds=60))
+
+        moved = start + timedelta(seconds=10.4)
+        game.apply_move(4, 4, now=moved, persist=False, clocked=True)
+        self.assertEqual((game.remaining_x, game.remaining_o), (55, 60))
+        self.assertEqual(game.pending_moves[0].remaining_x, 55)
+        self.assertEqual(game.flag_deadline(), moved + timedelta(seconds=60))
+        self.assertEqual(game.clock_remaining('X', moved + timedelta(seconds=30)), 55)
+
+    def test_check_flag(self):
+        game = clocked_game()
+        start = game.last_move_time
+        self.assertIsNone(game.check_flag(start + timedelta(seconds=59)))
+        self.assertEqual(game.check_flag(start + timedelta(seconds=60)), 'X')
+        self.assertEqual((game.winner, game.remaining_x), ('O', 0))
+        self.assertIsNone(game.flag_deadline())
+        self.assertIsNone(game.check_flag(start + timedelta(seconds=90)))
+
+    def test_no_clock_before_the_game_starts(self):
+        game = Game(player_x='Guest_1')
+        self.assertFalse(game.clock_running)
+        self.assertIsNone(game.flag_deadline())
+        self.assertEqual(game.clock_remaining('X'), 300)
+
+
+class ClockSchedulerTest(TestCase):
+    def test_fires_in_deadline_order(self):
+        fired = []
+
+        async def run():
+            clocks = ClockScheduler()
+            now = timezone.now()
+
+            def record(key):
+                async def callback():
+                    fired.append(key)
+                return callback
+
+            for key, delay in [('a', 0.06), ('b', 0.02), ('c', 0.04), ('d', 0.03)]:
+                clocks.schedule(key, now + timedelta(seconds=delay), record(key))
+            clocks.cancel('c')
+            clocks.schedule('b', now + timedelta(seconds=0.08), record('b'))
+            self.assertEqual(len(clocks), 3)
+            await asyncio.sleep(0.15)
+            return clocks
+
+        clocks = asyncio.run(run())
+        self.assertEqual(fired, ['d', 'a', 'b'])
+        self.assertEqual((len(clocks), clocks.fired), (0, 3))
+
+
+class FlagFallTest(TransactionTestCase):
+    def test_idle_room_waits_for_the_deadline(self):
+        clocked_game('FLAG01', time_x=1)
+        registry = RoomRegistry(MemoryRoomBackend(), flush_interval=0.05)
+
+        async def run():
+            room = await registry.join('FLAG01')
+            self.assertEqual(registry.clocks.deadline('FLAG01'), room.game.flag_deadline())
+            await asyncio.sleep(0.5)
+            # Nothing was committed or written while the clock ran.
+            idle = (room.revision, registry.flushes)
+            await asyncio.sleep(0.8)
+            return room, idle
+
+        room, idle = asyncio.run(run())
+        self.assertEqual(idle, (0, 0))
+        self.assertEqual((room.game.winner, room.game.remaining_x), ('O', 0))
+        self.assertEqual(registry.stats()['flags'], 1)
+        self.assertEqual(Game.objects.get(room_code='FLAG01').winner, 'O')
+
+    def test_moves_move_the_deadline(self):
+        clocked_game('FLAG02', time_x=1, increment=2)
+        registry = RoomRegistry(MemoryRoomBackend(), flush_interval=60)
+
+        async def run():
+            room = await registry.join('FLAG02')
+            await registry.update(room, lambda game: game.apply_move(4, 4, persist=False, clocked=True))
+            self.assertEqual(registry.clocks.deadline('FLAG02'), room.game.flag_deadline())
+            await registry.update(room, lambda game: game.apply_move(4, 0, persist=False, clocked=True))
+            # X's second, plus two of increment.
+            await asyncio.sleep(1.3)
+            self.assertIsNone(room.game.winner)
+            await registry.leave(room)
+            return room
+
+        room = asyncio.run(run())
+        self.assertEqual(len(registry.clocks), 0)
+        self.assertEqual(registry.clocks.fired, 0)
+
+    def test_players_are_told(self):
+        clocked_game('FLAG03', time_x=1)
+
+        async def run():
+            sockets = [WebsocketCommunicator(application, f"/ws/game/FLAG03/?seat={seat}") for seat in 'XO']
+            for socket in sockets:
+                await socket.connect()
+                await drain(socket)
+            message = await sockets[0].receive_json_from(timeout=2)
+            while message['type'] == 'start':
+                message = await sockets[0].receive_json_from(timeout=2)
+            for socket in sockets:
+                await socket.disconnect()
+            return message
+
+        self.assertEqual(asyncio.run(run()), {'type': 'surrender', 'winner': 'O',
+                                              'message': "⏰ X ran out of time. O wins!"})
+
+
+class ClockSyncTest(TransactionTestCase):
+    def test_sync_and_deadlines(self):
+        game = clocked_game('SYNC01', time_x=60, time_o=60)
+        start = game.last_move_time.timestamp() * 1000
+
+        async def run():
+            sockets = [WebsocketCommunicator(application, f"/ws/game/SYNC01/?seat={seat}") for seat in 'XO']
+            for socket in sockets:
+                await socket.connect()
+                await drain(socket)
+            await sockets[0].send_json_to({'action': 'sync', 'client_time': 1234})
+            sync = await sockets[0].receive_json_from()
+            while sync['type'] == 'start':
+                sync = await sockets[0].receive_json_from()
+            # No clock updates are sent to an idle room.
+            idle = await sockets[1].receive_nothing(timeout=1.2)
+            await sockets[0].send_json_to({'action': 'move', 'main_index': 4, 'sub_index': 4, 'player': 'X'})
+            move = await sockets[1].receive_json_from()
+            for socket in sockets:
+                await socket.disconnect()
+            return sync, idle, move
+
+        sync, idle, move = asyncio.run(run())
+        self.assertEqual((sync['type'], sync['client_time'], sync['resync']), ('sync', 1234, 60))
+        self.assertEqual(sync['deadline'], round(start + 60000))
+        self.assertEqual((sync['time_x'], sync['time_o']), (60, 60))
+        self.assertTrue(idle)
+        self.assertEqual((move['time_x'], move['time_o']), (59, 60))
+        self.assertEqual(move['deadline'] - move['server_time'], 60000)
@@ -0,0 +1,202 @@
+import asyncio
+from unittest.mock import patch
+
+from channels.auth import AuthMiddlewareStack
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TransactionTestCase
+
+from game.engine import UltimateBoard
+from game.models import Game
+from game.rooms import RoomRegistry
+from game.routing import websocket_urlpatterns
+
+application = AuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+
+async def connect(room_code):
+    communicator = WebsocketCommunicator(application, f"/ws/game/{room_code}/")
+    connected, _ = await communicator.connect()
+    assert connected
+    return communicator
+
+
+async def drain(communicator):
+    messages = []
+    while not await communicator.receive_nothing(timeout=0.05):
+        messages.append(await communicator.receive_json_from())
+    return messages
+
+
+class ConcurrentMovesTest(TransactionTestCase):
+    PLIES = 12
+
+    def test_racing_moves(self):
+        played = asyncio.run(self.play_racing_game())
+        game = Game.objects.get(room_code='RACE01')
+        moves = list(game.moves.order_by('ply').values_list('ply', 'symbol', 'main_index', 'sub_index'))
+        self.assertEqual([move[0] for move in moves], list(range(1, self.PLIES + 1)))
+        self.assertEqual([move[1] for move in moves], ['X', 'O'] * (self.PLIES // 2))
+        self.assertEqual([move[2:] for move in moves], played)
+        self.assertEqual(game.position_at(game.ply).sub_board(game.last_main_index),
+                         game.get_sub_game(game.last_main_index).board)
+
+    async def play_racing_game(self):
+        sockets = [await connect('RACE01'), await connect('RACE01')]
+        for socket in sockets:
+            await drain(socket)
+        engine = UltimateBoard()
+        played = []
+        for ply in range(self.PLIES):
+            # Each socket plays its own seat: X's socket connected first.
+            mover, waiting = sockets if engine.turn == 'X' else sockets[::-1]
+            # The player to move sends two moves for the same ply, one of
+            # them twice, while the other player tries to move out of turn.
+            first, second = engine.legal_moves()[:2]
+            await asyncio.gather(*[
+                socket.send_json_to({'action': 'move', 'main_index': move[0], 'sub_index': move[1],
+                                     'player': symbol})
+                for socket, move, symbol in [(mover, first, engine.turn), (mover, second, engine.turn),
+                                             (mover, second, engine.turn),
+                                             (waiting, first, 'O' if engine.turn == 'X' else 'X')]
+            ])
+            messages = await drain(sockets[0])
+            await drain(sockets[1])
+            moves = [m for m in messages if m['type'] == 'move']
+            self.assertEqual(len(moves), 1, messages)
+            move = (moves[0]['main_index'], moves[0]['sub_index'])
+            engine.play(*move)
+            played.append(move)
+        for socket in sockets:
+            await socket.disconnect()
+        return played
+
+
+async def watch(room_code):
+    communicator = WebsocketCommunicator(application, f"/ws/game/{room_code}/?watch=1")
+    connected, _ = await communicator.connect()
+    assert connected
+    return communicator
+
+
+class SpectatorTest(TransactionTestCase):
+    def test_watchers_do_not_take_seats(self):
+        async def run():
+            watcher = await watch('WATCH1')
+            waiting = await drain(watcher)
+            sockets = [await connect('WATCH1'), await connect('WATCH1')]
+            assignments = []
+            for socket in sockets:
+                assignments.append((await drain(socket))[0])
+            await drain(watcher)
+            late = await watch('WATCH1')
+            start = await drain(late)
+
+            await sockets[0].send_json_to({'action': 'move', 'main_index': 4, 'sub_index': 4, 'player': 'X'})
+            frames = [await socket.receive_from() for socket in [watcher, late, sockets[1]]]
+            await late.send_json_to({'action': 'move', 'main_index': 4, 'sub_index': 0, 'player': 'O'})
+            refused = await late.receive_json_from()
+            for socket in [watcher, late] + sockets:
+                await socket.disconnect()
+            return waiting, assignments, start, frames, refused
+
+        waiting, assignments, start, frames, refused = asyncio.run(run())
+        self.assertEqual([m['type'] for m in waiting], ['waiting'])
+        self.assertEqual(assignments, [{'type': 'player_assignment', 'player': 'X'},
+                                       {'type': 'player_assignment', 'player': 'O'}])
+        self.assertEqual((start[0]['type'], start[0]['my_player']), ('start', None))
+        # One encoding of the move, sent as it is to every socket.
+        self.assertEqual(len(set(frames)), 1)
+        self.assertEqual(refused, {'type': 'error', 'message': 'Spectators cannot play'})
+        game = Game.objects.get(room_code='WATCH1')
+        self.assertEqual((game.player_x, game.player_o, game.ply), ('Guest_1', 'Guest_2', 1))
+
+
+class SeatTest(TransactionTestCase):
+    def test_moves_for_the_other_seat_are_refused(self):
+        async def run():
+            sockets = [await connect('SEAT01'), await connect('SEAT01')]
+            for socket in sockets:
+                await drain(socket)
+            # O's socket plays X's move.
+            await sockets[1].send_json_to({'action': 'move', 'main_index': 4, 'sub_index': 4, 'player': 'X'})
+            refused = await drain(sockets[1])
+            # And surrenders for X, which gives up its own seat.
+            await sockets[1].send_json_to({'action': 'surrender', 'player': 'X'})
+            ending = await drain(sockets[0])
+            for socket in sockets:
+                await socket.disconnect()
+            return refused, ending
+
+        refused, ending = asyncio.run(run())
+        self.assertEqual(refused, [{'type': 'error', 'message': 'You can only play your own seat'}])
+        self.assertEqual([(m['type'], m['winner']) for m in ending], [('surrender', 'X')])
+        game = Game.objects.get(room_code='SEAT01')
+        self.assertEqual((game.ply, game.winner), (0, 'X'))
+
+
+class SurrenderTest(TransactionTestCase):
+    def test_surrender_after_the_end(self):
+        async def run():
+            sockets = [await connect('GIVEUP'), await connect('GIVEUP')]
+            for socket in sockets:
+                await drain(socket)
+            await sockets[1].send_json_to({'action': 'surrender', 'player': 'O'})
+            for socket in sockets:
+                await drain(socket)
+            await sockets[0].send_json_to({'action': 'surrender', 'player': 'X'})
+            late = await drain(sockets[1])
+            for socket in sockets:
+                await socket.disconnect()
+            return late
+
+        with patch('game.consumers.record_game_result') as record:
+            late = asyncio.run(run())
+        self.assertEqual(late, [])
+        record.assert_called_once()
+        self.assertEqual(Game.objects.get(room_code='GIVEUP').winner, 'X')
+
+
+class TimeLossTest(TransactionTestCase):
+    "X starts with no time on the clock."
+
+    async def start(self, room_code):
+        await Game.objects.acreate(room_code=room_code, time_x=0)
+        return [await connect(room_code), await connect(room_code)]
+
+    async def ending(self, socket):
+        while True:
+            message = await socket.receive_json_from(timeout=2)
+            if message['type'] == 'surrender':
+                return message
+
+    def test_flag_fall_is_recorded(self):
+        async def run():
+            sockets = await self.start('FLAG01')
+            message = await self.ending(sockets[0])
+            for socket in sockets:
+                await socket.disconnect()
+            return message
+
+        with patch('game.rooms.record_game_result') as record:
+            message = asyncio.run(run())
+        self.assertEqual(message['winner'], 'O')
+        record.assert_called_once()
+        self.assertEqual(record.call_args.args[1], 'O')
+
+    def test_late_move_is_recorded(self):
+        async def run():
+            sockets = await self.start('FLAG02')
+            await sockets[0].send_json_to({'action': 'move', 'main_index': 4, 'sub_index': 4, 'player': 'X'})
+            message = await self.ending(sockets[0])
+            for socket in sockets:
+                await socket.disconnect()
+            return message
+
+        # Without the room's clock timer, the move finds the flag down.
+        with patch.object(RoomRegistry, '_watch_clock'), patch('game.consumers.record_game_result') as record:
+            message = asyncio.run(run())
+        self.assertEqual(message['winner'], 'O')
+        record.assert_called_once()
+        self.assertEqual(record.call_args.args[1], 'O')
+        self.assertEqual(Game.objects.get(room_code='FLAG02').winner, 'O')
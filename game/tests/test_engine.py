@@ -0,0 +1,79 @@
+from django.test import TestCase
+
+from game.engine import UltimateBoard, board_masks, board_result
+
+
+class BoardResultTest(TestCase):
+    def test_board_result(self):
+        states = [
+            ("         ", None),
+            ("XXXOO    ", 'X'),
+            ("XOO X   X", 'X'),
+            ("XXO O O X", 'O'),
+            ("XOXXOXOXO", ' '),
+        ]
+        for board, expected in states:
+            self.assertEqual(board_result(*board_masks(board)), expected, board)
+
+
+class UltimateBoardTest(TestCase):
+    def test_first_move_is_free(self):
+        engine = UltimateBoard()
+        self.assertEqual(len(engine.legal_moves()), 81)
+
+    def test_send_rule(self):
+        "The sub index of a move picks the board the opponent plays in."
+        engine = UltimateBoard()
+        engine.play(0, 4)
+        self.assertEqual(engine.active, 4)
+        self.assertEqual(engine.turn, 'O')
+        self.assertEqual({main for main, _ in engine.legal_moves()}, {4})
+        with self.assertRaises(ValueError):
+            engine.play(0, 0)
+
+    def test_square_taken(self):
+        engine = UltimateBoard()
+        engine.play(4, 4)
+        with self.assertRaises(ValueError):
+            engine.play(4, 4)
+
+    def test_invalid_index(self):
+        engine = UltimateBoard()
+        with self.assertRaises(IndexError):
+            engine.play(9, 0)
+
+    def test_sub_board_win_frees_the_send(self):
+        engine = UltimateBoard.from_strings(["XX       "] + [" " * 9] * 8, active_index=0)
+        self.assertEqual(engine.play(0, 2, 'X'), 'X')
+        self.assertEqual(engine.sub_winner(0), 'X')
+        self.assertEqual(engine.sub_winning_line(0), [0, 1, 2])
+        self.assertEqual(engine.meta_board(), "X        ")
+        # Sent to the board that was just won, so any open board is allowed.
+        engine.active = None
+        engine.play(1, 0, 'O')
+        self.assertEqual(engine.active, None)
+
+    def test_meta_win(self):
+        boards = ["XXX      ", "XXX      ", "XX       "] + [" " * 9] * 6
+        engine = UltimateBoard.from_strings(boards, active_index=2)
+        self.assertEqual(engine.meta_board(), "XX       ")
+        engine.play(2, 2, 'X')
+        self.assertEqual(engine.winner, 'X')
+        self.assertEqual(engine.legal_moves(), [])
+
+    def test_draw(self):
+        boards = ["XOXXOXOXO"] * 8 + ["XOXXOXOX "]
+        engine = UltimateBoard.from_strings(boards, active_index=8)
+        self.assertEqual(engine.play(8, 8, 'O'), ' ')
+        self.assertEqual(engine.winner, 'draw')
+
+    def test_undo(self):
+        boards = ["XXX      ", "XXX      ", "XX       "] + [" " * 9] * 6
+        engine = UltimateBoard.from_strings(boards, active_index=2)
+        before = engine.copy()
+        engine.play(2, 2, 'X')
+        engine.undo()
+        self.assertEqual(engine.x, before.x)
+        self.assertEqual(engine.o, before.o)
+        self.assertEqual((engine.won_x, engine.won_o, engine.drawn), (before.won_x, before.won_o, before.drawn))
+        self.assertEqual((engine.active, engine.turn, engine.winner), (2, 'X', None))
@@ -0,0 +1,89 @@
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from game.consumers import GameConsumer
+from game.lobby import (ALPHABET, CODES, CodeAllocator, RoomCodesExhausted, RoomPool, encode_code, permute,
+                        unpermute)
+from game.models import Game, RoomSequence
+
+
+class RoomCodeTest(TestCase):
+    def test_permutation(self):
+        key = b'k' * 32
+        for number in [0, 1, 2, 12345, CODES // 2, CODES - 1]:
+            self.assertEqual(unpermute(permute(number, key), key), number)
+        codes = {encode_code(permute(number, key)) for number in range(20000)}
+        self.assertEqual(len(codes), 20000)
+        self.assertTrue(all(len(code) == 6 and set(code) <= set(ALPHABET) for code in codes))
+        self.assertNotEqual(permute(1, key), permute(1, b'other'))
+        with self.assertRaises(RoomCodesExhausted):
+            permute(CODES, key)
+
+    def test_allocators_share_the_sequence(self):
+        first, second = CodeAllocator(block=3), CodeAllocator(block=3)
+        codes = [allocator.take() for i in range(4) for allocator in (first, second)]
+        self.assertEqual(len(set(codes)), 8)
+        # Two blocks each.
+        self.assertEqual(RoomSequence.objects.get().next_value, 12)
+
+    def test_create_multiplayer(self):
+        response = self.client.post(reverse('game:create_multiplayer'), {'time': 3, 'increment': 2})
+        game = Game.objects.get()
+        self.assertRedirects(response, reverse('game:multiplayer_game', kwargs={'game_id': game.pk}))
+        self.assertEqual((len(game.room_code), game.time_x, game.remaining_o, game.increment), (6, 180, 180, 2))
+        self.assertFalse(game.pooled)
+
+
+class RoomPoolTest(TransactionTestCase):
+    def test_claim(self):
+        pool = RoomPool(size=4)
+        self.assertEqual(pool.fill(), 4)
+        self.assertEqual(Game.objects.filter(pooled=True, state__regex=r'^ {99}$').count(), 4)
+        first = pool.claim(3, 2)
+        # A room at hand costs one update.
+        with self.assertNumQueries(1):
+            second = pool.claim(1, 0)
+        game = Game.objects.get(pk=first)
+        self.assertEqual((game.pooled, game.time_x, game.remaining_o, game.increment, game.version),
+                         (False, 180, 180, 2, 1))
+        self.assertNotEqual(first, second)
+
+        # Pooled rooms cannot be joined or opened before they are given out.
+        waiting = Game.objects.filter(pooled=True).first()
+        self.assertEqual(self.client.get(reverse('game:multiplayer_game', kwargs={'game_id': waiting.pk}))
+                         .status_code, 404)
+        response = self.client.post(reverse('game:join_multiplayer'), {'code': waiting.room_code})
+        self.assertContains(response, 'Invalid code')
+
+    def test_refill_and_stale_rooms(self):
+        pool, other = RoomPool(size=4), RoomPool(size=4)
+        pool.fill()
+        # The other process finds the rooms in the database and claims one first.
+        taken = other.claim(5, 0)
+        claimed = [pool.claim(5, 0) for i in range(3)]
+        self.assertNotIn(taken, claimed)
+        for i in range(100):
+            if not pool.filling:
+                break
+            time.sleep(0.05)
+        self.assertEqual(len(pool.ready), 4)
+        self.assertEqual(Game.objects.filter(pooled=True).count(), 4)
+
+    def test_pooled_room_starts_the_clock_when_full(self):
+        pool = RoomPool(size=2)
+        pool.fill()
+        game = Game.objects.get(pk=pool.claim(2, 0))
+        game.player_x, game.player_o = 'Guest_1', 'Guest_2'
+        data = GameConsumer().create_subgames(game)
+        self.assertIsNotNone(game.last_move_time)
+        self.assertEqual((data['remaining_x'], game.state), (120, ' ' * 99))
+
+    def test_fill_command(self):
+        RoomPool(size=2).fill()
+        out = StringIO()
+        call_command('fill_room_pool', 5, stdout=out)
+        self.assertIn('Made 3 rooms; 5 in the pool', out.getvalue())
@@ -1,8 +1,21 @@
 import random
+from datetime import timedelta
+from unittest.mock import patch
+
 import six
-from django.test import TestCase
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from game.models import EMPTY_STATE, Game, GameConflict, Move, retry_on_conflict
+
 
-from game.models import Game
+def writes(queries):
+    return [q['sql'] for q in queries if q['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')]
 
 
 class GameModelTest(TestCase):
@@ -80,3 +93,275 @@ class GameModelTest(TestCase):
             self.assertEqual(game.is_game_over, state[1],
                              "is_game_over='{0}' for board='{1}', expected='{2}'".format(game.is_game_over,
                                                                                          game.board, state[1]))
+
+
+class GameEngineTest(TestCase):
+    def setUp(self):
+        self.game = Game.objects.create(player_x='human', player_o='game.players.RandomPlayer')
+        self.game.create_subgames()
+
+    def test_apply_move(self):
+        winner, winning_line = self.game.apply_move(0, 4, 'X')
+        self.assertEqual((winner, winning_line), (None, None))
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual(game.active_index, 4)
+        self.assertEqual(game.last_player, 'X')
+        self.assertEqual(game.sub_games.get(index=0).board, "    X    ")
+
+    def test_apply_move_wrong_board(self):
+        self.game.apply_move(0, 4, 'X')
+        with self.assertRaises(ValidationError):
+            self.game.apply_move(0, 0, 'O')
+
+    def test_apply_move_wins_sub_board(self):
+        for main_index, sub_index, symbol in [(0, 0, 'X'), (0, 3, 'O'), (3, 0, 'X'), (0, 4, 'O'), (4, 0, 'X')]:
+            self.game.apply_move(main_index, sub_index, symbol)
+        winner, winning_line = self.game.apply_move(0, 5, 'O')
+        self.assertEqual((winner, winning_line), ('O', [3, 4, 5]))
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual(game.board, "O        ")
+        self.assertEqual(game.sub_games.get(index=0).winner, 'O')
+
+    def test_sub_games_view(self):
+        self.game.apply_move(4, 2, 'X')
+        self.assertEqual(len(self.game.sub_games), 9)
+        sub_game = self.game.get_sub_game(4)
+        self.assertEqual((sub_game.board, sub_game.last_move_index, sub_game.winner), ("  X      ", 2, None))
+        self.assertEqual(self.game.sub_games.filter(index=4).first().board, sub_game.board)
+        self.assertIsNone(self.game.get_sub_game(0).last_move_index)
+        self.assertFalse(Game(player_x='a', player_o='b').sub_games.exists())
+
+    def test_one_write_each(self):
+        with CaptureQueriesContext(connection) as queries:
+            game = Game(player_x='human', player_o='human')
+            game.create_subgames()
+        self.assertEqual(len(writes(queries)), 1)
+        with CaptureQueriesContext(connection) as queries:
+            game.apply_move(0, 4, 'X')
+        self.assertEqual(len(writes(queries)), 1)
+        with CaptureQueriesContext(connection) as queries:
+            game.reset_state()
+        self.assertEqual(len(writes(queries)), 1)
+        self.assertEqual(Game.objects.get(pk=game.pk).state, EMPTY_STATE)
+
+    @override_settings(GAME_SNAPSHOT_EVERY=2)
+    def test_move_writes_changed_fields(self):
+        self.game.apply_move(0, 4, 'X')
+        game = Game.objects.get(pk=self.game.pk)
+        with CaptureQueriesContext(connection) as queries:
+            game.play(4, 0, 'O')
+        [insert, update] = writes(queries)
+        self.assertIn('"game_move"', insert)
+        self.assertIn('"state"', update)
+        self.assertIn('"active_index"', update)
+        self.assertNotIn('"player_x"', update)
+        self.assertNotIn('"time_x"', update)
+        self.assertEqual(game.changed_fields(), [])
+        self.assertEqual(Game.objects.get(pk=game.pk).get_sub_game(4).board, "O        ")
+
+    def test_play_auto_writes_once(self):
+        game = Game(player_x='game.players.GoodPlayer', player_o='human')
+        game.create_subgames()
+        with self.settings(AI_SERVICE_WORKERS=0, AI_PONDER=False), CaptureQueriesContext(connection) as queries:
+            game.play_auto()
+        self.assertEqual(len(writes(queries)), 1)
+        self.assertEqual(game.last_player, 'X')
+
+    def test_clock_loss_writes_once(self):
+        game = Game(player_x='alice', player_o='bob')
+        game.create_subgames()
+        game.play(0, 4, 'X')
+        game.remaining_o = 1
+        game.last_move_time = timezone.now() - timedelta(seconds=5)
+        game.save()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(game.play(4, 0, 'O'), 'X')
+        self.assertEqual(len(writes(queries)), 1)
+        game = Game.objects.get(pk=game.pk)
+        self.assertEqual((game.winner, game.remaining_o, game.ply), ('X', 0, 1))
+
+    def test_play_charges_the_player_to_move(self):
+        game = Game(player_x='alice', player_o='bob', increment=2)
+        game.create_subgames()
+        game.last_move_time = timezone.now() - timedelta(seconds=10)
+        game.play(0, 4, 'X')
+        self.assertEqual((game.remaining_x, game.remaining_o), (game.time_x - 10 + 2, game.time_o))
+        game = Game.objects.get(pk=game.pk)
+        self.assertEqual(game.remaining_x, game.time_x - 8)
+
+    def test_is_game_over_does_not_write(self):
+        for main_index, sub_index, symbol in [(0, 0, 'X'), (0, 3, 'O'), (3, 0, 'X'), (0, 4, 'O'), (4, 0, 'X')]:
+            self.game.apply_move(main_index, sub_index, symbol)
+        game = Game.objects.get(pk=self.game.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIsNone(game.is_game_over)
+            self.assertIsNone(game.get_sub_game(0).is_game_over)
+            game.set_active_index(0)
+        self.assertEqual(writes(queries), [])
+
+    def test_save_changes_skips_clean_game(self):
+        game = Game.objects.get(pk=self.game.pk)
+        with CaptureQueriesContext(connection) as queries:
+            game.save_changes()
+        self.assertEqual(writes(queries), [])
+        game.remaining_o -= 1
+        self.assertEqual(game.changed_fields(), ['remaining_o'])
+
+
+@override_settings(GAME_SNAPSHOT_EVERY=4)
+class MoveLogTest(TestCase):
+    MOVES = [(4, 4, 'X'), (4, 0, 'O'), (0, 4, 'X'), (4, 8, 'O'), (8, 4, 'X'), (4, 2, 'O')]
+
+    def setUp(self):
+        self.game = Game(player_x='alice', player_o='bob')
+        self.game.create_subgames()
+
+    def test_moves_are_logged(self):
+        with CaptureQueriesContext(connection) as queries:
+            for move in self.MOVES[:3]:
+                self.game.apply_move(*move)
+        self.assertEqual([sql.split()[2] for sql in writes(queries)], ['"game_move"'] * 3)
+        self.assertEqual(list(self.game.moves.values_list('ply', 'symbol', 'main_index', 'sub_index')),
+                         [(1, 'X', 4, 4), (2, 'O', 4, 0), (3, 'X', 0, 4)])
+        self.assertEqual(Game.objects.filter(pk=self.game.pk).values_list('ply', flat=True).get(), 0)
+
+    def test_snapshot_plus_replay(self):
+        for move in self.MOVES:
+            self.game.apply_move(*move)
+        row = Game.objects.filter(pk=self.game.pk).values('ply', 'state').get()
+        self.assertEqual(row['ply'], 4)
+        game = Game.objects.get(pk=self.game.pk)
+        for field in ('state', 'ply', 'board', 'active_index', 'last_player', 'last_main_index',
+                      'last_sub_index', 'remaining_x', 'remaining_o', 'last_move_time'):
+            self.assertEqual(getattr(game, field), getattr(self.game, field), field)
+        self.assertTrue({'state', 'ply'} <= set(game.changed_fields()))
+        game.apply_move(2, 0, 'X')
+        game.refresh_from_db()
+        self.assertEqual((game.ply, game.next_player), (7, 'O'))
+
+    def test_position_at(self):
+        for move in self.MOVES:
+            self.game.apply_move(*move)
+        engine = self.game.position_at(2)
+        self.assertEqual((engine.cell(4, 4), engine.cell(4, 0), engine.cell(0, 4)), ('X', 'O', ' '))
+        self.assertEqual(self.game.position_at(6).sub_board(4), self.game.get_sub_game(4).board)
+
+    def test_reset_starts_a_new_round(self):
+        for move in self.MOVES[:2]:
+            self.game.apply_move(*move)
+        self.game.reset_state()
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual((game.ply, game.round, game.state), (0, 1, EMPTY_STATE))
+        game.apply_move(0, 0, 'X')
+        self.assertEqual(Move.objects.filter(game=game).count(), 3)
+        self.assertEqual(Game.objects.get(pk=game.pk).get_sub_game(0).board, "X        ")
+
+
+class OptimisticConcurrencyTest(TestCase):
+    def setUp(self):
+        self.game = Game(player_x='alice', player_o='bob')
+        self.game.create_subgames()
+
+    def test_second_move_from_same_position_conflicts(self):
+        first = Game.objects.get(pk=self.game.pk)
+        second = Game.objects.get(pk=self.game.pk)
+        first.apply_move(4, 4, 'X')
+        with self.assertRaises(GameConflict):
+            second.apply_move(0, 0, 'X')
+        self.assertEqual(Move.objects.filter(game=self.game).count(), 1)
+
+    def test_stale_save_conflicts(self):
+        first = Game.objects.get(pk=self.game.pk)
+        second = Game.objects.get(pk=self.game.pk)
+        first.remaining_x -= 1
+        first.save_changes()
+        second.winner = 'O'
+        with self.assertRaises(GameConflict):
+            second.save_changes()
+        self.assertIsNone(Game.objects.get(pk=self.game.pk).winner)
+        self.assertEqual(Game.objects.get(pk=self.game.pk).version, first.version)
+
+    def test_stale_full_save_conflicts(self):
+        first = Game.objects.get(pk=self.game.pk)
+        second = Game.objects.get(pk=self.game.pk)
+        first.remaining_x -= 1
+        first.save_changes()
+        second.winner = 'O'
+        with self.assertRaises(GameConflict):
+            second.save()
+        self.assertEqual(second.version, first.version - 1)
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual((game.winner, game.remaining_x, game.version), (None, 299, first.version))
+        # A fresh copy saves.
+        game.winner = 'O'
+        game.save()
+        self.assertEqual(Game.objects.get(pk=self.game.pk).version, first.version + 1)
+
+    def test_surrender_after_a_concurrent_win(self):
+        game = Game.objects.create(player_x='Guest', player_o='game.players.RandomPlayer')
+        game.create_subgames()
+        stale = Game.objects.get(pk=game.pk)
+        # The game is won by another request meanwhile.
+        game.winner = 'X'
+        game.save_changes()
+        with patch('game.views.get_object_or_404', return_value=stale):
+            self.client.post(reverse('game:detail', kwargs={'pk': game.pk}), {'surrender': '1'})
+        self.assertEqual(Game.objects.get(pk=game.pk).winner, 'X')
+
+    def test_retry_revalidates(self):
+        stale = Game.objects.get(pk=self.game.pk)
+        self.game.apply_move(4, 4, 'X')
+        # The same X move again: the retry sees it is now O's turn.
+        with self.assertRaises(ValidationError):
+            retry_on_conflict(stale, lambda game: game.apply_move(0, 0, 'X'))
+
+    def test_retry_reloads(self):
+        stale = Game.objects.get(pk=self.game.pk)
+        self.game.remaining_o -= 5
+        self.game.save_changes()
+
+        def tick(game):
+            game.remaining_x -= 1
+            game.save_changes()
+
+        retry_on_conflict(stale, tick)
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual((game.remaining_x, game.remaining_o), (299, 295))
+
+    def test_move_out_of_turn(self):
+        with self.assertRaises(ValidationError):
+            self.game.apply_move(4, 4, 'O')
+
+
+class StateMigrationTest(TransactionTestCase):
+    before = [('game', '0001_initial')]
+
+    def migrate(self, targets=None):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        targets = targets or executor.loader.graph.leaf_nodes('game')
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_sub_games_are_packed(self):
+        apps = self.migrate(self.before)
+        OldGame = apps.get_model('game', 'Game')
+        OldSubGame = apps.get_model('game', 'SubGame')
+        game = OldGame.objects.create(player_x='a', player_o='b')
+        OldGame.objects.create(player_x='c', player_o=None)
+        for i in range(9):
+            OldSubGame.objects.create(game=game, index=i, board="XXX   OO " if i == 2 else " " * 9,
+                                      winner='X' if i == 2 else None, last_move_index=2 if i == 2 else None)
+        self.migrate()
+
+        game = Game.objects.get(pk=game.pk)
+        self.assertEqual(game.get_sub_game(2).board, "XXX   OO ")
+        self.assertEqual(game.get_sub_game(2).winner, 'X')
+        self.assertEqual(game.get_sub_game(2).last_move_index, 2)
+        self.assertEqual(game.engine.sub_winner(2), 'X')
+        self.assertFalse(Game.objects.get(player_x='c').sub_games.exists())
+
+        apps = self.migrate(self.before)
+        OldSubGame = apps.get_model('game', 'SubGame')
+        self.assertEqual(OldSubGame.objects.get(game_id=game.pk, index=2).board, "XXX   OO ")
+        self.migrate()
@@ -0,0 +1,64 @@
+from io import StringIO
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from game.engine import UltimateBoard
+from game.opening_book import OpeningBook, get_book, load_book
+from game.players import UltimatePlayer
+from game.transposition import SYMMETRIES
+
+
+class OpeningBookTest(TestCase):
+    def test_round_trip(self):
+        book = OpeningBook.build(plies=2, depth=1)
+        self.assertGreater(len(book), 1)
+        copy = OpeningBook.from_bytes(book.to_bytes())
+        self.assertEqual(copy.entries, book.entries)
+        self.assertEqual(copy.max_plies, 2)
+
+    def test_lookup_is_symmetric(self):
+        book = OpeningBook.build(plies=2, depth=1)
+        first = UltimateBoard()
+        first.play(0, 2)
+        move = book.lookup(first)
+        self.assertTrue(first.is_legal(*move))
+        for perm in SYMMETRIES:
+            engine = UltimateBoard()
+            engine.play(perm[0], perm[2])
+            mapped = book.lookup(engine)
+            self.assertTrue(engine.is_legal(*mapped))
+            self.assertEqual(mapped, (perm[move[0]], perm[move[1]]))
+
+    def test_lookup_outside_book(self):
+        book = OpeningBook.build(plies=2, depth=1)
+        engine = UltimateBoard()
+        for move in [(4, 4), (4, 0), (0, 4)]:
+            engine.play(*move)
+        self.assertIsNone(book.lookup(engine))
+        self.assertIsNone(OpeningBook().lookup(UltimateBoard()))
+
+    def test_load_missing_or_corrupt_book(self):
+        self.assertEqual(len(load_book('/nonexistent/book.bin')), 0)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(b'not a book')
+        try:
+            self.assertEqual(len(load_book(f.name)), 0)
+        finally:
+            os.unlink(f.name)
+
+    def test_shipped_book(self):
+        book = get_book()
+        self.assertGreater(len(book), 0)
+        engine = UltimateBoard()
+        self.assertEqual(UltimatePlayer(node_limit=1).find_move(engine), book.lookup(engine))
+
+    def test_build_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'book.bin')
+            out = StringIO()
+            call_command('build_opening_book', plies=1, depth=1, output=path, stdout=out)
+            self.assertEqual(len(load_book(path)), 1)
+            self.assertIn('Wrote 1 positions', out.getvalue())
@@ -1,9 +1,11 @@
 import random
+import time
 import six
 from django.test import TestCase
 
 from game.models import Game
-from game.players import get_player, RandomPlayer
+from game.engine import UltimateBoard
+from game.players import get_player, RandomPlayer, UltimatePlayer
 
 
 class RandomPlayerTest(TestCase):
@@ -20,3 +22,34 @@ class RandomPlayerTest(TestCase):
 
         game.play(p1.play(game))
         self.assertEqual(game.board, "      X  " if six.PY3 else "       X ")
+
+
+class UltimatePlayerTest(TestCase):
+    def test_import(self):
+        p = get_player("game.players.UltimatePlayer")
+        self.assertEqual(type(p), UltimatePlayer)
+
+    def test_respects_send_rule(self):
+        engine = UltimateBoard()
+        engine.play(0, 4)
+        move = UltimatePlayer(node_limit=500).find_move(engine)
+        self.assertTrue(engine.is_legal(*move))
+        self.assertEqual(move[0], 4)
+
+    def test_takes_meta_win(self):
+        boards = ["XXX      ", "XXX      ", "XX       "] + [" " * 9] * 6
+        engine = UltimateBoard.from_strings(boards, active_index=None)
+        self.assertEqual(UltimatePlayer(node_limit=2000).find_move(engine), (2, 2))
+
+    def test_bounded_time(self):
+        engine = UltimateBoard()
+        start = time.monotonic()
+        move = UltimatePlayer(max_think_time=0.2).find_move(engine, remaining=300)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertTrue(engine.is_legal(*move))
+
+    def test_think_time_follows_clock(self):
+        p = UltimatePlayer(max_think_time=2)
+        self.assertEqual(p.think_time(0), p.MIN_THINK_TIME)
+        self.assertEqual(p.think_time(10), 0.5)
+        self.assertEqual(p.think_time(300), 2)
@@ -0,0 +1,147 @@
+import concurrent.futures
+import threading
+import time
+
+from django.test import TestCase, override_settings
+
+from game import ai_service, ponder
+from game.engine import UltimateBoard
+from game.models import Game
+from game.ponder import Ponderer, plausible_moves
+
+PLAYER = 'game.players.UltimatePlayer'
+
+
+class PonderTestMixin:
+    def setUp(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self.submitted = []
+        self.ponderers = []
+
+    def tearDown(self):
+        for ponderer in self.ponderers:
+            for game_key in list(ponderer.sessions):
+                ponderer.cancel(game_key)
+        self.executor.shutdown(wait=True)
+
+    def make_ponderer(self, **kwargs):
+        ponderer = Ponderer(submit=self.submit, **kwargs)
+        self.ponderers.append(ponderer)
+        return ponderer
+
+    def submit(self, player_name, engine, remaining=None, timeout=None):
+        self.submitted.append(engine)
+        return self.executor.submit(ai_service.compute_move, player_name,
+                                    ai_service.position_of(engine), remaining, timeout)
+
+    def wait(self, ponderer):
+        while ponderer.stats()['queued'] or ponderer.stats()['running']:
+            threading.Event().wait(0.01)
+
+
+class PondererTest(PonderTestMixin, TestCase):
+    def test_answers_pondered_reply(self):
+        ponderer = self.make_ponderer(moves=3, max_jobs=2, think_time=0.05)
+        engine = UltimateBoard()
+        engine.play(4, 4)
+        ponderer.start(1, PLAYER, engine)
+        self.wait(ponderer)
+        self.assertEqual(ponderer.stats()['cached'], 3)
+
+        human = plausible_moves(engine, 1)[0]
+        engine.play(*human)
+        move = ponderer.take(1, engine)
+        self.assertTrue(engine.is_legal(*move))
+        stats = ponderer.stats()
+        self.assertEqual((stats['hits'], stats['games']), (1, 0))
+
+    def test_miss_cancels_the_game(self):
+        ponderer = self.make_ponderer(moves=2, max_jobs=1, think_time=0.05)
+        engine = UltimateBoard()
+        engine.play(4, 4)
+        ponderer.start(1, PLAYER, engine)
+        engine.play(*plausible_moves(engine, 9)[-1])
+        self.assertIsNone(ponderer.take(1, engine))
+        self.wait(ponderer)
+        stats = ponderer.stats()
+        self.assertEqual((stats['misses'], stats['games'], stats['cached']), (1, 0, 0))
+        self.assertLessEqual(len(self.submitted), 2)
+
+    def test_limits(self):
+        ponderer = self.make_ponderer(moves=4, max_jobs=1, max_games=2, think_time=0.05)
+        for game_key in range(3):
+            ponderer.start(game_key, PLAYER, UltimateBoard())
+            self.assertLessEqual(ponderer.stats()['running'], 1)
+        self.assertEqual(list(ponderer.sessions), [1, 2])
+        ponderer.cancel(1)
+        ponderer.cancel(2)
+        self.wait(ponderer)
+        self.assertEqual(ponderer.stats()['games'], 0)
+
+    def test_expired_games_are_dropped(self):
+        ponderer = self.make_ponderer(moves=1, think_time=0.05, ttl=0)
+        ponderer.start(1, PLAYER, UltimateBoard())
+        self.wait(ponderer)
+        ponderer.start(2, PLAYER, UltimateBoard())
+        self.assertEqual(list(ponderer.sessions), [2])
+
+    def test_only_search_players_ponder(self):
+        ponderer = self.make_ponderer()
+        ponderer.start(1, 'game.players.GoodPlayer', UltimateBoard())
+        ponderer.start(2, 'random', UltimateBoard())
+        self.assertEqual(self.submitted, [])
+
+
+@override_settings(AI_PONDER=True, AI_SERVICE_WORKERS=1)
+class PlayAutoPonderTest(PonderTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.ponderer = self.make_ponderer(moves=9, max_jobs=2, think_time=0.05)
+        ponder._ponderer = self.ponderer
+
+    def tearDown(self):
+        ponder._ponderer = None
+        super().tearDown()
+
+    def test_play_auto_uses_cache(self):
+        game = Game.objects.create(player_x='human', player_o=PLAYER)
+        game.create_subgames()
+        self.ponderer.start(game.pk, PLAYER, game.engine)
+        self.wait(self.ponderer)
+        game.play(*plausible_moves(game.engine, 1)[0], 'X')
+        expected = self.ponderer.sessions[game.pk].answers[ponder.position_key(game.engine)]
+        game.play_auto()
+        self.assertEqual((game.last_main_index, game.last_sub_index), expected)
+        self.assertEqual(self.ponderer.stats()['hits'], 1)
+        # Pondering restarts on the human's clock after the AI's move.
+        self.assertIn(game.pk, self.ponderer.sessions)
+
+    def test_game_over_cancels(self):
+        game = Game.objects.create(player_x='human', player_o=PLAYER)
+        game.create_subgames()
+        self.ponderer.start(game.pk, PLAYER, game.engine)
+        game.winner = 'O'
+        game.play_auto()
+        self.assertNotIn(game.pk, self.ponderer.sessions)
+
+
+@override_settings(AI_SERVICE_WORKERS=1, AI_PONDER_MAX_JOBS=1)
+class PonderPoolTest(TestCase):
+    def tearDown(self):
+        ai_service.shutdown()
+
+    def test_live_moves_do_not_wait_for_pondering(self):
+        engine = UltimateBoard()
+        engine.play(4, 4)
+        # Starts the live worker.
+        ai_service.request_move('game.players.GoodPlayer', engine, timeout=30)
+        ponderer = Ponderer(moves=8, max_jobs=1, think_time=2)
+        ponderer.start(1, PLAYER, engine)
+        self.assertEqual((ponderer.stats()['running'], ponderer.stats()['queued']), (1, 7))
+
+        started = time.monotonic()
+        move = ai_service.request_move('game.players.GoodPlayer', engine, timeout=3)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertTrue(engine.is_legal(*move))
+        self.assertEqual(ponderer.stats()['running'], 1)
+        ponderer.cancel(1)
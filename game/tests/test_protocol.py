@@ -0,0 +1,93 @@
+import asyncio
+import json
+from io import StringIO
+
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+
+from game.management.commands.wire_benchmark import move_frames
+from game.models import Game
+from game.protocol import FRAMES, broadcast_event, decode, encode, negotiate
+from game.tests.test_consumers import application, drain
+
+OTHER_FRAMES = [
+    {'type': 'start', 'seq': 3, 'next_player': 'O', 'my_player': 'Guest_1', 'opponent': 'Guest_2',
+     'time_x': 290, 'time_o': 300, 'server_time': 1000, 'deadline': 301000, 'cells': ' ' * 90,
+     'active_index': 4},
+    {'type': 'restart', 'next_player': 'X', 'player_x': 'a', 'player_o': 'b', 'time_x': 60, 'time_o': 60,
+     'server_time': 5, 'deadline': 60005},
+    {'type': 'sync', 'client_time': 1, 'server_time': 2, 'resync': 60, 'time_x': None, 'time_o': None,
+     'deadline': None},
+    {'type': 'surrender', 'winner': 'O', 'message': "X surrendered. O wins!"},
+    {'type': 'replay_vote', 'from': 'X', 'vote': 'yes'},
+    {'type': 'player_assignment', 'player': 'X'},
+    {'type': 'waiting', 'message': 'Waiting for another player to join'},
+    {'type': 'error', 'message': 'Game is full'},
+]
+
+
+class ProtocolTest(TestCase):
+    def test_round_trip(self):
+        frames = move_frames(3) + OTHER_FRAMES
+        self.assertEqual({frame['type'] for frame in frames}, set(FRAMES))
+        for frame in frames:
+            compact = encode(frame, 2)
+            self.assertEqual(decode(compact), frame)
+            self.assertEqual(decode(encode(frame, 1)), frame)
+            self.assertLess(len(compact), len(encode(frame, 1)))
+
+    def test_move_delta(self):
+        frame = {'type': 'move', 'seq': 2, 'main_index': 4, 'sub_index': 7, 'player': 'O', 'next_player': 'X',
+                 'winner': None, 'active_index': 7, 'time_x': 299, 'time_o': 298, 'server_time': 10,
+                 'deadline': 299010, 'winning_line': None}
+        self.assertEqual(encode(frame, 2), '["m",2,43,null,7,299,298,10,299010]')
+
+    def test_negotiate(self):
+        for query, version in [(b'', 1), (b'proto=2', 2), (b'seat=X&proto=9', 2), (b'proto=0', 1),
+                               (b'proto=x', 1)]:
+            self.assertEqual(negotiate({'query_string': query}), version)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('wire_benchmark', games=2, repeat=1, watchers=[1, 3], fan_out_moves=5, stdout=out)
+        self.assertIn('v1:', out.getvalue())
+        self.assertIn('of the bytes', out.getvalue())
+        self.assertIn('3 sockets:', out.getvalue())
+
+    def test_broadcast_event(self):
+        frame = OTHER_FRAMES[3]
+        event = broadcast_event(frame)
+        self.assertEqual(event['type'], 'room_frame')
+        self.assertEqual(event['frames'], {'1': encode(frame, 1), '2': encode(frame, 2)})
+
+
+class CompactSocketTest(TransactionTestCase):
+    def test_compact_frames(self):
+        async def run():
+            sockets = [WebsocketCommunicator(application, f"/ws/game/PROTO1/?proto={proto}&seat={seat}")
+                       for proto, seat in [(2, 'X'), (1, 'O')]]
+            for socket in sockets:
+                await socket.connect()
+            await drain(sockets[1])
+            await sockets[0].send_json_to({'action': 'move', 'main_index': 4, 'sub_index': 4, 'player': 'X'})
+            frames = []
+            while not await sockets[0].receive_nothing(timeout=0.1):
+                frames.append(await sockets[0].receive_from())
+            await sockets[0].send_json_to({'action': 'state'})
+            state = await sockets[0].receive_from()
+            legacy = await sockets[1].receive_json_from()
+            for socket in sockets:
+                await socket.disconnect()
+            return frames, state, legacy
+
+        Game.objects.create(room_code='PROTO1', player_x='Guest_1', player_o='Guest_2')
+        frames, state, legacy = asyncio.run(run())
+        codes = [json.loads(frame)[0] for frame in frames]
+        self.assertEqual((codes[0], codes[-1]), ('p', 'm'))
+        self.assertIn('s', codes)
+        move = decode(frames[-1])
+        self.assertEqual((move['seq'], move['main_index'], move['sub_index'], move['player']), (1, 4, 4, 'X'))
+        self.assertEqual(decode(state)['seq'], 1)
+        self.assertEqual({key: legacy[key] for key in ('type', 'seq', 'main_index', 'sub_index', 'player')},
+                         {'type': 'move', 'seq': 1, 'main_index': 4, 'sub_index': 4, 'player': 'X'})
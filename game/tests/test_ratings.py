@@ -0,0 +1,95 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from game.models import Game, Rating
+from game.ratings import Leaderboard, get_leaderboard
+from game.results import snapshot, write_results
+
+
+class RatingTest(TestCase):
+    def setUp(self):
+        self.users = {name: User.objects.create_user(name) for name in ['alice', 'bob', 'carol']}
+
+    def play(self, *games):
+        "Writes the results of (player_x, player_o, winner) games, a second apart."
+        start = timezone.now()
+        results = []
+        for i, (player_x, player_o, winner) in enumerate(games):
+            game = Game.objects.create(player_x=player_x, player_o=player_o)
+            results.append(snapshot(game, winner))
+            results[-1]['date_played'] = start + timedelta(seconds=i)
+        write_results(results)
+
+    def ratings(self):
+        return {(rating.user.username, rating.pool): (round(rating.rating, 1), rating.games)
+                for rating in Rating.objects.select_related('user')}
+
+    def test_incremental(self):
+        self.play(('alice', 'bob', 'X'), ('bob', 'alice', 'draw'), ('alice', 'game.players.GoodPlayer', 'O'),
+                  ('Guest_1', 'carol', 'O'))
+        self.assertEqual(self.ratings(), {
+            ('alice', 'multi'): (1514.5, 2),
+            ('bob', 'multi'): (1485.5, 2),
+            ('alice', 'ai:GoodPlayer'): (1484.0, 1),
+        })
+        # Recording a result again does not rate it again.
+        game = Game.objects.order_by('pk').first()
+        write_results([snapshot(game, 'X')])
+        self.assertEqual(self.ratings()[('alice', 'multi')], (1514.5, 2))
+
+    def test_recompute(self):
+        self.play(('alice', 'bob', 'X'), ('bob', 'carol', 'O'), ('carol', 'alice', 'draw'), ('alice', 'bob', 'O'),
+                  ('carol', 'random', 'X'))
+        incremental = self.ratings()
+        Rating.objects.filter(user__username='alice').delete()
+        out = StringIO()
+        call_command('recompute_ratings', chunk_size=2, stdout=out)
+        self.assertEqual(self.ratings(), incremental)
+        self.assertIn('Rated 5 results; 4 ratings', out.getvalue())
+
+
+class LeaderboardTest(TestCase):
+    def setUp(self):
+        for name, rating in [('alice', 1600), ('bob', 1550), ('carol', 1550), ('dave', 1400)]:
+            user = User.objects.create_user(name)
+            Rating.objects.create(user=user, pool='multi', rating=rating, games=3)
+        Rating.objects.create(user=User.objects.get(username='dave'), pool='ai:GoodPlayer', rating=1450, games=1)
+
+    def test_top_and_rank(self):
+        board = Leaderboard(size=3, refresh=60)
+        self.assertEqual([(entry['rank'], entry['username'], entry['rating']) for entry in board.top()],
+                         [(1, 'alice', 1600), (2, 'bob', 1550), (2, 'carol', 1550)])
+        dave = User.objects.get(username='dave')
+        self.assertEqual(board.rank(dave)['rank'], 4)
+        self.assertEqual(board.rank(dave, 'ai:GoodPlayer')['rank'], 1)
+        self.assertIsNone(board.rank(User.objects.get(username='alice'), 'ai:GoodPlayer'))
+        self.assertEqual(board.pools(), ['ai:GoodPlayer', 'multi'])
+
+    def test_snapshot_is_refreshed_periodically(self):
+        board = Leaderboard(size=3, refresh=60)
+        board.top()
+        Rating.objects.filter(user__username='dave', pool='multi').update(rating=1700)
+        with self.assertNumQueries(0):
+            self.assertEqual(board.top()[0]['username'], 'alice')
+        board.refresh = 0
+        self.assertEqual(board.top()[0]['username'], 'dave')
+        self.assertEqual(board.builds, 2)
+
+    def test_views(self):
+        get_leaderboard().invalidate()
+        self.client.force_login(User.objects.get(username='dave'))
+        data = self.client.get(reverse('game:leaderboard_api'), {'pool': 'ai:GoodPlayer'}).json()
+        self.assertEqual(data['pool'], 'ai:GoodPlayer')
+        self.assertEqual(data['me'], {'rank': 1, 'username': 'dave', 'rating': 1450, 'games': 1})
+        self.assertEqual(data['pools'], [{'pool': 'ai:GoodPlayer', 'label': 'vs GoodPlayer'},
+                                         {'pool': 'multi', 'label': 'Multiplayer'}])
+        response = self.client.get(reverse('game:leaderboard'), {'pool': 'nope'})
+        self.assertEqual(response.context['pool'], 'multi')
+        self.assertContains(response, 'Your rank: <strong>#4</strong>')
+        get_leaderboard().invalidate()
@@ -0,0 +1,217 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from game.models import Game, GameResult, PlayerStats
+from game.results import ResultWriter, result_identifier, result_rows, snapshot, write_results
+
+
+class ResultRowsTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    def test_rows(self):
+        multi = Game.objects.create(player_x='alice', player_o='bob')
+        single = Game.objects.create(player_x='alice', player_o='game.players.GoodPlayer')
+        guest = Game.objects.create(player_x='Guest_1', player_o='bob')
+        guests = Game.objects.create(player_x='Guest_1', player_o='Guest_2')
+        rows = result_rows([snapshot(multi, 'X'), snapshot(single, 'draw'), snapshot(guest, 'X'),
+                            snapshot(guests, 'O')])
+        self.assertEqual([(row.player_x, row.player_o, row.name_x, row.name_o, row.mode, row.winner,
+                           row.game_identifier) for row in rows], [
+            (self.alice, self.bob, 'alice', 'bob', 'multi', 'X', f"{multi.pk}:0"),
+            (self.alice, None, 'alice', 'Computer', 'single', 'draw', f"{single.pk}:0"),
+            (None, self.bob, 'Guest_1', 'bob', 'multi', 'X', f"{guest.pk}:0"),
+        ])
+
+    def test_one_row_per_game(self):
+        GameResult.objects.create(game_identifier='7:1', player_x=self.alice, winner='X', mode='multi')
+        with self.assertRaises(IntegrityError):
+            GameResult.objects.create(game_identifier='7:1', player_o=self.alice, winner='X', mode='multi')
+
+    def test_for_user(self):
+        now = timezone.now()
+        for i, (player_x, player_o, winner) in enumerate([(self.alice, self.bob, 'X'), (self.bob, self.alice, 'X'),
+                                                          (self.bob, None, 'O'), (None, self.alice, 'draw')]):
+            GameResult.objects.create(game_identifier=str(i), player_x=player_x, player_o=player_o,
+                                      name_x=player_x.username if player_x else 'Guest_1',
+                                      name_o=player_o.username if player_o else 'Guest_2',
+                                      winner=winner, mode='multi', date_played=now + timedelta(minutes=i))
+        history = GameResult.objects.for_user(self.alice).order_by('date_played')
+        self.assertEqual([(game.game_identifier, game.opponent, game.result) for game in history],
+                         [('0', 'bob', 'win'), ('1', 'bob', 'loss'), ('3', 'Guest_1', 'draw')])
+
+
+@override_settings(PROFILE_PAGE_SIZE=4)
+class ProfileTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        game = Game.objects.create(player_x='alice', player_o='bob')
+        results = []
+        for i, winner in enumerate(['X', 'O', 'X', 'X', 'O', 'draw', 'X', 'draw', 'X']):
+            game.round = i
+            results.append(snapshot(game, winner))
+            # Pairs of games finish at the same time.
+            results[-1]['date_played'] = timezone.now() + timedelta(seconds=i // 2)
+        write_results(results)
+        self.client.force_login(self.alice)
+
+    def pages(self, sort):
+        pages, cursor = [], None
+        while True:
+            response = self.client.get(reverse('game:profile'), {'sort': sort, **({'after': cursor} if cursor else {})})
+            pages.append([int(game.game_identifier.split(':')[1]) for game in response.context['history']])
+            cursor = response.context['next_cursor']
+            if cursor is None:
+                return pages, response.context
+
+    def test_pages(self):
+        pages, context = self.pages('asc')
+        self.assertEqual(pages, [[0, 1, 2, 3], [4, 5, 6, 7], [8]])
+        pages, context = self.pages('desc')
+        self.assertEqual(pages, [[8, 7, 6, 5], [4, 3, 2, 1], [0]])
+        self.assertTrue(context['paged'])
+
+    def test_stats(self):
+        response = self.client.get(reverse('game:profile'))
+        self.assertEqual((response.context['total_games'], response.context['wins'], response.context['losses'],
+                          response.context['draws'], response.context['win_rate']), (9, 5, 2, 2, 55.6))
+        self.assertEqual(PlayerStats.objects.get(user=self.bob).wins, 2)
+        # Stats are not read from the history.
+        GameResult.objects.all().delete()
+        self.assertEqual(self.client.get(reverse('game:profile')).context['total_games'], 9)
+
+    def test_bad_cursor(self):
+        response = self.client.get(reverse('game:profile'), {'after': 'x.1'})
+        self.assertEqual(len(response.context['history']), 4)
+        self.assertFalse(response.context['paged'])
+
+
+class ResultWriterTest(TransactionTestCase):
+    def test_batches_and_duplicates(self):
+        User.objects.create_user('alice')
+        User.objects.create_user('bob')
+        game = Game.objects.create(player_x='alice', player_o='bob')
+        writer = ResultWriter(batch_size=10, flush_interval=0.2)
+        # The consumer and a view both record the first round.
+        writer.submit(game, 'X')
+        writer.submit(game, 'X')
+        game.round += 1
+        writer.submit(game, 'draw')
+        writer.flush()
+        self.assertEqual(writer.stats(), {'submitted': 3, 'pending': 0, 'batches': 1, 'failures': 0,
+                                          'retried': 0, 'dropped': 0})
+        self.assertEqual(sorted(GameResult.objects.values_list('game_identifier', 'winner')),
+                         [(f"{game.pk}:0", 'X'), (result_identifier(game), 'draw')])
+        # Recorded again later, in another batch.
+        writer.submit(game, 'draw')
+        writer.flush()
+        self.assertEqual(GameResult.objects.count(), 2)
+        self.assertEqual(list(PlayerStats.objects.order_by('user__username').values_list(
+            'games', 'wins', 'losses', 'draws')), [(2, 1, 0, 1), (2, 0, 1, 1)])
+
+    def test_failed_batch_is_retried(self):
+        User.objects.create_user('alice')
+        game = Game.objects.create(player_x='alice', player_o='game.players.GoodPlayer')
+        writer = ResultWriter(batch_size=10, flush_interval=0, retry_delay=0)
+        attempts = []
+
+        def fail_once(batch):
+            attempts.append(len(batch))
+            if len(attempts) == 1:
+                raise OperationalError("database is locked")
+            return write_results(batch)
+
+        with patch('game.results.write_results', side_effect=fail_once):
+            with self.assertLogs('game.results', 'ERROR') as logs:
+                writer.submit(game, 'X')
+                writer.flush()
+        self.assertEqual(attempts, [1, 1])
+        self.assertIn("Error writing 1 game results", logs.output[0])
+        self.assertEqual(GameResult.objects.get().winner, 'X')
+        stats = writer.stats()
+        self.assertEqual((stats['batches'], stats['failures'], stats['retried'], stats['dropped']), (1, 1, 1, 0))
+
+    def test_gives_up_after_attempts(self):
+        User.objects.create_user('alice')
+        game = Game.objects.create(player_x='alice', player_o='game.players.GoodPlayer')
+        writer = ResultWriter(batch_size=10, flush_interval=0, max_attempts=2, retry_delay=0)
+        with patch('game.results.write_results', side_effect=OperationalError("database is locked")):
+            with self.assertLogs('game.results', 'ERROR') as logs:
+                writer.submit(game, 'X')
+                writer.flush()
+        self.assertIn("Gave up writing the result of game", logs.output[-1])
+        self.assertFalse(GameResult.objects.exists())
+        stats = writer.stats()
+        self.assertEqual((stats['failures'], stats['retried'], stats['dropped']), (2, 1, 1))
+
+
+class BackfillTest(TransactionTestCase):
+    before = [('game', '0006_game_increment')]
+    after = [('game', '0008_gameresult')]
+    stats = [('game', '0009_playerstats')]
+    merged = [('game', '0012_merge_split_rounds')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_backfill(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        GameHistory = apps.get_model('game', 'GameHistory')
+        Player = apps.get_model('auth', 'User')
+        alice = Player.objects.create(username='alice')
+        bob = Player.objects.create(username='bob')
+        start = timezone.now() - timedelta(hours=1)
+        rows = []
+        for user, opponent, mode, result, identifier, minute in [
+                (alice, 'bob', 'multi', 'win', 'ROOM01_1', 0), (bob, 'alice', 'multi', 'loss', 'ROOM01_1', 0),
+                (alice, 'Computer', 'single', 'draw', None, 1), (bob, 'Guest_3', 'multi', 'win', 'ROOM02', 2),
+                (alice, 'bob', 'multi', 'loss', 'ROOM03', 3),
+                # Two rounds in one room, under the room code.
+                (alice, 'bob', 'multi', 'win', 'ABC123', 10), (bob, 'alice', 'multi', 'loss', 'ABC123', 10),
+                (bob, 'alice', 'multi', 'win', 'ABC123', 13), (alice, 'bob', 'multi', 'loss', 'ABC123', 13)]:
+            row = GameHistory.objects.create(user=user, opponent=opponent, mode=mode, result=result,
+                                             game_identifier=identifier, moves=20)
+            GameHistory.objects.filter(pk=row.pk).update(date_played=start + timedelta(minutes=minute))
+            rows.append(row)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        GameResult = executor.loader.project_state(self.after).apps.get_model('game', 'GameResult')
+        self.assertEqual(sorted(GameResult.objects.values_list(
+            'game_identifier', 'player_x__username', 'player_o__username', 'name_o', 'winner', 'mode', 'moves')), [
+            ('ABC123', 'alice', 'bob', 'bob', 'X', 'multi', 20),
+            # 0007 gave the two rows of the second round different suffixes.
+            (f'ABC123#{rows[7].pk}', 'bob', 'alice', 'alice', 'X', 'multi', 20),
+            (f'ABC123#{rows[8].pk}', 'alice', 'bob', 'bob', 'O', 'multi', 20),
+            ('ROOM01_1', 'alice', 'bob', 'bob', 'X', 'multi', 20),
+            ('ROOM02', 'bob', None, 'Guest_3', 'X', 'multi', 20),
+            ('ROOM03', 'alice', 'bob', 'bob', 'O', 'multi', 20),
+            (f'history:{rows[2].pk}', 'alice', None, 'Computer', 'draw', 'single', 20),
+        ])
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.stats)
+        PlayerStats = executor.loader.project_state(self.stats).apps.get_model('game', 'PlayerStats')
+        self.assertEqual(sorted(PlayerStats.objects.values_list('user__username', 'games', 'wins', 'losses', 'draws')),
+                         [('alice', 6, 2, 3, 1), ('bob', 6, 4, 2, 0)])
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.merged)
+        apps = executor.loader.project_state(self.merged).apps
+        self.assertEqual(sorted(apps.get_model('game', 'GameResult').objects.filter(
+            game_identifier__startswith='ABC123').values_list('game_identifier', 'player_x__username', 'winner')), [
+            ('ABC123', 'alice', 'X'), (f'ABC123#{rows[7].pk}', 'bob', 'X')])
+        self.assertEqual(sorted(apps.get_model('game', 'PlayerStats').objects.values_list(
+            'user__username', 'games', 'wins', 'losses', 'draws')), [('alice', 5, 2, 2, 1), ('bob', 5, 3, 2, 0)])
@@ -0,0 +1,176 @@
+import asyncio
+import shutil
+import socket
+import subprocess
+import time
+import unittest
+
+from django.test import TestCase
+
+from game.room_backends import MemoryRoomBackend, RedisRoomBackend
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+def start_redis_server():
+    "Starts a throwaway redis-server on a free port; returns (process, url)."
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen(['redis-server', '--port', str(port), '--save', '', '--appendonly', 'no'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for attempt in range(50):
+        try:
+            socket.create_connection(('localhost', port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return process, f"redis://localhost:{port}/0"
+
+
+class RedisServerMixin:
+    "Runs tests against a local redis-server, or fakeredis's in-process server."
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.redis_process = None
+        if shutil.which('redis-server'):
+            cls.redis_process, cls.redis_url = start_redis_server()
+        elif fakeredis is not None:
+            cls.fake_server = fakeredis.FakeServer()
+        else:
+            raise unittest.SkipTest("Needs redis-server or fakeredis")
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.redis_process:
+            cls.redis_process.terminate()
+            cls.redis_process.wait()
+        super().tearDownClass()
+
+    def redis_backend(self, prefix):
+        if self.redis_process:
+            return RedisRoomBackend(self.redis_url, prefix=prefix)
+        return RedisRoomBackend(prefix=prefix, connect=lambda: fakeredis.FakeAsyncRedis(
+            server=self.fake_server, decode_responses=True))
+
+
+class RoomBackendTests:
+    def run_async(self, coroutine):
+        return asyncio.run(coroutine)
+
+    def test_create_and_get(self):
+        backend = self.backend
+
+        async def run():
+            self.assertIsNone(await backend.get('R1'))
+            self.assertEqual(await backend.create('R1', 'first', 3), (0, 'first'))
+            # A room that is live already keeps its state.
+            self.assertEqual(await backend.create('R1', 'second', 4), (0, 'first'))
+            return await backend.get('R1')
+
+        self.assertEqual(self.run_async(run()), (0, 'first'))
+
+    def test_commit_over_revision(self):
+        backend = self.backend
+
+        async def run():
+            await backend.create('R1', 'start', 0)
+            self.assertEqual(await backend.commit('R1', 0, 'one', ['m1']), 1)
+            # A commit made from revision 0 lost the race.
+            self.assertIsNone(await backend.commit('R1', 0, 'other', ['m2']))
+            self.assertEqual(await backend.commit('R1', 1, 'two', ['m2', 'm3']), 2)
+            self.assertIsNone(await backend.commit('R2', 0, 'none'))
+            return await backend.get('R1')
+
+        self.assertEqual(self.run_async(run()), (2, 'two'))
+
+    def test_take(self):
+        backend = self.backend
+
+        async def run():
+            await backend.create('R1', 'start', 5)
+            self.assertIsNone(await backend.take('R1'))
+            await backend.commit('R1', 0, 'one', ['m1'])
+            await backend.commit('R1', 1, 'two', ['m2'])
+            self.assertEqual(await backend.take('R1'), (5, 'two', ['m1', 'm2']))
+            self.assertIsNone(await backend.take('R1'))
+            # Clock ticks commit fields without moves.
+            await backend.commit('R1', 2, 'three')
+            self.assertEqual(await backend.take('R1'), (6, 'three', []))
+            self.assertIsNone(await backend.take('R2'))
+
+        self.run_async(run())
+
+    def test_reset(self):
+        backend = self.backend
+
+        async def run():
+            await backend.create('R1', 'start', 5)
+            await backend.commit('R1', 0, 'one', ['m1'])
+            revision = await backend.reset('R1', 'reloaded', 9)
+            self.assertEqual(await backend.get('R1'), (revision, 'reloaded'))
+            self.assertIsNone(await backend.commit('R1', 1, 'stale'))
+            self.assertIsNone(await backend.take('R1'))
+            await backend.commit('R1', revision, 'next', ['m2'])
+            self.assertEqual(await backend.take('R1'), (9, 'next', ['m2']))
+
+        self.run_async(run())
+
+    def test_votes(self):
+        backend = self.backend
+
+        async def run():
+            self.assertIsNone(await backend.vote('R1', 'X', 'yes'))
+            self.assertEqual(await backend.vote('R1', 'O', 'yes'), 'restart')
+            self.assertIsNone(await backend.vote('R1', 'X', 'yes'))
+            self.assertEqual(await backend.vote('R1', 'O', 'no'), 'cancel')
+            await backend.vote('R1', 'X', 'yes')
+            await backend.clear_votes('R1')
+            self.assertIsNone(await backend.vote('R1', 'O', 'yes'))
+
+        self.run_async(run())
+
+    def test_lease(self):
+        backend = self.backend
+
+        async def run():
+            self.assertTrue(await backend.acquire('R1', 'a', 10))
+            self.assertTrue(await backend.acquire('R1', 'a', 10))
+            self.assertFalse(await backend.acquire('R1', 'b', 10))
+            await backend.release('R1', 'b')
+            self.assertFalse(await backend.acquire('R1', 'b', 10))
+            await backend.release('R1', 'a')
+            self.assertTrue(await backend.acquire('R1', 'b', 0.05))
+            await asyncio.sleep(0.1)
+            self.assertTrue(await backend.acquire('R1', 'a', 10))
+
+        self.run_async(run())
+
+    def test_sockets_and_delete(self):
+        backend = self.backend
+
+        async def run():
+            await backend.create('R1', 'start', 0)
+            self.assertEqual(await backend.join('R1'), 1)
+            self.assertEqual(await backend.join('R1'), 2)
+            self.assertEqual(await backend.leave('R1'), 1)
+            self.assertEqual(await backend.leave('R1'), 0)
+            await backend.delete('R1')
+            self.assertIsNone(await backend.get('R1'))
+
+        self.run_async(run())
+
+
+class MemoryRoomBackendTest(RoomBackendTests, TestCase):
+    def setUp(self):
+        self.backend = MemoryRoomBackend()
+
+
+class RedisRoomBackendTest(RedisServerMixin, RoomBackendTests, TestCase):
+    def setUp(self):
+        self.backend = self.redis_backend(f"test:{self._testMethodName}:{time.monotonic()}:")
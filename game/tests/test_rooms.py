@@ -0,0 +1,259 @@
+import asyncio
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.core.exceptions import ValidationError
+from django.db import OperationalError
+from django.test import TransactionTestCase
+
+from game.models import Game, Move
+from game.room_backends import MemoryRoomBackend
+from game.rooms import RoomRegistry, get_registry, write_batch
+from game.tests.test_consumers import connect, drain
+from game.tests.test_room_backends import RedisServerMixin
+
+
+def new_game(room_code):
+    game = Game(room_code=room_code, player_x='Guest_1', player_o='Guest_2')
+    game.create_subgames()
+    return game
+
+
+def play(*move):
+    return lambda game: game.apply_move(*move, persist=False)
+
+
+class RoomRegistryTest(TransactionTestCase):
+    def setUp(self):
+        self.game = new_game('ROOM01')
+        self.registry = RoomRegistry(MemoryRoomBackend(), flush_interval=60)
+
+    def test_moves_wait_for_the_flush(self):
+        async def run():
+            room = await self.registry.join('ROOM01')
+            for move in [(4, 4), (4, 0), (0, 4)]:
+                await self.registry.update(room, play(*move))
+            written = await sync_to_async(Move.objects.count)()
+            await self.registry.flush(room)
+            return room, written
+
+        room, written = asyncio.run(run())
+        self.assertEqual(written, 0)
+        self.assertEqual(Move.objects.count(), 3)
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual((game.ply, game.state, game.version), (3, room.game.state, self.game.version + 1))
+        self.assertEqual(self.registry.stats()['flushes'], 1)
+
+    def test_failed_move_is_not_committed(self):
+        async def run():
+            room = await self.registry.join('ROOM01')
+            await self.registry.update(room, play(4, 4))
+            with self.assertRaises(ValidationError):
+                await self.registry.update(room, play(0, 0))
+            return room.revision
+
+        self.assertEqual(asyncio.run(run()), 1)
+
+    def test_flush_loop(self):
+        self.registry.flush_interval = 0.01
+
+        async def run():
+            room = await self.registry.join('ROOM01')
+            await self.registry.update(room, play(4, 4))
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.assertEqual(Game.objects.get(pk=self.game.pk).ply, 1)
+
+    def test_leave_flushes_and_forgets(self):
+        async def run():
+            first = await self.registry.join('ROOM01')
+            second = await self.registry.join('ROOM01')
+            self.assertIs(first, second)
+            await self.registry.update(first, play(4, 4))
+            await self.registry.leave(first)
+            self.assertIn('ROOM01', self.registry.rooms)
+            await self.registry.leave(second)
+            return await self.registry.backend.get('ROOM01')
+
+        self.assertIsNone(asyncio.run(run()))
+        self.assertEqual(self.registry.rooms, {})
+        self.assertEqual(Game.objects.get(pk=self.game.pk).ply, 1)
+
+    def test_restart_writes_the_finished_round_first(self):
+        async def run():
+            room = await self.registry.join('ROOM01')
+            await self.registry.update(room, play(4, 4))
+            await self.registry.update(room, lambda game: game.reset_state(persist=False))
+            await self.registry.update(room, play(0, 0))
+            await self.registry.flush(room)
+
+        asyncio.run(run())
+        self.assertEqual(list(Move.objects.order_by('round', 'ply').values_list('round', 'ply', 'main_index')),
+                         [(0, 1, 4), (1, 1, 0)])
+        game = Game.objects.get(pk=self.game.pk)
+        self.assertEqual((game.round, game.ply), (1, 1))
+
+    def test_failed_flush_is_retried(self):
+        failures = []
+
+        def fail_once(*args):
+            if not failures:
+                failures.append(args)
+                raise OperationalError("database is locked")
+            return write_batch(*args)
+
+        async def run():
+            room = await self.registry.join('ROOM01')
+            await self.registry.update(room, play(4, 4))
+            with patch('game.rooms.write_batch', side_effect=fail_once):
+                with self.assertLogs('game.rooms', 'ERROR'):
+                    await self.registry.flush(room)
+                written = await sync_to_async(Move.objects.count)()
+                # Played while the batch waits; written after it.
+                await self.registry.update(room, play(4, 0))
+                await self.registry.flush(room)
+            return room, written
+
+        room, written = asyncio.run(run())
+        self.assertEqual(written, 0)
+        self.assertIsNone(room.unflushed)
+        self.assertEqual((room.game.ply, room.revision), (2, 2))
+        self.assertEqual(list(Move.objects.order_by('ply').values_list('ply', 'main_index', 'sub_index')),
+                         [(1, 4, 4), (2, 4, 0)])
+        self.assertEqual(Game.objects.get(pk=self.game.pk).ply, 2)
+        self.assertEqual((self.registry.failures, self.registry.flushes), (1, 2))
+
+    def test_failed_flush_reloads_the_room(self):
+        async def run():
+            room = await self.registry.join('ROOM01')
+            await self.registry.update(room, play(4, 4))
+            await sync_to_async(Game.objects.filter(pk=self.game.pk).update)(version=5)
+            layer = get_channel_layer()
+            channel = await layer.new_channel()
+            await layer.group_add(room.group_name, channel)
+            with self.assertLogs('game.rooms', 'ERROR'):
+                for attempt in range(self.registry.flush_retries):
+                    self.assertEqual(room.game.version, self.game.version)
+                    await self.registry.flush(room)
+            # The sockets are sent the position the room was reset to.
+            return room, await asyncio.wait_for(layer.receive(channel), 1)
+
+        room, message = asyncio.run(run())
+        self.assertEqual(message['type'], 'start_game')
+        self.assertEqual(self.registry.failures, 3)
+        self.assertIsNone(room.unflushed)
+        self.assertEqual(room.game.version, 5)
+        # The moves were written with the failed batch and replayed on load.
+        self.assertEqual(room.game.ply, 1)
+
+    def test_flush_all(self):
+        async def run():
+            room = await self.registry.join('ROOM01')
+            await self.registry.update(room, play(4, 4))
+
+        asyncio.run(run())
+        self.registry.flush_all()
+        self.assertEqual(Game.objects.get(pk=self.game.pk).ply, 1)
+
+
+class SharedRoomTests:
+    "Two registries on one backend stand for two processes serving a room."
+
+    def setUp(self):
+        self.game = new_game('SHARE1')
+        self.registries = [RoomRegistry(self.make_backend(), flush_interval=60) for i in range(2)]
+
+    def test_moves_from_both_processes(self):
+        first, second = self.registries
+
+        async def run():
+            rooms = [await first.join('SHARE1'), await second.join('SHARE1')]
+            await first.update(rooms[0], play(4, 4))
+            # The second copy is a move behind; its commit fails, and the
+            # move is checked again on the position after (4, 4).
+            with self.assertRaisesMessage(ValidationError, "It is not your turn"):
+                await second.update(rooms[1], lambda game: game.apply_move(4, 0, 'X', persist=False))
+            await second.update(rooms[1], lambda game: game.apply_move(4, 0, 'O', persist=False))
+            await first.refresh(rooms[0])
+            self.assertEqual(rooms[0].game.state, rooms[1].game.state)
+            self.assertEqual([room.owned for room in rooms], [True, False])
+            await second.flush(rooms[1])
+            await first.flush(rooms[0])
+            return rooms
+
+        rooms = asyncio.run(run())
+        self.assertEqual(list(Move.objects.order_by('ply').values_list('symbol', 'main_index', 'sub_index')),
+                         [('X', 4, 4), ('O', 4, 0)])
+        self.assertEqual(Game.objects.get(pk=self.game.pk).state, rooms[1].game.state)
+
+    def test_votes_from_both_processes(self):
+        first, second = self.registries
+
+        async def run():
+            rooms = [await first.join('SHARE1'), await second.join('SHARE1')]
+            self.assertIsNone(await first.vote(rooms[0], 'X', 'yes'))
+            return await second.vote(rooms[1], 'O', 'yes')
+
+        self.assertEqual(asyncio.run(run()), 'restart')
+
+    def test_lease_moves_when_the_holder_leaves(self):
+        first, second = self.registries
+
+        async def run():
+            rooms = [await first.join('SHARE1'), await second.join('SHARE1')]
+            await second.update(rooms[1], play(4, 4))
+            await first.leave(rooms[0])
+            await second._claim(rooms[1])
+            self.assertTrue(rooms[1].owned)
+            await second.flush(rooms[1])
+
+        asyncio.run(run())
+        self.assertEqual(Game.objects.get(pk=self.game.pk).ply, 1)
+
+
+class MemorySharedRoomTest(SharedRoomTests, TransactionTestCase):
+    def make_backend(self):
+        if not hasattr(self, 'backend'):
+            self.backend = MemoryRoomBackend()
+        return self.backend
+
+
+class RedisSharedRoomTest(RedisServerMixin, SharedRoomTests, TransactionTestCase):
+    def make_backend(self):
+        return self.redis_backend(f"test:{self._testMethodName}:")
+
+
+class WriteBehindConsumerTest(TransactionTestCase):
+    def setUp(self):
+        self.registry = get_registry()
+        self.flush_interval = self.registry.flush_interval
+        self.registry.flush_interval = 60
+
+    def tearDown(self):
+        self.registry.flush_interval = self.flush_interval
+
+    def test_moves_are_broadcast_before_they_are_written(self):
+        async def run():
+            sockets = [await connect('WB0001'), await connect('WB0001')]
+            for socket in sockets:
+                await drain(socket)
+            written = []
+            for main_index, sub_index, player in [(4, 4, 'X'), (4, 0, 'O'), (0, 4, 'X')]:
+                mover, other = sockets if player == 'X' else sockets[::-1]
+                await mover.send_json_to({'action': 'move', 'main_index': main_index,
+                                          'sub_index': sub_index, 'player': player})
+                messages = await drain(other)
+                await drain(mover)
+                self.assertEqual([m['type'] for m in messages], ['move'])
+                written.append(await sync_to_async(Move.objects.count)())
+            for socket in sockets:
+                await socket.disconnect()
+            return written
+
+        self.assertEqual(asyncio.run(run()), [0, 0, 0])
+        game = Game.objects.get(room_code='WB0001')
+        self.assertEqual(game.ply, 3)
+        self.assertEqual(game.moves.count(), 3)
+        self.assertNotIn('WB0001', self.registry.rooms)
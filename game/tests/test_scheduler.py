@@ -0,0 +1,68 @@
+import threading
+
+from django.test import TestCase, override_settings
+
+from game.engine import UltimateBoard
+from game.scheduler import MoveScheduler
+
+
+@override_settings(AI_SERVICE_WORKERS=0, AI_MOVE_TIMEOUT=1.0)
+class MoveSchedulerTest(TestCase):
+    def test_request_move(self):
+        scheduler = MoveScheduler(slots=1)
+        engine = UltimateBoard()
+        engine.play(0, 4)
+        move = scheduler.request_move(1, 'game.players.LegendPlayer', engine)
+        self.assertEqual(move[0], 4)
+        stats = scheduler.stats()
+        self.assertEqual((stats['requests'], stats['running'], stats['queue_depth']), (1, 0, 0))
+        self.assertEqual(stats['degraded'], 0)
+
+    def test_think_time_shrinks_with_queue(self):
+        scheduler = MoveScheduler(slots=2, min_think_time=0.1)
+        self.assertEqual(scheduler.think_time(), 1.0)
+        scheduler.running, scheduler.queued = 2, 2
+        self.assertEqual(scheduler.think_time(), 0.5)
+        scheduler.queued = 100
+        self.assertEqual(scheduler.think_time(), 0.1)
+
+    def test_shed_when_queue_is_full(self):
+        scheduler = MoveScheduler(slots=1, max_queue=0)
+        engine = UltimateBoard()
+        move = scheduler.request_move(1, 'game.players.UltimatePlayer', engine)
+        self.assertTrue(engine.is_legal(*move))
+        self.assertEqual(scheduler.stats()['shed'], 1)
+
+    def test_round_robin_between_games(self):
+        scheduler = MoveScheduler(slots=1)
+        scheduler.running = 1  # Hold the only slot while the queue fills up.
+        order = []
+
+        def request(game_key):
+            scheduler.acquire(game_key)
+            order.append(game_key)
+            scheduler.release()
+
+        threads = []
+        for game_key in ['a', 'a', 'a', 'b']:
+            thread = threading.Thread(target=request, args=(game_key,))
+            thread.start()
+            threads.append(thread)
+            while scheduler.stats()['queue_depth'] < len(threads):
+                pass
+        scheduler.release()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, ['a', 'b', 'a', 'a'])
+        stats = scheduler.stats()
+        self.assertEqual(stats['max_queue_depth'], 4)
+        self.assertEqual(stats['degraded'], 3)  # The last move ran alone.
+
+
+@override_settings(AI_SERVICE_WORKERS=0)
+class MetricsViewTest(TestCase):
+    def test_ai_metrics(self):
+        response = self.client.get('/game/metrics/ai/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('queue_depth', response.json()['scheduler'])
+        self.assertIn('hit_rate', next(iter(response.json()['tables']['live'].values())))
@@ -0,0 +1,72 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from game.models import Game
+from game.players import get_transposition_table
+from game.selfplay import elo_difference, make_player, play_game, resolve_player, run_tournament
+
+
+class SelfPlayTest(TestCase):
+    def test_resolve_player(self):
+        self.assertEqual(resolve_player('good'), 'game.players.GoodPlayer')
+        self.assertEqual(resolve_player('LegendPlayer'), 'game.players.LegendPlayer')
+        with self.assertRaises(ValueError):
+            resolve_player('foobar')
+
+    def test_play_game_is_seeded(self):
+        first = play_game('game.players.RandomPlayer', 'game.players.GoodPlayer', seed=7)
+        second = play_game('game.players.RandomPlayer', 'game.players.GoodPlayer', seed=7)
+        self.assertEqual(first['moves'], second['moves'])
+        self.assertIn(first['winner'], ('X', 'O', 'draw'))
+
+    def test_run_tournament(self):
+        result = run_tournament('good', 'random', games=6, seed=1)
+        self.assertEqual(result['wins'] + result['draws'] + result['losses'], 6)
+        self.assertEqual(set(result['latency']), {'first', 'second'})
+        self.assertEqual((result['first'], result['second']),
+                         ('game.players.GoodPlayer', 'game.players.RandomPlayer'))
+        self.assertEqual(Game.objects.count(), 0)
+
+    def test_mirror_match_keeps_both_seats(self):
+        result = run_tournament('good', 'good', games=2, seed=3)
+        moves = result['latency']['first']['moves'] + result['latency']['second']['moves']
+        self.assertEqual(moves, result['avg_plies'] * 2)
+        self.assertGreater(result['latency']['second']['moves'], 0)
+
+    def test_each_game_gets_fresh_tables(self):
+        first, second = make_player('game.players.UltimatePlayer'), make_player('game.players.UltimatePlayer')
+        self.assertIsNot(first.table, second.table)
+        self.assertIsNot(first.table, get_transposition_table())
+        probes = get_transposition_table().probes
+        play_game('game.players.UltimatePlayer', 'game.players.RandomPlayer', seed=5, think_time=0.01)
+        self.assertEqual(get_transposition_table().probes, probes)
+
+    def test_elo_difference(self):
+        self.assertEqual(elo_difference(0.5), 0)
+        self.assertAlmostEqual(elo_difference(0.75), 190.8, places=1)
+        self.assertEqual(elo_difference(1.0), 800)
+
+
+class TournamentCommandTest(TestCase):
+    def test_output_and_baseline(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'baseline.json')
+            call_command('tournament', 'good', 'random', games=4, workers=1, output=path, stdout=StringIO())
+            with open(path) as f:
+                self.assertEqual(json.load(f)['games'], 4)
+            out = StringIO()
+            # Sub-millisecond latencies are noisy; only the score is held to the baseline here.
+            call_command('tournament', 'good', 'random', games=4, workers=1, baseline=path,
+                         max_slowdown=1000, stdout=out)
+            self.assertIn('first.p90', out.getvalue())
+            self.assertIn('No regressions', out.getvalue())
+
+    def test_unknown_player(self):
+        with self.assertRaises(CommandError):
+            call_command('tournament', 'good', 'foobar', games=1, workers=1, stdout=StringIO())
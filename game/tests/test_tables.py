@@ -0,0 +1,49 @@
+from django.test import TestCase
+
+from game.engine import board_masks
+from game.players import GoodPlayer, LegendPlayer
+from game.tables import STATES, SubBoardTable, decode, get_table, index, load_table
+
+
+class SubBoardTableTest(TestCase):
+    def setUp(self):
+        self.table = get_table()
+
+    def test_index_round_trip(self):
+        for code in (0, 1, 2, 3, 4242, STATES - 1):
+            self.assertEqual(index(*decode(code)), code)
+
+    def test_empty_board_is_a_draw(self):
+        self.assertEqual(self.table.value(0, 0, 'X'), 0)
+        self.assertEqual(self.table.value(0, 0, 'O'), 0)
+
+    def test_forced_win(self):
+        # X holds two corners with the center open: a fork either way.
+        x, o = board_masks("X O     X")
+        self.assertEqual(self.table.value(x, o, 'X'), 1)
+        self.assertEqual(self.table.best_moves(x, o, 'X'), [4])
+
+    def test_threats(self):
+        x, o = board_masks("XX  O    ")
+        self.assertEqual(self.table.threats(x, o, 'X'), 1 << 2)
+        self.assertEqual(self.table.threats(x, o, 'O'), 0)
+
+    def test_dead(self):
+        self.assertTrue(self.table.is_dead(*board_masks("XOXXOOOXX")))
+        self.assertTrue(self.table.is_dead(*board_masks("XOX OXOXO")))
+        self.assertFalse(self.table.is_dead(*board_masks("XOX      ")))
+
+    def test_shipped_file_matches_build(self):
+        built = SubBoardTable.build()
+        loaded = load_table()
+        self.assertEqual(loaded.to_bytes(), built.to_bytes())
+
+
+class TablePlayersTest(TestCase):
+    def test_good_player_blocks(self):
+        self.assertEqual(GoodPlayer().find_winning_move(list("OO XX    "), 'X'), 5)
+        self.assertEqual(GoodPlayer().find_winning_move(list("OO XX    "), 'O'), 2)
+
+    def test_legend_player_wins_fastest(self):
+        self.assertEqual(LegendPlayer().find_best_move(list("OO XX    "), 'X'), 5)
+        self.assertEqual(LegendPlayer().find_best_move(list("OO XX    "), 'O'), 2)
@@ -0,0 +1,90 @@
+from django.test import TestCase
+
+from game.engine import UltimateBoard
+from game.search import Search
+from game.transposition import (EXACT, INVERSES, LOWER, SYMMETRIES, PositionHash, TranspositionTable,
+                                from_canonical, to_canonical)
+
+
+def transformed(moves, perm):
+    engine = UltimateBoard()
+    for main_index, sub_index in moves:
+        engine.play(perm[main_index], perm[sub_index])
+    return engine
+
+
+class PositionHashTest(TestCase):
+    moves = [(0, 1), (1, 5), (5, 0), (0, 4)]
+
+    def test_symmetries_are_distinct(self):
+        self.assertEqual(len(set(SYMMETRIES)), 8)
+        for perm, inverse in zip(SYMMETRIES, INVERSES):
+            self.assertEqual([inverse[perm[i]] for i in range(9)], list(range(9)))
+
+    def test_symmetric_positions_share_a_key(self):
+        keys = set()
+        for perm in SYMMETRIES:
+            engine = transformed(self.moves, perm)
+            keys.add(PositionHash(engine).key(engine)[0])
+        self.assertEqual(len(keys), 1)
+
+    def test_incremental_matches_scratch(self):
+        engine = UltimateBoard()
+        position = PositionHash(engine)
+        for main_index, sub_index in self.moves:
+            position.toggle(main_index, sub_index, engine.turn)
+            engine.play(main_index, sub_index)
+        self.assertEqual(position.key(engine), PositionHash(engine).key(engine))
+
+    def test_active_board_is_part_of_the_key(self):
+        engine = transformed(self.moves, SYMMETRIES[0])
+        position = PositionHash(engine)
+        key = position.key(engine)[0]
+        engine.active = None
+        self.assertNotEqual(position.key(engine)[0], key)
+
+    def test_canonical_move_round_trip(self):
+        for symmetry in range(8):
+            self.assertEqual(from_canonical(to_canonical((2, 7), symmetry), symmetry), (2, 7))
+
+
+class TranspositionTableTest(TestCase):
+    def test_store_and_probe(self):
+        table = TranspositionTable(1024)
+        table.store(12345, 4, EXACT, -250, (3, 8))
+        self.assertEqual(table.probe(12345), (4, EXACT, -250, (3, 8)))
+        self.assertIsNone(table.probe(54321))
+        self.assertEqual(table.stats()['hit_rate'], 0.5)
+
+    def test_fixed_memory_budget(self):
+        table = TranspositionTable(1024)
+        self.assertEqual(table.size, 64)
+        self.assertLessEqual(table.memory_bytes, 1024)
+        for key in range(2, 2000, 2):
+            table.store(key, 1, EXACT, 0, None)
+        self.assertEqual(table.used, table.size)
+        self.assertLessEqual(table.memory_bytes, 1024)
+
+    def test_depth_preferred_replacement(self):
+        table = TranspositionTable(32)  # A single bucket
+        table.store(2, 8, LOWER, 10, (0, 0))
+        table.store(4, 1, EXACT, 20, (1, 1))
+        table.store(6, 1, EXACT, 30, (2, 2))
+        # The deep entry survives; the always-replace slot holds the newest.
+        self.assertEqual(table.probe(2)[0], 8)
+        self.assertIsNone(table.probe(4))
+        self.assertEqual(table.probe(6)[2], 30)
+
+
+class SearchWithTableTest(TestCase):
+    def test_table_cuts_nodes(self):
+        engine = UltimateBoard()
+        engine.play(4, 4)
+        engine.play(4, 0)
+        plain = Search(max_depth=4)
+        plain.run(engine)
+        cached = Search(max_depth=4, table=TranspositionTable(1 << 20))
+        move = cached.run(engine)
+        self.assertTrue(engine.is_legal(*move))
+        self.assertLess(cached.nodes, plain.nodes)
+        self.assertGreater(cached.table.hits, 0)
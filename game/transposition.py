@@ -0,0 +1,177 @@
+"""
+Zobrist hashing and a fixed-size transposition table for the whole-board
+search.
+
+Positions are hashed under all 8 symmetries of the board at once (a rotation
+or reflection moves the meta-board and every sub-board the same way), and the
+smallest of the 8 keys is used.  One table entry therefore serves every
+symmetric variant of a position; best moves are stored in that canonical frame
+and mapped back on lookup.
+"""
+import random
+from array import array
+
+EXACT, LOWER, UPPER = 0, 1, 2
+NO_MOVE = 127
+
+
+def _compose(first, then):
+    return tuple(then[first[i]] for i in range(9))
+
+
+_ROTATE = (2, 5, 8, 1, 4, 7, 0, 3, 6)
+_FLIP = (2, 1, 0, 5, 4, 3, 8, 7, 6)
+_IDENTITY = tuple(range(9))
+
+# SYMMETRIES[s][i] is where cell i of a 3x3 grid lands under symmetry s.
+SYMMETRIES = []
+for _base in (_IDENTITY, _FLIP):
+    _perm = _base
+    for _ in range(4):
+        SYMMETRIES.append(_perm)
+        _perm = _compose(_perm, _ROTATE)
+SYMMETRIES = tuple(SYMMETRIES)
+INVERSES = tuple(tuple(perm.index(i) for i in range(9)) for perm in SYMMETRIES)
+
+_rng = random.Random(0x5EED)
+_CELL_KEYS = [[_rng.getrandbits(64) for _ in range(81)] for _ in range(2)]
+_ACTIVE_KEYS = [_rng.getrandbits(64) for _ in range(10)]
+TURN_KEY = _rng.getrandbits(64)
+
+# CELL_KEYS[symbol][main * 9 + sub][s] and ACTIVE_KEYS[active or 9][s] are the
+# keys of a cell or active board after applying symmetry s.
+CELL_KEYS = tuple(
+    tuple(tuple(_CELL_KEYS[symbol][perm[cell // 9] * 9 + perm[cell % 9]] for perm in SYMMETRIES)
+          for cell in range(81))
+    for symbol in range(2))
+ACTIVE_KEYS = tuple(tuple(_ACTIVE_KEYS[perm[i]] for perm in SYMMETRIES) for i in range(9)) + \
+    ((_ACTIVE_KEYS[9],) * 8,)
+
+
+class PositionHash:
+    "Zobrist hashes of the stones of a position under each symmetry."
+
+    def __init__(self, engine):
+        self.hashes = [0] * 8
+        for main_index in range(9):
+            for sub_index in range(9):
+                symbol = engine.cell(main_index, sub_index)
+                if symbol != ' ':
+                    self.toggle(main_index, sub_index, symbol)
+
+    def toggle(self, main_index, sub_index, symbol):
+        "Adds or removes a stone; the same call undoes itself."
+        keys = CELL_KEYS[0 if symbol == 'X' else 1][main_index * 9 + sub_index]
+        self.hashes = [h ^ k for h, k in zip(self.hashes, keys)]
+
+    def key(self, engine):
+        """
+        Returns (key, symmetry) for the canonical form of the position,
+        including the active board and side to move.
+        """
+        active = ACTIVE_KEYS[9 if engine.active is None else engine.active]
+        turn = TURN_KEY if engine.turn == 'O' else 0
+        keys = [h ^ a ^ turn for h, a in zip(self.hashes, active)]
+        best = min(keys)
+        return best, keys.index(best)
+
+
+def to_canonical(move, symmetry):
+    perm = SYMMETRIES[symmetry]
+    return perm[move[0]], perm[move[1]]
+
+
+def from_canonical(move, symmetry):
+    perm = INVERSES[symmetry]
+    return perm[move[0]], perm[move[1]]
+
+
+class TranspositionTable:
+    """
+    Fixed-size table of search results.  Entries live in two-slot buckets:
+    the first slot keeps the deepest result seen (depth-preferred) and the
+    second always takes the newest, so shallow entries cannot evict deep ones
+    while recent positions still get cached.
+    """
+    ENTRY_BYTES = 16
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        size = 2
+        while size * 2 * self.ENTRY_BYTES <= max_bytes:
+            size *= 2
+        self.size = size
+        self.keys = array('Q', bytes(8 * size))
+        self.values = array('q', bytes(8 * size))
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.replacements = 0
+        self.used = 0
+
+    def clear(self):
+        self.keys = array('Q', bytes(8 * self.size))
+        self.values = array('q', bytes(8 * self.size))
+        self.probes = self.hits = self.stores = self.replacements = self.used = 0
+
+    def probe(self, key):
+        "Returns (depth, flag, score, move) for the canonical key, or None."
+        self.probes += 1
+        key |= 1
+        slot = key & (self.size - 2)
+        for i in (slot, slot + 1):
+            if self.keys[i] == key:
+                self.hits += 1
+                value = self.values[i]
+                cell = value & 0x7F
+                move = None if cell == NO_MOVE else divmod(cell, 9)
+                return (value >> 9) & 0x7F, (value >> 7) & 0x3, value >> 16, move
+        return None
+
+    def store(self, key, depth, flag, score, move):
+        self.stores += 1
+        key |= 1
+        cell = NO_MOVE if move is None else move[0] * 9 + move[1]
+        value = score << 16 | depth << 9 | flag << 7 | cell
+        slot = key & (self.size - 2)
+        keys, values = self.keys, self.values
+        if keys[slot] == key or not keys[slot]:
+            target = slot
+        elif keys[slot + 1] == key:
+            target = slot + 1
+        elif depth >= (values[slot] >> 9) & 0x7F:
+            # Demote the shallower entry to the always-replace slot.
+            if not keys[slot + 1]:
+                self.used += 1
+            else:
+                self.replacements += 1
+            keys[slot + 1], values[slot + 1] = keys[slot], values[slot]
+            keys[slot], values[slot] = key, value
+            return
+        else:
+            target = slot + 1
+        if not keys[target]:
+            self.used += 1
+        elif keys[target] != key:
+            self.replacements += 1
+        keys[target], values[target] = key, value
+
+    @property
+    def memory_bytes(self):
+        return self.keys.itemsize * len(self.keys) + self.values.itemsize * len(self.values)
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def stats(self):
+        return {
+            'entries': self.size,
+            'used': self.used,
+            'fill_rate': self.used / self.size,
+            'memory_bytes': self.memory_bytes,
+            'probes': self.probes,
+            'hits': self.hits,
+            'hit_rate': self.hit_rate,
+            'stores': self.stores,
+            'replacements': self.replacements,
+        }
@@ -15,6 +15,8 @@ urlpatterns = [
     path('single/', views.single_player, name='single_player'),
     path('index/', views.index, name='index'),
     path('profile/', views.profile, name='profile'),
+    path('leaderboard/', views.leaderboard, name='leaderboard'),
+    path('api/leaderboard/', views.leaderboard_api, name='leaderboard_api'),
     # Classic game view
     path('<int:pk>/', views.game, name='detail'),
 
@@ -24,4 +26,7 @@ urlpatterns = [
     path('multi/join/', views.join_multiplayer, name='join_multiplayer'),  # Join room
     path('multi/game/<int:game_id>/', views.multiplayer_game_view, name='multiplayer_game'),  # Multiplayer game page
 
+    # Metrics
+    path('metrics/ai/', views.ai_metrics, name='ai_metrics'),
+
 ]
\ No newline at end of file
@@ -1,11 +1,13 @@
-import random
-import string
+from datetime import datetime, timedelta, timezone as dt_timezone
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import logout
 from django.contrib.auth.forms import UserCreationForm
 from django.views.decorators.http import require_http_methods
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
-from .models import Game, GameHistory
+from .models import Game, GameResult, PlayerStats, retry_on_conflict
 from django.db.models import Q
 from django.utils import timezone
 
@@ -13,53 +15,87 @@ from django.http import JsonResponse
 
 from .forms import NewGameForm, PlayForm
 from .models import Game
+from .lobby import open_room
+from .ratings import MULTIPLAYER, get_leaderboard, pool_label
+from .results import record_game_result
 
 
 # ======================= Main Menu Views =======================
 
+DEFAULT_PROFILE_PAGE_SIZE = 20
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def history_cursor(result):
+    "Where the history page after ``result`` starts: its date (in microseconds) and id."
+    return f"{(result.date_played - EPOCH) // timedelta(microseconds=1)}.{result.pk}"
+
+
+def parse_history_cursor(cursor):
+    try:
+        microseconds, pk = cursor.split('.')
+        return EPOCH + timedelta(microseconds=int(microseconds)), int(pk)
+    except (ValueError, OverflowError):
+        return None
+
+
 @login_required
 def profile(request):
     sort_order = request.GET.get('sort', 'desc')
-    if sort_order == 'asc':
-        history_queryset = GameHistory.objects.filter(user=request.user).order_by('date_played')
-    else:
-        history_queryset = GameHistory.objects.filter(user=request.user).order_by('-date_played')
-
-
-    seen = set()
-    deduped_history = []
-    for game in history_queryset:
-        key = (
-            (game.opponent or '').lower(),
-            game.mode,
-            game.result,
-            game.date_played.strftime('%Y%m%d%H%M'),  # round to minute
-            game.game_identifier
-        )
-        if key not in seen:
-            seen.add(key)
-            deduped_history.append(game)
-
-
-    stats = {
-        'total': len(deduped_history),
-        'wins': sum(1 for g in deduped_history if g.result == 'win'),
-        'losses': sum(1 for g in deduped_history if g.result == 'loss'),
-        'draws': sum(1 for g in deduped_history if g.result == 'draw'),
-    }
-    stats['win_rate'] = round((stats['wins'] / stats['total']) * 100, 1) if stats['total'] > 0 else 0
+    descending = sort_order != 'asc'
+    history = GameResult.objects.for_user(request.user)
+
+    # Pages follow each other by (date_played, id), so a page costs the same
+    # however far into the history it is.
+    after = parse_history_cursor(request.GET.get('after', ''))
+    if after:
+        date_played, pk = after
+        if descending:
+            history = history.filter(Q(date_played__lt=date_played) | Q(date_played=date_played, id__lt=pk))
+        else:
+            history = history.filter(Q(date_played__gt=date_played) | Q(date_played=date_played, id__gt=pk))
+    order = ('-date_played', '-id') if descending else ('date_played', 'id')
+    page_size = getattr(settings, 'PROFILE_PAGE_SIZE', DEFAULT_PROFILE_PAGE_SIZE)
+    page = list(history.order_by(*order)[:page_size + 1])
+    next_cursor = history_cursor(page[page_size - 1]) if len(page) > page_size else None
+
+    stats = PlayerStats.objects.filter(user=request.user).first() or PlayerStats(user=request.user)
 
     return render(request, 'game/profile.html', {
-        'history': deduped_history,
-        'total_games': stats['total'],
-        'wins': stats['wins'],
-        'losses': stats['losses'],
-        'draws': stats['draws'],
-        'win_rate': stats['win_rate'],
+        'history': page[:page_size],
+        'next_cursor': next_cursor,
+        'paged': after is not None,
+        'total_games': stats.games,
+        'wins': stats.wins,
+        'losses': stats.losses,
+        'draws': stats.draws,
+        'win_rate': stats.win_rate,
         'sort_order': sort_order,
     })
 
 
+def leaderboard_data(request):
+    board = get_leaderboard()
+    pool = request.GET.get('pool', MULTIPLAYER)
+    pools = board.pools()
+    if pool not in pools:
+        pool = MULTIPLAYER
+    return {
+        'pool': pool,
+        'pools': [{'pool': name, 'label': pool_label(name)} for name in pools],
+        'entries': board.top(pool),
+        'me': board.rank(request.user, pool) if request.user.is_authenticated else None,
+    }
+
+
+def leaderboard(request):
+    return render(request, 'game/leaderboard.html', leaderboard_data(request))
+
+
+def leaderboard_api(request):
+    return JsonResponse(leaderboard_data(request))
+
+
 def main_menu(request):
     return render(request, 'game/main_menu.html')
 
@@ -91,7 +127,7 @@ def index(request):
         difficulty = request.POST.get("difficulty")
         if difficulty:
             player_x = request.user.username if request.user.is_authenticated else "Guest"
-            game = Game.objects.create(
+            game = Game(
                 player_x=player_x,
                 player_o=difficulty,  # Use selected difficulty e.g. 'random' or 'minimax'
                 board=" " * 9,
@@ -102,13 +138,12 @@ def index(request):
             )
             game.create_subgames()
             game.play_auto()
-            game.save()
             return redirect(game)
 
         form = NewGameForm(request.POST)
         if form.is_valid():
             player_x = request.user.username if request.user.is_authenticated else "Guest"
-            game = Game.objects.create(
+            game = Game(
                 player_x=player_x,
                 player_o='random',  # default AI opponent
                 board=" " * 9,
@@ -119,7 +154,6 @@ def index(request):
             )
             game.create_subgames()
             game.play_auto()
-            game.save()
             return redirect(game)
     else:
         form = NewGameForm()
@@ -128,42 +162,34 @@ def index(request):
 
 # ======================= Multiplayer Views =======================
 
+# Seconds added to a player's clock after each of their moves.
+INCREMENT_CHOICES = (0, 2, 5, 10, 30)
+
+
 def multiplayer(request):
     return render(request, 'game/multiplayer.html', {
-        'time_choices': range(1, 11)
+        'time_choices': range(1, 11),
+        'increment_choices': INCREMENT_CHOICES,
     })
 
 
-def generate_unique_room_code():
-    while True:
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        if not Game.objects.filter(room_code=code).exists():
-            return code
-
-
 def create_multiplayer(request):
     if request.method == "POST":
-        code = generate_unique_room_code()
-
         try:
             time_per_player = int(request.POST.get("time", 5))
             if not 1 <= time_per_player <= 10:
                 raise ValueError
+            increment = int(request.POST.get("increment", 0))
+            if increment not in INCREMENT_CHOICES:
+                raise ValueError
         except (ValueError, TypeError):
             return render(request, 'game/multiplayer.html', {
                 'time_choices': range(1, 11),
+                'increment_choices': INCREMENT_CHOICES,
                 'error': "Invalid time value. Please choose between 1 and 10 minutes."
             })
 
-        game = Game.objects.create(
-            room_code=code,
-            player_x=None,
-            player_o=None,
-            board=" " * 9,
-            time_x=time_per_player * 60,
-            time_o=time_per_player * 60,
-        )
-        return redirect('game:multiplayer_game', game_id=game.id)
+        return redirect('game:multiplayer_game', game_id=open_room(time_per_player, increment))
 
     return redirect('game:multiplayer')
 
@@ -171,146 +197,128 @@ def create_multiplayer(request):
 def join_multiplayer(request):
     if request.method == "POST":
         code = request.POST.get('code', '').strip().upper()
-        game = Game.objects.filter(room_code=code).first()
+        game = Game.objects.filter(room_code=code, pooled=False).first()
         if game and (not game.player_x or not game.player_o):
             return redirect('game:multiplayer_game', game_id=game.id)
+        elif game:
+            # A full room is watched.
+            return redirect(reverse('game:multiplayer_game', kwargs={'game_id': game.id}) + '?watch=1')
         else:
             return render(request, 'game/multiplayer.html', {
                 'time_choices': range(1, 11),
-                'error': '❌ Invalid code or room is full.'
+                'increment_choices': INCREMENT_CHOICES,
+                'error': '❌ Invalid code.'
             })
     return redirect('game:multiplayer')
 
 
 def multiplayer_game_view(request, game_id):
-    game = get_object_or_404(Game, id=game_id)
+    game = get_object_or_404(Game, id=game_id, pooled=False)
     return render(request, 'game/multi_player_board.html', {
         'game': game,
         'room_code': game.room_code,
-        'my_player': request.user.username if request.user.is_authenticated else "Guest"
+        'my_player': request.user.username if request.user.is_authenticated else "Guest",
+        'spectating': request.GET.get('watch') == '1',
     })
 
 
 # ======================= Classic Game View =======================
 
 @require_http_methods(["GET", "POST"])
-def game(request, pk):
+def surrender_game(request, pk):
+    game = get_object_or_404(Game, pk=pk)
+    if game.winner:
+        return
+    current_username = request.user.username if request.user.is_authenticated else "Guest"
+    user_symbol = 'X' if game.player_x == current_username else 'O'
+    ai_symbol = 'O' if user_symbol == 'X' else 'X'
+
+    def surrender(game):
+        # A move may have ended the game meanwhile.
+        if game.winner:
+            return None
+        game.winner = ai_symbol
+        game.save_changes()
+        return game
+
+    surrendered = retry_on_conflict(game, surrender)
+    if surrendered:
+        surrendered.stop_pondering()
+        if request.user.is_authenticated:
+            record_game_result(surrendered, surrendered.winner)
+
+
+def play_user_move(request, pk, main_index, sub_index):
+    "Plays the user's move; returns the game and whether the move was played."
     game = get_object_or_404(Game, pk=pk)
+    if game.winner:
+        return game, False
+    current_username = request.user.username if request.user.is_authenticated else "Guest"
+    player_symbol = 'X' if game.player_x == current_username else 'O'
+    try:
+        game.play(main_index, sub_index, player_symbol)
+    except Exception as e:
+        print("Error during move:", e)
+        return game, False
+    return game, True
 
-    if request.method == "POST" and request.POST.get("surrender") == "1":
-        if not game.winner:
-
-            current_username = request.user.username if request.user.is_authenticated else "Guest"
-            user_symbol = 'X' if game.player_x == current_username else 'O'
-            ai_symbol = 'O' if user_symbol == 'X' else 'X'
-            game.winner = ai_symbol
-            game.save()
-
-            from django.contrib.auth.models import User
-            if request.user.is_authenticated:
-                for uname in [game.player_x, game.player_o]:
-                    if not uname:
-                        continue
-                    if uname.lower() in ['random', 'minimax', 'computer']:
-                        continue
-                    try:
-                        user_obj = User.objects.get(username=uname)
-                    except User.DoesNotExist:
-                        continue
-                    symbol = 'X' if uname == game.player_x else 'O'
-                    if game.winner in ['draw', ' ']:
-                        result = 'draw'
-                    elif game.winner == symbol:
-                        result = 'win'
-                    else:
-                        result = 'loss'
-                    opponent = game.player_o if uname == game.player_x else game.player_x
-                    if opponent and opponent.lower() in ['random', 'minimax', 'computer']:
-                        opponent = "Computer"
-                    if not GameHistory.objects.filter(
-                            user=user_obj,
-                            opponent=opponent,
-                            mode=('single' if opponent == "Computer" else 'multi'),
-                            date_played__gte=game.date_created
-                    ).exists():
-                        GameHistory.objects.create(
-                            user=user_obj,
-                            opponent=opponent,
-                            mode=('single' if opponent == "Computer" else 'multi'),
-                            result=result
-                        )
 
+def render_game(request, pk):
+    game = get_object_or_404(Game, pk=pk)
+    context = {
+        'game': game,
+        'active_index': game.active_index,
+        'last_main_index': game.last_main_index,
+        'last_sub_index': game.last_sub_index,
+        'sub_game_0': game.get_sub_game(0),
+        'sub_game_1': game.get_sub_game(1),
+        'sub_game_2': game.get_sub_game(2),
+        'sub_game_3': game.get_sub_game(3),
+        'sub_game_4': game.get_sub_game(4),
+        'sub_game_5': game.get_sub_game(5),
+        'sub_game_6': game.get_sub_game(6),
+        'sub_game_7': game.get_sub_game(7),
+        'sub_game_8': game.get_sub_game(8),
+        'next_player': game.next_player,
+        'current_user': request.user.username if request.user.is_authenticated else 'Guest',
+    }
+    return render(request, "game/single_player_board.html", context)
+
+
+async def game(request, pk):
+    # Async, so the computer's reply is awaited on the move service
+    # (game.ai_service) instead of holding a request thread; the database
+    # work runs in sync_to_async.
+    if request.method == "POST" and request.POST.get("surrender") == "1":
+        await sync_to_async(surrender_game)(request, pk)
         return redirect('game:detail', pk=pk)
 
     if request.method == "POST" and not request.POST.get("surrender"):
         form = PlayForm(request.POST)
         if form.is_valid():
-            main_index = form.cleaned_data['main_index']
-            sub_index = form.cleaned_data['sub_index']
-
-            if not game.winner:
-                current_username = request.user.username if request.user.is_authenticated else "Guest"
-                player_symbol = 'X' if game.player_x == current_username else 'O'
+            game, played = await sync_to_async(play_user_move)(
+                request, pk, form.cleaned_data['main_index'], form.cleaned_data['sub_index'])
+            if played:
                 try:
-                    game.play(main_index, sub_index, player_symbol)
-                    game.play_auto()
+                    await game.play_auto_async()
                 except Exception as e:
                     print("Error during move:", e)
 
-
             if game.winner:
-                from django.contrib.auth.models import User
-                for uname in [game.player_x, game.player_o]:
-                    if not uname:
-                        continue
-                    if uname.lower() in ['random', 'minimax', 'computer']:
-                        continue
-                    try:
-                        user_obj = User.objects.get(username=uname)
-                    except User.DoesNotExist:
-                        continue
-                    symbol = 'X' if uname == game.player_x else 'O'
-                    if game.winner in ['draw', ' ']:
-                        result = 'draw'
-                    elif game.winner == symbol:
-                        result = 'win'
-                    else:
-                        result = 'loss'
-                    opponent = game.player_o if uname == game.player_x else game.player_x
-                    if opponent and opponent.lower() in ['random', 'minimax', 'computer']:
-                        opponent = "Computer"
-                    if not GameHistory.objects.filter(
-                            user=user_obj,
-                            opponent=opponent,
-                            mode=('single' if opponent == "Computer" else 'multi'),
-                            date_played__gte=game.date_created
-                    ).exists():
-                        GameHistory.objects.create(
-                            user=user_obj,
-                            opponent=opponent,
-                            mode=('single' if opponent == "Computer" else 'multi'),
-                            result=result
-                        )
+                record_game_result(game, game.winner)
             return redirect('game:detail', pk=pk)
 
-    context = {
-        'game': game,
-        'active_index': game.active_index,
-        'last_main_index': game.last_main_index,
-        'last_sub_index': game.last_sub_index,
-        'sub_game_0': game.sub_games.filter(index=0).first(),
-        'sub_game_1': game.sub_games.filter(index=1).first(),
-        'sub_game_2': game.sub_games.filter(index=2).first(),
-        'sub_game_3': game.sub_games.filter(index=3).first(),
-        'sub_game_4': game.sub_games.filter(index=4).first(),
-        'sub_game_5': game.sub_games.filter(index=5).first(),
-        'sub_game_6': game.sub_games.filter(index=6).first(),
-        'sub_game_7': game.sub_games.filter(index=7).first(),
-        'sub_game_8': game.sub_games.filter(index=8).first(),
-        'next_player': game.next_player,
-        'current_user': request.user.username if request.user.is_authenticated else 'Guest',
-    }
-    return render(request, "game/single_player_board.html", context)
+    return await sync_to_async(render_game)(request, pk)
+
+
+# ======================= AI Metrics View =======================
+
+def ai_metrics(request):
+    from .ai_service import table_stats
+    from .ponder import get_ponderer
+    from .scheduler import get_scheduler
+    return JsonResponse({'scheduler': get_scheduler().stats(), 'ponder': get_ponderer().stats(),
+                         'tables': table_stats()})
 
 
 # ======================= Sign Up View =======================
@@ -356,51 +364,7 @@ def register_multiplayer_result(request):
 
         try:
             game = Game.objects.get(room_code=room_code)
-            from django.contrib.auth.models import User
-
-            # Get the actual player usernames based on symbols
-            if winner_symbol == 'draw':
-
-                for player_username, opponent_username in [(game.player_x, game.player_o),
-                                                           (game.player_o, game.player_x)]:
-                    if not player_username:
-                        continue
-                    try:
-                        user_obj = User.objects.get(username=player_username)
-                        GameHistory.objects.create(
-                            user=user_obj,
-                            opponent=opponent_username if opponent_username else "Unknown",
-                            mode='multi',
-                            result='draw',
-                            game_identifier=room_code  # Use room_code as unique identifier
-                        )
-                    except User.DoesNotExist:
-                        continue
-            else:
-                # Handle win/loss case
-                # Map symbols to actual usernames
-                winner_username = game.player_x if winner_symbol == 'X' else game.player_o
-                loser_username = game.player_o if winner_symbol == 'X' else game.player_x
-
-                # Create records for both winner and loser
-                for username, result, opponent in [
-                    (winner_username, 'win', loser_username),
-                    (loser_username, 'loss', winner_username)
-                ]:
-                    if not username:
-                        continue
-                    try:
-                        user_obj = User.objects.get(username=username)
-                        GameHistory.objects.create(
-                            user=user_obj,
-                            opponent=opponent if opponent else "Unknown",
-                            mode='multi',
-                            result=result,
-                            game_identifier=room_code  # Use room_code as unique identifier
-                        )
-                    except User.DoesNotExist:
-                        continue
-
+            record_game_result(game, winner_symbol)
             return HttpResponse("OK")
         except Exception as e:
             return HttpResponse(f"Error: {e}", status=400)
@@ -12,8 +12,11 @@ setup(
         'tictactoe',
         'game',
         'game.tests',
-        'game.migrations'
+        'game.migrations',
+        'game.management',
+        'game.management.commands',
     ],
+    package_data={'game': ['data/*.bin']},
     url='https://github.com/paulcwatts/django-tictactoe',
     license='BSD',
     author='Paul Watts',
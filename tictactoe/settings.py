@@ -123,6 +123,97 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Moves between two snapshots of a game row; the moves in between are only
+# appended to the move log (game.models.Move) and replayed when a game loads.
+GAME_SNAPSHOT_EVERY = 8
+
+# Where multiplayer rooms keep their live state (game.room_backends).  To
+# serve the same rooms from several processes, use
+# 'game.room_backends.RedisRoomBackend' together with the channels_redis
+# channel layer above.
+ROOM_STATE_BACKEND = 'game.room_backends.MemoryRoomBackend'
+ROOM_STATE_REDIS_URL = 'redis://localhost:6379/0'
+
+# Room changes are written to the database at most this many seconds later
+# by the process holding the room's lease, which another process takes over
+# once it has not been renewed for ROOM_LEASE_TIMEOUT seconds (game.rooms).
+# A batch that fails to write is tried by the next ROOM_FLUSH_RETRIES
+# flushes before the room is loaded again from the database.
+ROOM_FLUSH_INTERVAL = 1.0
+ROOM_LEASE_TIMEOUT = 10.0
+ROOM_FLUSH_RETRIES = 3
+
+# Room codes are a keyed permutation of a sequence, of which each process
+# reserves ROOM_CODE_BLOCK numbers at a time; ROOM_CODE_KEY defaults to one
+# derived from SECRET_KEY.  Each process keeps ROOM_POOL_SIZE rooms made
+# ahead of time, so opening one is a single update (game.lobby); 0 makes
+# each room as it is opened.
+ROOM_CODE_BLOCK = 100
+ROOM_POOL_SIZE = 0
+
+# Clients count the clocks down themselves, to the deadline sent with each
+# move, and check their clock against the server's this often (seconds).
+CLOCK_RESYNC_INTERVAL = 60
+
+# Finished games are written to the players' history off the request path,
+# in batches of at most RESULT_BATCH_SIZE results, each waiting at most
+# RESULT_FLUSH_INTERVAL seconds for others to join it (game.results).  A
+# batch that fails is queued again after RESULT_RETRY_DELAY seconds, up to
+# RESULT_WRITE_ATTEMPTS writes of each result.
+RESULT_BATCH_SIZE = 100
+RESULT_FLUSH_INTERVAL = 0.5
+RESULT_WRITE_ATTEMPTS = 5
+RESULT_RETRY_DELAY = 1.0
+
+# Games shown per page of the profile's history.
+PROFILE_PAGE_SIZE = 20
+
+# Elo ratings and leaderboards (game.ratings).
+RATING_K = 32
+LEADERBOARD_SIZE = 100
+LEADERBOARD_REFRESH = 60
+
+# Room affinity (game.affinity): each room is served by one of these workers,
+# name -> base URL such as 'ws://10.0.0.1:8001', picked by consistent
+# hashing of its code.  Other workers forward its sockets there, or redirect
+# the client with ROOM_AFFINITY_MODE = 'redirect'.  Empty: every worker serves
+# every room.  Change the membership of running workers with
+# ``manage.py rebalance_rooms``.  Forwarded sockets are signed with
+# ROOM_FORWARD_KEY, which every worker must share; it defaults to one derived
+# from SECRET_KEY.
+ROOM_WORKERS = {}
+ROOM_WORKER_NAME = os.environ.get('ROOM_WORKER_NAME', '')
+ROOM_AFFINITY_MODE = 'forward'
+
+# Memory budget of the transposition table each worker process keeps for the
+# whole-board AI (game.players.UltimatePlayer).
+AI_TRANSPOSITION_TABLE_BYTES = 16 * 1024 * 1024
+
+# Worker processes computing AI moves off the request thread (0 computes them
+# in-process), and the seconds a move may take before falling back to the
+# GoodPlayer reply.
+AI_SERVICE_WORKERS = 2
+AI_MOVE_TIMEOUT = 2.0
+
+# Concurrent AI moves across all games (defaults to AI_SERVICE_WORKERS), the
+# backlog beyond which moves are answered by the fallback player, and the
+# floor the per-move think time shrinks to under load.
+AI_SCHEDULER_SLOTS = None
+AI_SCHEDULER_MAX_QUEUE = 100
+AI_MIN_THINK_TIME = 0.05
+
+# Search the AI's answers to the likeliest human replies while the human is
+# thinking (game.ponder): replies per position, searches at once across all
+# games (each in a process of its own, apart from AI_SERVICE_WORKERS), games
+# that keep a cache, seconds per search, and seconds before an idle game's
+# cache is dropped.
+AI_PONDER = True
+AI_PONDER_MOVES = 8
+AI_PONDER_MAX_JOBS = 1
+AI_PONDER_MAX_GAMES = 100
+AI_PONDER_THINK_TIME = 1.0
+AI_PONDER_TTL = 600
+
 
 try:
     from .local_settings import *